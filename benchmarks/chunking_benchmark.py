@@ -0,0 +1,91 @@
+"""Compares serial and process-pool chunking on a synthetic many-layer stage.
+
+    python -m usdchat.benchmarks.chunking_benchmark --layers 200 --workers 8
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from usdchat.utils.chunk_ascii_files import (iter_files_to_chunks,
+                                             resolve_chunking_workers)
+
+
+def write_synthetic_stage(directory, layers, prims_per_layer, points_per_mesh):
+    """Writes a root layer that sublayers `layers` generated USDA layers."""
+    rng = random.Random(0)
+    layer_paths = []
+    for layer_idx in range(layers):
+        lines = ["#usda 1.0", "", f'def Xform "Layer_{layer_idx}"', "{"]
+        for prim_idx in range(prims_per_layer):
+            points = ", ".join(
+                f"({rng.random():.4f}, {rng.random():.4f}, {rng.random():.4f})"
+                for _ in range(points_per_mesh)
+            )
+            lines += [
+                f'    def Mesh "Mesh_{prim_idx}" (',
+                '        kind = "component"',
+                "    )",
+                "    {",
+                f"        point3f[] points = [{points}]",
+                '        uniform token purpose = "render"',
+                "        rel material:binding = </Looks/Default>",
+                "    }",
+            ]
+        lines.append("}")
+        path = os.path.join(directory, f"layer_{layer_idx}.usda")
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        layer_paths.append(path)
+
+    sublayers = ",\n        ".join(
+        f"@./{os.path.basename(path)}@" for path in layer_paths)
+    with open(os.path.join(directory, "root.usda"), "w") as f:
+        f.write(f"#usda 1.0\n(\n    subLayers = [\n        {sublayers}\n    ]\n)\n")
+    return layer_paths
+
+
+def time_chunking(files, workers):
+    start = time.perf_counter()
+    order = [
+        (chunk.source, chunk.start_line)
+        for chunk in iter_files_to_chunks(files, workers=workers)
+    ]
+    return time.perf_counter() - start, order
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--layers", type=int, default=200)
+    parser.add_argument("--prims", type=int, default=200)
+    parser.add_argument("--points", type=int, default=64)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Process count for the parallel run, 0 uses one per CPU",
+    )
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="usdchat_chunking_benchmark_")
+    try:
+        files = write_synthetic_stage(
+            directory, args.layers, args.prims, args.points)
+        workers = resolve_chunking_workers(args.workers, len(files))
+
+        serial_time, serial_order = time_chunking(files, workers=1)
+        parallel_time, parallel_order = time_chunking(files, workers=workers)
+        assert serial_order == parallel_order, "parallel chunk order differs"
+
+        print(f"layers: {len(files)}, chunks: {len(serial_order)}")
+        print(f"serial:              {serial_time:.2f}s")
+        print(f"parallel ({workers:>2} procs): {parallel_time:.2f}s")
+        print(f"speedup:             {serial_time / parallel_time:.2f}x")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Compares prim traversal against composition queries for layer discovery.
+
+    python -m usdchat.benchmarks.layer_discovery_benchmark --layers 50 --prims 20000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from pxr import Sdf, Usd
+
+from usdchat.utils.resolve_stage_layers import (
+    collect_all_layer_paths, collect_all_layer_paths_by_traversal)
+
+
+def write_synthetic_stage(directory, layers, prims_per_layer):
+    """Writes a root layer referencing `layers` assets, each with a flat
+    hierarchy of prims_per_layer Xforms, and returns the root layer path."""
+    root_layer = Sdf.Layer.CreateNew(os.path.join(directory, "root.usda"))
+    with Sdf.ChangeBlock():
+        for layer_idx in range(layers):
+            asset_path = os.path.join(directory, f"asset_{layer_idx}.usdc")
+            asset_layer = Sdf.Layer.CreateNew(asset_path)
+            asset_root = Sdf.CreatePrimInLayer(asset_layer, "/Asset")
+            asset_root.specifier = Sdf.SpecifierDef
+            asset_root.typeName = "Xform"
+            for prim_idx in range(prims_per_layer):
+                prim = Sdf.PrimSpec(asset_root, f"Prim_{prim_idx}",
+                                    Sdf.SpecifierDef, "Xform")
+                prim.kind = "component"
+            asset_layer.defaultPrim = "Asset"
+            asset_layer.Save()
+
+            instance = Sdf.CreatePrimInLayer(
+                root_layer, f"/World/Asset_{layer_idx}")
+            instance.specifier = Sdf.SpecifierDef
+            instance.referenceList.Prepend(Sdf.Reference(asset_path))
+        root_layer.GetPrimAtPath("/World").specifier = Sdf.SpecifierDef
+    root_layer.Save()
+    return root_layer.realPath
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--layers", type=int, default=50)
+    parser.add_argument("--prims", type=int, default=20000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="usdchat_discovery_benchmark_")
+    try:
+        root_path = write_synthetic_stage(directory, args.layers, args.prims)
+        stage = Usd.Stage.Open(root_path)
+
+        traversal_time, traversal_paths = timed(
+            collect_all_layer_paths_by_traversal, stage
+        )
+        composition_time, composition_paths = timed(
+            collect_all_layer_paths, stage
+        )
+        missing = traversal_paths - composition_paths - {""}
+        assert not missing, f"layers missed by composition query: {missing}"
+
+        print(f"layers: {len(composition_paths)}, prims: {args.layers * args.prims}")
+        print(f"prim traversal:    {traversal_time:.3f}s")
+        print(f"composition query: {composition_time:.3f}s")
+        print(f"speedup:           {traversal_time / composition_time:.1f}x")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
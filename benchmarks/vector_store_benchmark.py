@@ -0,0 +1,113 @@
+"""Compares the ChromaDB and NumPy vector stores on random normalized vectors.
+
+The numpy store is also run with float16 and int8 quantization, with and
+without full precision reranking, to show memory saved against recall lost.
+
+    python -m usdchat.benchmarks.vector_store_benchmark --sizes 10000 100000
+"""
+import argparse
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from usdchat.services.numpy_vector_store import NumpyVectorStore
+from usdchat.services.vector_store import ChromaVectorStore
+
+
+def random_vectors(rng, count, dimensions):
+    vectors = rng.standard_normal((count, dimensions)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def open_stores(directory, rerank_factor):
+    stores = {"numpy": NumpyVectorStore(f"{directory}/numpy")}
+    for quantization in ("float16", "int8"):
+        stores[quantization] = NumpyVectorStore(
+            f"{directory}/{quantization}",
+            quantization=quantization,
+            rerank_factor=rerank_factor,
+        )
+        stores[f"{quantization}-norerank"] = NumpyVectorStore(
+            f"{directory}/{quantization}-norerank",
+            quantization=quantization,
+            rerank_factor=1,
+        )
+    try:
+        stores["chromadb"] = ChromaVectorStore(f"{directory}/chromadb")
+    except ImportError as e:
+        print(f"Skipping chromadb: {e}")
+    return stores
+
+
+def run_store(store, name, vectors, queries, k, batch_size):
+    collection = store.create_collection(
+        name=name, metadata={"hnsw:space": "cosine"})
+    ids = [str(idx) for idx in range(len(vectors))]
+    add_time = 0.0
+    for start in range(0, len(vectors), batch_size):
+        elapsed, _ = timed(
+            collection.add,
+            ids=ids[start: start + batch_size],
+            embeddings=vectors[start: start + batch_size].tolist(),
+        )
+        add_time += elapsed
+    query_time, result = timed(
+        collection.query,
+        query_embeddings=queries.tolist(),
+        n_results=k,
+        include=["distances"],
+    )
+    found = [[int(i) for i in row] for row in result["ids"]]
+    memory = getattr(collection, "nbytes", None)
+    return add_time, query_time, found, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dimensions", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=7)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    directory = tempfile.mkdtemp(prefix="usdchat_vector_store_benchmark_")
+    try:
+        stores = open_stores(directory, args.rerank_factor)
+        print(f"{'store':<18}{'vectors':>10}{'add s':>10}"
+              f"{'query ms':>10}{'MiB':>10}{'recall':>8}")
+        for size in args.sizes:
+            vectors = random_vectors(rng, size, args.dimensions)
+            queries = random_vectors(rng, args.queries, args.dimensions)
+            exact = np.argsort(-(queries @ vectors.T), axis=1)[:, : args.k]
+            for backend, store in stores.items():
+                add_time, query_time, found, memory = run_store(
+                    store, f"bench_{size}", vectors, queries, args.k,
+                    args.batch_size)
+                recall = np.mean([
+                    len(set(row) & set(truth.tolist())) / args.k
+                    for row, truth in zip(found, exact)
+                ])
+                memory = "-" if memory is None else f"{memory / 2**20:.1f}"
+                print(
+                    f"{backend:<18}{size:>10}{add_time:>10.2f}"
+                    f"{query_time * 1000 / args.queries:>10.3f}"
+                    f"{memory:>10}{recall:>8.3f}"
+                )
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
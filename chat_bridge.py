@@ -1,9 +1,20 @@
+import hashlib
+import json
 import logging
+import time
 
 from PySide6.QtCore import QObject, Signal
 
-from usdchat.services.chromadb_collections import ChromaDBCollections
-from usdchat.utils import chat_thread, embed_thread
+from usdchat.services.answer_cache import AnswerCache
+from usdchat.services.chromadb_collections import (ChromaDBCollections,
+                                                   layer_scope)
+from usdchat.services.query_cache import LRUCache
+from usdchat.utils import chat_thread, embed_thread, prefetch_thread
+from usdchat.utils.chunk_dedup import chunk_digest
+from usdchat.utils.context_builder import (context_separator,
+                                           context_token_budget,
+                                           select_context_chunks)
+from usdchat.utils.history_compactor import HistoryCompactor, is_tool_output
 
 logging.basicConfig(
     level=logging.WARNING,
@@ -11,6 +22,20 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def normalize_query_text(text):
+    return " ".join(text.lower().split())
+
+
+def format_context_chunk(document, metadata):
+    """Prefixes a retrieved chunk with where it came from."""
+    if not metadata:
+        return document
+    return (
+        f"# {metadata['layer']} lines {metadata['start_line']}-"
+        f"{metadata['end_line']} {metadata['prim_path']}\n{document}"
+    )
+
+
 class ChatBridge(QObject):
     signal_bot_response = Signal(str)
     signal_python_code_ready = Signal(str)
@@ -41,7 +66,36 @@ class ChatBridge(QObject):
         self.embed_threads = []
         self.conversation_manager = conversation_manager
         self.collection_name = collection_name
+        self.embed_options = {}
+        # Layers retrieval is limited to, None searches the whole collection
+        self.query_layers = None
         self.chromadb_collections = ChromaDBCollections(config=self.config)
+        self.history_compactor = HistoryCompactor(
+            self.chat_bot.model,
+            self.config.HISTORY_MAX_TOKENS,
+            self.config.HISTORY_SUMMARY_TOKENS,
+            self.config.HISTORY_TOOL_OUTPUT_TOKENS,
+        )
+        self.answer_cache = None
+        if self.config.ANSWER_CACHE:
+            self.answer_cache = AnswerCache(
+                self.config.ANSWER_CACHE_PATH,
+                self.config.ANSWER_CACHE_TTL,
+                self.config.ANSWER_CACHE_MAX_ENTRIES,
+            )
+        # Question of the answer being streamed, stored once it completes
+        self.pending_answer = None
+        self.prefetch_thread_instance = prefetch_thread
+        self.prefetch_threads = []
+        self.prefetch_thread = None
+        self.prefetch_results = LRUCache(self.config.PREFETCH_CACHE_SIZE)
+        self.prefetch_used = False
+        # Question and history waiting on its prefetch before being sent
+        self.pending_send = None
+        # Time to first token, seconds and count per kind of request
+        self.submit_time = None
+        self.first_token_label = None
+        self.first_token_stats = {}
 
     @property
     def conversation_manager(self):
@@ -59,13 +113,40 @@ class ChatBridge(QObject):
         elif user_input == "new session":
             self.conversation_manager.new_session()
 
-        messages = self.get_messages()
         self.conversation_manager.append_to_log(
             {"role": "user", "content": user_input})
+        self.submit_time = time.perf_counter()
+        self.prefetch_used = False
 
         if self.rag_mode:
+            cached_answer = self.get_cached_answer(user_input)
+            if cached_answer is not None:
+                self.signal_bot_response.emit(cached_answer)
+                self.on_bot_full_response(cached_answer)
+                return
+
+        messages = self.get_messages()
+        if self.rag_mode:
+            running = self.running_prefetch(user_input)
+            if running is not None:
+                # Send once the prefetch for this question lands instead of
+                # blocking the UI while it finishes.
+                self.pending_send = (user_input, messages)
+                running.finished.connect(self.on_prefetch_finished)
+                if not running.isRunning():
+                    self.on_prefetch_finished()
+                return
             messages = self.get_query_messages(user_input, messages)
+        self.send_messages(messages)
 
+    def on_prefetch_finished(self):
+        if self.pending_send is None:
+            return
+        user_input, messages = self.pending_send
+        self.pending_send = None
+        self.send_messages(self.get_query_messages(user_input, messages))
+
+    def send_messages(self, messages):
         self.chat_thread = self.chat_thread_instance.ChatThread(
             self.chat_bot,
             self.chat_widget,
@@ -74,9 +155,15 @@ class ChatBridge(QObject):
             config=self.config,
         )
         self.chat_threads.append(self.chat_thread)
+        self.chat_thread.finished.connect(self.clean_up_chat_threads)
         self.chat_thread.start()
 
         self.chat_thread.signal_bot_response.connect(self.signal_bot_response)
+        self.first_token_label = (
+            ("prefetched" if self.prefetch_used else "not prefetched")
+            if self.rag_mode else "no retrieval"
+        )
+        self.chat_thread.signal_bot_response.connect(self.on_bot_response_chunk)
         self.chat_thread.signal_bot_full_response.connect(
             self.on_bot_full_response)
 
@@ -84,39 +171,200 @@ class ChatBridge(QObject):
             self.on_python_execution_response
         )
 
+    def previous_turn(self):
+        """Digest of the exchange before the question just logged, None when
+        the question opens the conversation."""
+        turn = [
+            message for message in self.conversation_manager.conversation[:-1]
+            if message.get("role") != "system"
+        ][-2:]
+        if not turn:
+            return None
+        content = "\0".join(message.get("content") or "" for message in turn)
+        return hashlib.blake2b(
+            content.encode("utf-8"), digest_size=16).hexdigest()
+
+    def get_cached_answer(self, user_input):
+        """Looks up an earlier answer to a question like user_input against
+        the current collection version and search scope. Follow-up
+        questions only match ones asked after the same previous turn."""
+        self.pending_answer = None
+        if self.answer_cache is None or is_tool_output({"content": user_input}):
+            return None
+        version = self.chromadb_collections.collection_version(
+            self.collection_name)
+        scope = json.dumps(
+            {
+                "model": self.chat_bot.model,
+                "layers": (
+                    sorted(self.query_layers)
+                    if self.query_layers is not None else None
+                ),
+                "previous_turn": self.previous_turn(),
+            }
+        )
+        embedding = self.chromadb_collections.embed_queries([user_input])[0]
+        answer = self.answer_cache.lookup(
+            self.collection_name,
+            version,
+            scope,
+            embedding,
+            self.config.ANSWER_CACHE_SIMILARITY,
+        )
+        if answer is None:
+            self.pending_answer = (
+                self.collection_name, version, scope, user_input, embedding)
+        return answer
+
     def get_messages(self):
         messages = self.conversation_manager.load()
-        return messages
+        self.history_compactor.model = self.chat_bot.model
+        return self.history_compactor.compact(messages)
 
     def get_query_messages(self, user_input, messages):
         self.query_text = user_input
-        self.context = self.query_agent(self.query_text)
-
         prompt = [
             {
                 "role": "system",
                 "content": self.config.RAG_PROMPT,
             },
-            {"role": "user", "content": f"{self.query_text} {self.context}"},
+            {"role": "user", "content": f"{self.query_text}{context_separator}"},
         ]
+        token_budget = context_token_budget(
+            messages + prompt,
+            self.chat_bot.model,
+            self.config.MAX_TOKENS,
+            self.config.RAG_CONTEXT_MAX_TOKENS,
+            context_size=self.config.CONTEXT_WINDOW_TOKENS,
+        )
+        self.context = self.query_agent(
+            self.query_text, token_budget=token_budget)
+
+        if self.context:
+            prompt[1]["content"] += self.context
+        else:
+            prompt[1]["content"] = self.query_text
         messages.extend(prompt)
 
         return messages
 
-    def query_agent(self, query_text, n_results=7):
-        print(f"collection_name: {self.collection_name}")
-        query_results = self.chromadb_collections.query_collection(
+    def rag_candidates(self):
+        return (
+            self.config.RERANK_TOP_N
+            if self.config.RERANK else self.config.RAG_CANDIDATES
+        )
+
+    def prefetch_key(self, query_text, n_results, query_layers):
+        return (
+            self.collection_name,
+            self.chromadb_collections.collection_version(self.collection_name),
+            normalize_query_text(query_text),
+            n_results,
+            tuple(sorted(query_layers)) if query_layers is not None else None,
+        )
+
+    def retrieve(self, query_text, n_results, query_layers):
+        if self.config.HYBRID_RETRIEVAL:
+            return self.chromadb_collections.hybrid_query_collection(
+                self.collection_name,
+                query_text,
+                n_results=n_results,
+                where=layer_scope(query_layers),
+            )
+        return self.chromadb_collections.query_collection(
             collection_name=self.collection_name,
             query_texts=[query_text],
             n_results=n_results,
-            include=["documents"],
+            where=layer_scope(query_layers),
+            include=["documents", "metadatas"],
+        )
+
+    def prefetch(self, query_text, query_layers):
+        """Starts retrieving for text the user is still typing. A prefetch
+        for older text is cancelled, its results are never used."""
+        if (
+            not self.rag_mode
+            or not self.collection_name
+            or len(query_text) < self.config.PREFETCH_MIN_CHARACTERS
+            or (query_layers is not None and not query_layers)
+        ):
+            return
+        n_results = self.rag_candidates()
+        key = self.prefetch_key(query_text, n_results, query_layers)
+        running = self.prefetch_thread
+        if running is not None and running.isRunning():
+            if running.key == key:
+                return
+            running.stop()
+        if self.prefetch_results.get(key) is not None:
+            return
+        self.prefetch_thread = self.prefetch_thread_instance.PrefetchThread(
+            self.retrieve,
+            key,
+            query_text,
+            n_results,
+            query_layers,
+            self.prefetch_results,
         )
-        flat_list = [item for sublist in query_results["documents"]
-                     for item in sublist]
-        context = " ".join(flat_list)
+        self.prefetch_threads.append(self.prefetch_thread)
+        self.prefetch_thread.finished.connect(self.clean_up_prefetch_threads)
+        self.prefetch_thread.start()
+
+    def running_prefetch(self, query_text):
+        """The prefetch still retrieving for query_text, if any."""
+        running = self.prefetch_thread
+        if running is None or not running.isRunning():
+            return None
+        key = self.prefetch_key(
+            query_text, self.rag_candidates(), self.query_layers)
+        return running if running.key == key else None
+
+    def query_agent(self, query_text, n_results=None, token_budget=None):
+        """Retrieves chunks for query_text and joins as many as fit in
+        token_budget, best ranked first. Results prefetched while the
+        question was typed are used when there are any."""
+        print(f"collection_name: {self.collection_name}")
+        n_results = n_results or self.rag_candidates()
+        if token_budget is None:
+            token_budget = self.config.RAG_CONTEXT_MAX_TOKENS
+        if not token_budget:
+            logger.warning("No tokens left for context in this request.")
+            return ""
+        if self.query_layers is not None and not self.query_layers:
+            logger.warning("No embedded layers in the search scope.")
+            return ""
+        key = self.prefetch_key(query_text, n_results, self.query_layers)
+        query_results = self.prefetch_results.get(key)
+        self.prefetch_used = query_results is not None
+        if query_results is None:
+            query_results = self.retrieve(
+                query_text, n_results, self.query_layers)
+        ranked_chunks = [
+            (chunk_digest(document), format_context_chunk(document, metadata))
+            for documents, metadatas in zip(
+                query_results["documents"], query_results["metadatas"]
+            )
+            for document, metadata in zip(documents, metadatas)
+        ]
+        chunks, _ = select_context_chunks(
+            ranked_chunks, token_budget, self.chat_bot.model)
+        context = context_separator.join(chunks)
         logger.info(f"Context: {context}")
         return context
 
+    def on_bot_response_chunk(self, chunk):
+        if not chunk or self.submit_time is None:
+            return
+        seconds = time.perf_counter() - self.submit_time
+        self.submit_time = None
+        total, count = self.first_token_stats.get(self.first_token_label, (0.0, 0))
+        total, count = total + seconds, count + 1
+        self.first_token_stats[self.first_token_label] = (total, count)
+        logger.info(
+            f"Time to first token: {seconds:.3f}s ({self.first_token_label}), "
+            f"mean {total / count:.3f}s over {count}."
+        )
+
     def on_python_execution_response(self, python_output, success):
         self.conversation_manager.append_to_log(
             {
@@ -128,6 +376,13 @@ class ChatBridge(QObject):
     def on_bot_full_response(self, response):
         logger.info("on_bot_full_response: %s", response)
 
+        # Answers with code act on the stage, so only plain answers are reused.
+        if self.pending_answer is not None and response and (
+            "```python" not in response
+        ):
+            self.answer_cache.put(*self.pending_answer, response)
+        self.pending_answer = None
+
         if not self.standalone:
             if "```python" in response and "```" in response:
                 self.signal_python_code_ready.emit(response)
@@ -139,7 +394,11 @@ class ChatBridge(QObject):
 
     def embed_stage(self, stage_path):
         self.embed_thread = self.embed_thread_instance.EmbedThread(
-            stage_path, collection_name=self.collection_name, config=self.config)
+            stage_path,
+            collection_name=self.collection_name,
+            config=self.config,
+            **self.embed_options,
+        )
         self.embed_threads.append(self.embed_thread)
         self.embed_thread.start()
 
@@ -152,7 +411,18 @@ class ChatBridge(QObject):
         self.clean_up_thread()
         self.signal_embed_complete.emit(no_of_chunks)
 
+    def clean_up_prefetch_threads(self):
+        self.prefetch_threads = [
+            thread for thread in self.prefetch_threads if not thread.isFinished()
+        ]
+
+    def clean_up_chat_threads(self):
+        self.chat_threads = [
+            thread for thread in self.chat_threads if not thread.isFinished()
+        ]
+
     def clean_up_thread(self):
+        self.pending_send = None
         if self.chat_threads:
             last_thread = self.chat_threads[-1]
             last_thread.stop()
@@ -12,11 +12,104 @@ class Config:
     MODEL = "gpt-4"
     # MODEL = "gpt-3.5-turbo-0613"
     DB_PATH = "/tmp/chromadb.db"
+    # "chromadb" (HNSW) or "numpy" (exact search over an in-memory matrix)
+    VECTOR_STORE = "chromadb"
+    NUMPY_STORE_PATH = "/tmp/usdchat_numpy_store"
+    # "none", "float16" or "int8"; numpy store only, keeps compact vectors in
+    # memory and the full precision ones on disk for reranking
+    VECTOR_QUANTIZATION = "none"
+    # Quantized searches rerank n_results times this many candidates
+    QUANTIZED_RERANK_FACTOR = 4
+    COLLECTIONS_DATA_PATH = "/tmp/usdchat_collections"
     EMBEDDING_MODEL = "all-MiniLM-L6-v2"
     TOKENIZER_MODEL = "gpt-3.5-turbo-0613"
     MAX_EMBEDDING_TOKENS = 2000
+    # Tokens packed into one chunk, 0 packs up to the embedding model's
+    # max_seq_length so no part of a chunk is truncated away
+    CHUNK_TOKENS = 0
+    # "prim" packs whole USDA prims into chunks, "line" embeds every line
+    CHUNK_STRATEGY = "prim"
+    # Chunks read from the stream and embedded together, bounds peak memory
+    EMBEDDING_BATCH_SIZE = 512
+    # Upper bound on tokens per batch, the batch shrinks for long chunks
+    EMBEDDING_BATCH_TOKENS = 128 * 1024
+    # Times a failed batch is retried before embedding gives up
+    EMBEDDING_RETRIES = 2
+    # Batches buffered between the resolve, chunk, embed and write stages
+    EMBED_PIPELINE_QUEUE_SIZE = 4
+    # Processes used to chunk layer files, 0 uses one per CPU
+    CHUNKING_WORKERS = 0
+    # Threads exporting binary layers to USDA, 0 lets Python pick
+    LAYER_EXPORT_WORKERS = 0
+    # Converted layers are cached here between runs, defaults to a
+    # usdchat_layer_cache folder in WORKING_DIRECTORY
+    LAYER_CACHE_DIRECTORY = ""
+    LAYER_CACHE_MAX_BYTES = 20 * 1024**3
+    LAYER_CACHE_HASH_CONTENT = False
+    # Also embed layers behind unloaded payloads when discovering layers
+    INCLUDE_UNLOADED_PAYLOADS = False
+    # Vectors are cached here across collections, defaults to a
+    # usdchat_embedding_cache folder in WORKING_DIRECTORY
+    EMBEDDING_CACHE_DIRECTORY = ""
+    # 0 disables the embedding cache
+    EMBEDDING_CACHE_MAX_ENTRIES = 2_000_000
+    # Recent query embeddings and retrieval results kept in memory
+    QUERY_EMBEDDING_CACHE_SIZE = 256
+    QUERY_RESULT_CACHE_SIZE = 128
+    # Fuse BM25 hits on exact USD identifiers with the vector hits
+    HYBRID_RETRIEVAL = True
+    # Candidates taken from each retriever before fusing
+    HYBRID_CANDIDATES = 20
+    # Reciprocal rank fusion constant, larger values flatten the ranking
+    RRF_K = 60
+    # Rerank retrieved chunks with a local cross-encoder before they reach
+    # the prompt
+    RERANK = False
+    RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    # Hits fetched for the cross-encoder to choose from
+    RERANK_CANDIDATES = 30
+    # Chunks kept per question after reranking
+    RERANK_TOP_N = 5
+    RERANK_BATCH_SIZE = 16
+    # Seconds of scoring per question, unscored hits keep retrieval order
+    RERANK_LATENCY_BUDGET = 0.5
+    RERANK_SCORE_CACHE_SIZE = 10000
+    # Embed each distinct chunk content once across the whole stage
+    DEDUPLICATE_CHUNKS = True
+    # Replace numeric arrays (points, normals, indices, primvars) with
+    # count/min/max/sample descriptors before embedding
+    SUMMARIZE_ARRAYS = True
+    ARRAY_SUMMARY_MIN_ELEMENTS = 16
+    ARRAY_SUMMARY_SAMPLES = 3
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     MAX_TOKENS = 500
+    # Context window of MODEL, 0 looks it up from the model name
+    CONTEXT_WINDOW_TOKENS = 0
+    # Most tokens of retrieved chunks added to one question
+    RAG_CONTEXT_MAX_TOKENS = 3000
+    # Chunks retrieved per question, as many as fit the budget are used
+    RAG_CANDIDATES = 20
+    # Most tokens of conversation history sent with a question
+    HISTORY_MAX_TOKENS = 3000
+    # Tokens for the summary of messages dropped from the history, 0 drops
+    # them without one
+    HISTORY_SUMMARY_TOKENS = 400
+    # Older python outputs and fix requests are cut to this many tokens
+    HISTORY_TOOL_OUTPUT_TOKENS = 200
+    # Answer RAG questions close to earlier ones, asked against the same
+    # collection version, from the earlier answer
+    ANSWER_CACHE = True
+    ANSWER_CACHE_PATH = "/tmp/usdchat_answer_cache.sqlite"
+    # Cosine similarity an earlier question needs for its answer to be reused
+    ANSWER_CACHE_SIMILARITY = 0.95
+    ANSWER_CACHE_TTL = 7 * 24 * 3600
+    ANSWER_CACHE_MAX_ENTRIES = 5000
+    # Retrieve context in the background once typing pauses this long, 0
+    # turns prefetching off
+    PREFETCH_DEBOUNCE_MS = 400
+    # Shortest question worth prefetching for
+    PREFETCH_MIN_CHARACTERS = 12
+    PREFETCH_CACHE_SIZE = 16
     TEMPERATURE = 0
     MAX_ATTEMPTS = 4
     WORKING_DIRECTORY = "/tmp"
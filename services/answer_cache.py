@@ -0,0 +1,123 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """Answers to earlier RAG questions, stored in SQLite with the question's
+    embedding so a rephrased question can find them again.
+
+    Entries belong to one collection version and scope; once a collection is
+    re-embedded its old answers are deleted on the next lookup. Entries
+    expire after ttl seconds, and the least recently used ones are dropped
+    beyond max_entries.
+    """
+
+    def __init__(self, path, ttl, max_entries):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY, collection TEXT, version INTEGER,
+                scope TEXT, question TEXT, embedding BLOB, answer TEXT,
+                created REAL, last_used REAL);
+            CREATE INDEX IF NOT EXISTS answers_collection
+                ON answers (collection, version, scope);
+            """
+        )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def lookup(self, collection, version, scope, embedding, threshold):
+        """Returns the answer of the most similar earlier question if its
+        cosine similarity is at least threshold, else None."""
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM answers WHERE created < ? OR "
+                "(collection = ? AND version != ?)",
+                (now - self.ttl, collection, version),
+            )
+            rows = [
+                row for row in self._connection.execute(
+                    "SELECT id, embedding, answer FROM answers "
+                    "WHERE collection = ? AND version = ? AND scope = ?",
+                    (collection, version, scope),
+                )
+                if len(row[1]) == query.nbytes
+            ]
+            if rows:
+                matrix = np.frombuffer(
+                    b"".join(row[1] for row in rows), dtype=np.float32
+                ).reshape(len(rows), -1)
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= threshold:
+                    self._connection.execute(
+                        "UPDATE answers SET last_used = ? WHERE id = ?",
+                        (now, rows[best][0]),
+                    )
+                    self.hits += 1
+                    logger.info(
+                        f"Answer cache hit, similarity {scores[best]:.3f} "
+                        f"({self.hit_rate:.0%} hit rate)."
+                    )
+                    return rows[best][2]
+        self.misses += 1
+        return None
+
+    def put(self, collection, version, scope, question, embedding, answer):
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO answers (collection, version, scope, question, "
+                "embedding, answer, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (collection, version, scope, question, vector.tobytes(),
+                 answer, now, now),
+            )
+            self._connection.execute(
+                "DELETE FROM answers WHERE id NOT IN ("
+                "SELECT id FROM answers ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM answers")
+
+    def discard(self, collection):
+        """Forgets the answers of a deleted or renamed collection, whose
+        versions start over if it is built again."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM answers WHERE collection = ?", (collection,))
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from usdchat.services.answer_cache import AnswerCache
+
+
+class AnswerCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = self.open_cache()
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def open_cache(self, ttl=3600, max_entries=10):
+        return AnswerCache(
+            os.path.join(self.directory, "answers.sqlite"), ttl, max_entries)
+
+    def lookup(self, embedding, version=1, scope="", threshold=0.95):
+        return self.cache.lookup("shot", version, scope, embedding, threshold)
+
+    def test_similar_question_reuses_the_answer(self):
+        self.cache.put("shot", 1, "", "Where is the chair?", [1.0, 0.0], "A")
+        self.cache.put("shot", 1, "", "How big is the lamp?", [0.0, 1.0], "B")
+        self.assertEqual(self.lookup([2.0, 0.1]), "A")
+        self.assertEqual(self.lookup([0.1, 3.0]), "B")
+        self.assertIsNone(self.lookup([1.0, 1.0]))
+        self.assertIsNone(self.lookup([1.0, 0.0, 0.0]))
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+    def test_answers_are_scoped(self):
+        self.cache.put("shot", 1, "a.usda", "q", [1.0, 0.0], "A")
+        self.assertIsNone(self.lookup([1.0, 0.0]))
+        self.assertEqual(self.lookup([1.0, 0.0], scope="a.usda"), "A")
+        self.assertIsNone(
+            self.cache.lookup("asset", 1, "a.usda", [1.0, 0.0], 0.95))
+
+    def test_new_collection_version_drops_old_answers(self):
+        self.cache.put("shot", 1, "", "q", [1.0, 0.0], "A")
+        self.assertIsNone(self.lookup([1.0, 0.0], version=2))
+        self.assertIsNone(self.lookup([1.0, 0.0], version=1))
+
+    def test_expired_and_least_recently_used_answers_are_dropped(self):
+        cache = self.open_cache(ttl=60, max_entries=2)
+        self.addCleanup(cache.close)
+        now = [0.0]
+        with mock.patch("usdchat.services.answer_cache.time.time",
+                        side_effect=lambda: now[0]):
+            cache.put("shot", 1, "", "q1", [1.0, 0.0], "A")
+            now[0] = 1.0
+            cache.put("shot", 1, "", "q2", [0.0, 1.0], "B")
+            now[0] = 2.0
+            self.assertEqual(cache.lookup("shot", 1, "", [1.0, 0.0], 0.9), "A")
+            now[0] = 3.0
+            cache.put("shot", 1, "", "q3", [1.0, 1.0], "C")
+            # B was used least recently.
+            self.assertIsNone(cache.lookup("shot", 1, "", [0.0, 1.0], 0.9))
+            now[0] = 100.0
+            # Everything is past its ttl.
+            self.assertIsNone(cache.lookup("shot", 1, "", [1.0, 0.0], 0.9))
+
+    def test_discard_and_clear(self):
+        self.cache.put("shot", 1, "", "q", [1.0, 0.0], "A")
+        self.cache.put("asset", 1, "", "q", [1.0, 0.0], "B")
+        self.cache.discard("shot")
+        self.assertIsNone(self.lookup([1.0, 0.0]))
+        self.assertEqual(
+            self.cache.lookup("asset", 1, "", [1.0, 0.0], 0.95), "B")
+        self.cache.clear()
+        self.assertIsNone(
+            self.cache.lookup("asset", 1, "", [1.0, 0.0], 0.95))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,24 +1,141 @@
+import copy
+import itertools
+import json
 import logging
+import os
+import shutil
+import threading
+import time
 
-import chromadb
 import chromadb.utils.embedding_functions as ef
 
-from utils.chunk_ascii_files import split_files_to_chunks
+from usdchat.config.config import Config
+from usdchat.services.answer_cache import AnswerCache
+from usdchat.services.embed_pipeline import EmbedPipeline
+from usdchat.services.embedding_cache import EmbeddingCache
+from usdchat.services.lexical_index import (LEXICAL_INDEX_FILENAME,
+                                            LexicalIndex)
+from usdchat.services.query_cache import LRUCache
+from usdchat.services.reranker import CrossEncoderReranker
+from usdchat.services.shared_resources import acquire_shared, release_shared
+from usdchat.services.vector_store import ChromaVectorStore
+from usdchat.utils.chunk_ascii_files import iter_files_to_chunks
+from usdchat.utils.chunk_dedup import ChunkDeduplicator, chunk_digest
+from usdchat.utils.collection_manifest import (CollectionManifest,
+                                               layer_fingerprint)
 
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+default_query_include = ("metadatas", "documents", "distances")
+# Same as Collection.query, rerank needs it before the query is made.
+default_n_results = 10
+embedder_special_tokens = 2
+result_fields = ("ids", "embeddings", "documents", "metadatas", "distances")
+
+# Shared by every ChromaDBCollections in the process.
+_query_embeddings = LRUCache(Config.QUERY_EMBEDDING_CACHE_SIZE)
+_query_results = LRUCache(Config.QUERY_RESULT_CACHE_SIZE)
+_collection_versions = {}
+_versions_lock = threading.Lock()
+
+
+def layer_scope(layer_paths):
+    """Builds a where filter limiting a query to chunks from the given
+    layers, or None to search the whole collection."""
+    if layer_paths is None:
+        return None
+    layer_paths = sorted(layer_paths)
+    if len(layer_paths) == 1:
+        return {"layer": layer_paths[0]}
+    return {"layer": {"$in": layer_paths}}
+
+
+def _scope_layers(where):
+    """The layers a layer_scope filter allows, None when where is empty and
+    False for filters the lexical index can't apply."""
+    if not where:
+        return None
+    if set(where) != {"layer"}:
+        return False
+    layer = where["layer"]
+    if isinstance(layer, str):
+        return [layer]
+    if isinstance(layer, dict) and set(layer) == {"$in"}:
+        return layer["$in"]
+    return False
+
 
 class ChromaDBCollections:
+    """Collection operations on top of the process-wide vector store and
+    embedding model, which are created on first use and shared by every
+    instance. Call close once an instance is no longer needed."""
+
     def __init__(self, config=None):
         self.config = config
-        self.client = chromadb.PersistentClient(path=self.config.DB_PATH)
-        self.embedding_function = ef.SentenceTransformerEmbeddingFunction(
-            self.config.EMBEDDING_MODEL
+        self.pipeline_stats = []
+        self._lock = threading.Lock()
+        self._acquired = {}
+
+    def _shared(self, key, factory):
+        with self._lock:
+            if key not in self._acquired:
+                self._acquired[key] = acquire_shared(key, factory)
+            return self._acquired[key]
+
+    @property
+    def client(self):
+        """The VectorStore selected by Config.VECTOR_STORE."""
+        backend = self.config.VECTOR_STORE
+        if backend == "numpy":
+            from usdchat.services.numpy_vector_store import NumpyVectorStore
+
+            path = self.config.NUMPY_STORE_PATH
+            quantization = self.config.VECTOR_QUANTIZATION
+            return self._shared(
+                ("vector store", backend, path, quantization),
+                lambda: NumpyVectorStore(
+                    path,
+                    quantization=quantization,
+                    rerank_factor=self.config.QUANTIZED_RERANK_FACTOR,
+                ),
+            )
+        if backend != "chromadb":
+            raise ValueError(f"Unknown vector store {backend}")
+        return self._shared(
+            ("vector store", backend, self.config.DB_PATH),
+            lambda: ChromaVectorStore(self.config.DB_PATH),
+        )
+
+    @property
+    def embedding_function(self):
+        return self._shared(
+            ("embedding model", self.config.EMBEDDING_MODEL),
+            lambda: ef.SentenceTransformerEmbeddingFunction(
+                self.config.EMBEDDING_MODEL
+            ),
+        )
+
+    @property
+    def reranker(self):
+        return self._shared(
+            ("reranker model", self.config.RERANK_MODEL),
+            lambda: CrossEncoderReranker(
+                self.config.RERANK_MODEL,
+                batch_size=self.config.RERANK_BATCH_SIZE,
+                cache_size=self.config.RERANK_SCORE_CACHE_SIZE,
+            ),
         )
 
+    def close(self):
+        with self._lock:
+            keys = list(self._acquired)
+            self._acquired.clear()
+        for key in keys:
+            release_shared(key)
+
     def create_collection(
             self,
             name,
@@ -40,67 +157,283 @@ class ChromaDBCollections:
             name=name, embedding_function=embedding_function
         )
 
+    def collection_data_dir(self, name, create=True):
+        """Directory holding the files kept next to a collection."""
+        directory = os.path.join(self.config.COLLECTIONS_DATA_PATH, name)
+        if create:
+            os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def embedding_settings(self):
+        """Settings that change chunk contents or vectors; a collection built
+        with different ones can't be updated incrementally."""
+        return {
+            "embedding_model": self.config.EMBEDDING_MODEL,
+            "chunk_tokens": self.chunk_tokens(),
+            "chunk_strategy": self.config.CHUNK_STRATEGY,
+            "summarize_arrays": self.config.SUMMARIZE_ARRAYS,
+            "array_summary_min_elements": self.config.ARRAY_SUMMARY_MIN_ELEMENTS,
+            "array_summary_samples": self.config.ARRAY_SUMMARY_SAMPLES,
+            "vector_quantization": (
+                self.config.VECTOR_QUANTIZATION
+                if self.config.VECTOR_STORE == "numpy" else "none"
+            ),
+        }
+
+    def chunk_tokens(self):
+        """Tokens packed into one chunk: CHUNK_TOKENS when set, otherwise as
+        many as the embedding model reads before truncating, never more
+        than MAX_EMBEDDING_TOKENS."""
+        if self.config.CHUNK_TOKENS:
+            return min(self.config.CHUNK_TOKENS, self.config.MAX_EMBEDDING_TOKENS)
+        model = getattr(self.embedding_function, "_model", None)
+        max_seq_length = getattr(model, "max_seq_length", None)
+        if not max_seq_length:
+            return self.config.MAX_EMBEDDING_TOKENS
+        # The model adds its own start and end tokens to every input.
+        return min(
+            max(max_seq_length - embedder_special_tokens, 1),
+            self.config.MAX_EMBEDDING_TOKENS,
+        )
+
+    def embedding_batch_size(self):
+        """Chunks embedded per call, capped so one batch never holds more
+        than EMBEDDING_BATCH_TOKENS tokens."""
+        return max(
+            1,
+            min(
+                self.config.EMBEDDING_BATCH_SIZE,
+                self.config.EMBEDDING_BATCH_TOKENS // self.chunk_tokens(),
+            ),
+        )
+
+    def open_embedding_cache(self):
+        if not self.config.EMBEDDING_CACHE_MAX_ENTRIES:
+            return None
+        directory = self.config.EMBEDDING_CACHE_DIRECTORY or os.path.join(
+            self.config.WORKING_DIRECTORY, "usdchat_embedding_cache"
+        )
+        try:
+            return EmbeddingCache(
+                directory,
+                self.config.EMBEDDING_MODEL,
+                self.config.EMBEDDING_CACHE_MAX_ENTRIES,
+            )
+        except BlockingIOError:
+            logger.warning(
+                f"Embedding cache {directory} is in use by another update, "
+                f"embedding without it."
+            )
+            return None
+
+    def _embed_documents(self, documents, digests, cache=None):
+        """Returns a vector per document, running the embedding model only
+        for contents the cache hasn't seen."""
+        cached = cache.lookup(digests) if cache else {}
+        missing = [
+            idx for idx, digest in enumerate(digests) if digest not in cached
+        ]
+        if missing:
+            computed = self.embedding_function(
+                [documents[idx] for idx in missing])
+            if cache:
+                cache.add([digests[idx] for idx in missing], computed)
+            for idx, vector in zip(missing, computed):
+                cached[digests[idx]] = [float(value) for value in vector]
+        return [cached[digest] for digest in digests]
+
+    def _add_with_retry(self, collection, collection_name, **kwargs):
+        """Adds one batch, retrying just that batch on a fresh collection
+        handle if the connection drops. Returns the handle that worked."""
+        for attempt in range(self.config.EMBEDDING_RETRIES + 1):
+            try:
+                if attempt:
+                    # Part of the batch may have landed before the failure.
+                    collection.upsert(**kwargs)
+                else:
+                    collection.add(**kwargs)
+                return collection
+            except EOFError as e:
+                if attempt == self.config.EMBEDDING_RETRIES:
+                    raise
+                logger.warning(
+                    f"Error adding documents to collection, retrying "
+                    f"batch ({attempt + 1}/{self.config.EMBEDDING_RETRIES}): {e}"
+                )
+                collection = self.get_collection(
+                    collection_name, embedding_function=self.embedding_function
+                )
+
     def create_and_store_embeddings(
         self,
         files,
         collection_name,
         signal_progress_update=None,
         progress_range=(60, 100),
+        layer_paths=None,
+        stop_event=None,
     ):
-        collection = self.get_or_create_collection(
-            collection_name, embedding_function=self.embedding_function
-        )
-        chunks = split_files_to_chunks(files)
-        total_chunks = len(chunks)
-        logger.info(f"Found {total_chunks} chunks.")
-
-        batch_size = 80000
-        for i in range(0, total_chunks, batch_size):
-            batch_docs = chunks[i: i + batch_size]
-            batch_ids = [f"doc_{j}" for j in range(i, i + len(batch_docs))]
-
-            # Report progress
-            if signal_progress_update:
-                progress = progress_range[0] + (
-                    ((i + len(batch_docs)) / total_chunks) * (progress_range[1] - 80)
-                )
-                signal_progress_update.emit(
-                    int(progress),
-                    f"Adding to {collection_name} collections: {i + len(batch_docs)}/{total_chunks} chunks ({int(progress)}%)",
-                )
+        """Brings a collection up to date with the given ASCII files.
 
-            try:
-                collection.add(documents=batch_docs, ids=batch_ids)
-            except EOFError as e:
-                logger.error(f"Error adding documents to collection: {e}")
-                self.client.delete_collection(collection_name)
-                collection = self.get_or_create_collection(
-                    self.client, collection_name)
-                collection.add(documents=batch_docs, ids=batch_ids)
-
-            if signal_progress_update:
-                progress = progress_range[0] + (
-                    ((i + len(batch_docs)) / total_chunks) * (progress_range[1] - 80)
-                )
-                signal_progress_update.emit(
-                    int(progress),
-                    f"Embedding: {i + len(batch_docs)}/{total_chunks} chunks ({int(progress)}%)",
-                )
+        layer_paths holds the original layer of each file and defaults to the
+        files themselves. Returns the number of documents in the collection.
+        """
+        layer_paths = layer_paths or files
+        return self.update_collection_from_layers(
+            collection_name,
+            zip(layer_paths, files),
+            len(files),
+            signal_progress_update,
+            progress_range,
+            stop_event,
+        )
+
+    def update_collection_from_layers(
+        self,
+        collection_name,
+        layers,
+        total_layers,
+        signal_progress_update=None,
+        progress_range=(0, 100),
+        stop_event=None,
+    ):
+        """Embeds (layer_path, ascii_path) pairs as they arrive, with
+        chunking, embedding and database writes running concurrently.
 
-        logger.info(f"Upserted {total_chunks} chunks.")
+        Layers whose fingerprint matches the collection manifest are skipped;
+        for the others only new chunks are embedded, moved chunks get their
+        metadata updated and stale chunks are deleted. Setting stop_event
+        cancels within one batch. Returns the number of documents in the
+        collection, or None if cancelled.
+        """
+        update = _CollectionUpdate(
+            self, collection_name, total_layers, signal_progress_update,
+            progress_range)
+        pipeline = EmbedPipeline(
+            stop_event, queue_size=self.config.EMBED_PIPELINE_QUEUE_SIZE)
+        pipeline.add_stage("resolve", update.select_changed)
+        pipeline.add_stage("chunk", update.chunk_batches)
+        pipeline.add_stage("embed", update.embed_batches)
+        pipeline.add_stage("write", update.write_batches)
+        try:
+            pipeline.run(layers)
+        finally:
+            self.pipeline_stats = pipeline.stats
+            update.finish(cancelled=pipeline.stop_event.is_set())
+        if pipeline.stop_event.is_set():
+            return None
+        bottleneck = pipeline.bottleneck()
+        message = (
+            f"✅ {collection_name} collection updated: {update.embedded_chunks} "
+            f"embedded, {update.deleted_chunks} removed."
+        )
+        if bottleneck and bottleneck.items:
+            message += f" Slowest stage: {bottleneck.name}."
         if signal_progress_update:
-            signal_progress_update.emit(
-                progress_range[1], f"✅ {collection_name} collection created."
-            )
+            signal_progress_update.emit(progress_range[1], message)
+        return update.collection.count()
+
+    def collection_version(self, collection_name):
+        """Increases every time the collection changes. Read from the
+        manifest once and then tracked in memory."""
+        with _versions_lock:
+            version = _collection_versions.get(collection_name)
+            if version is None:
+                directory = self.collection_data_dir(
+                    collection_name, create=False)
+                version = CollectionManifest(directory).version
+                _collection_versions[collection_name] = version
+            return version
+
+    def _collection_changed(self, collection_name, version=None):
+        """Records a new collection version, bumping the manifest unless the
+        caller already did, and drops cached results for the collection."""
+        if version is None:
+            manifest = CollectionManifest(
+                self.collection_data_dir(collection_name))
+            manifest.version += 1
+            manifest.save()
+            version = manifest.version
+        self.client.persist(collection_name)
+        with _versions_lock:
+            _collection_versions[collection_name] = version
+        _query_results.discard_where(lambda key: key[0] == collection_name)
 
-        return chunks
+    def _collection_removed(self, collection_name):
+        with _versions_lock:
+            _collection_versions.pop(collection_name, None)
+        _query_results.discard_where(lambda key: key[0] == collection_name)
+        self._discard_answers(collection_name)
+
+    def _discard_answers(self, collection_name=None):
+        """Drops cached chat answers for a collection, or for all of them."""
+        path = self.config.ANSWER_CACHE_PATH
+        if not self.config.ANSWER_CACHE or not os.path.exists(path):
+            return
+        answer_cache = AnswerCache(
+            path,
+            self.config.ANSWER_CACHE_TTL,
+            self.config.ANSWER_CACHE_MAX_ENTRIES,
+        )
+        try:
+            if collection_name is None:
+                answer_cache.clear()
+            else:
+                answer_cache.discard(collection_name)
+        finally:
+            answer_cache.close()
+
+    def embed_queries(self, query_texts):
+        """Embeds query texts, reusing vectors of texts embedded before."""
+        model = self.config.EMBEDDING_MODEL
+        _query_embeddings.max_entries = self.config.QUERY_EMBEDDING_CACHE_SIZE
+        vectors = [_query_embeddings.get((model, text)) for text in query_texts]
+        missing = [idx for idx, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.embedding_function(
+                [query_texts[idx] for idx in missing])
+            for idx, vector in zip(missing, computed):
+                vectors[idx] = [float(value) for value in vector]
+                _query_embeddings.put((model, query_texts[idx]), vectors[idx])
+        return vectors
+
+    def collection_layers(self, collection_name, pattern=""):
+        """Layers the collection was built from, optionally only those whose
+        path contains pattern."""
+        manifest = CollectionManifest(
+            self.collection_data_dir(collection_name, create=False)
+        )
+        return sorted(
+            layer_path for layer_path in manifest.layers
+            if pattern in layer_path
+        )
+
+    def get_chunk_occurrences(self, collection_name, doc_id):
+        """Returns every (layer, prim_path, start_line, end_line) at which
+        the content stored under doc_id appears."""
+        manifest = CollectionManifest(
+            self.collection_data_dir(collection_name, create=False)
+        )
+        chunk = manifest.find_chunk(doc_id)
+        if chunk is None:
+            return []
+        return [tuple(location) for location in manifest.occurrences(chunk["digest"])]
 
     def delete_collection(self, name):
         self.client.delete_collection(name=name)
+        self._collection_removed(name)
+        shutil.rmtree(
+            self.collection_data_dir(name, create=False), ignore_errors=True
+        )
 
     def rename_collection(self, old_name, new_name):
         collection = self.get_collection(old_name)
         collection.modify(name=new_name)
+        self._collection_removed(old_name)
+        self._collection_removed(new_name)
+        old_dir = self.collection_data_dir(old_name, create=False)
+        if os.path.isdir(old_dir):
+            os.rename(old_dir, self.collection_data_dir(new_name, create=False))
 
     def reset_db(self):
         for collection_name in self.all_collections():
@@ -114,6 +447,8 @@ class ChromaDBCollections:
     ):
         collection = self.get_collection(collection_name)
         collection.add(documents=documents, metadatas=metadatas, ids=ids)
+        self._index_documents(collection_name, ids, documents, metadatas)
+        self._collection_changed(collection_name)
 
     def query_collection(
         self,
@@ -123,15 +458,165 @@ class ChromaDBCollections:
         where=None,
         where_document=None,
         include=None,
+        rerank=None,
     ):
-        collection = self.get_collection(collection_name)
-        return collection.query(
-            query_embeddings=self.embedding_function(query_texts),
-            n_results=n_results,
+        """Queries a collection, answering repeated queries against an
+        unchanged collection from the result cache.
+
+        With rerank, or Config.RERANK when rerank is None, RERANK_CANDIDATES
+        hits are fetched and the cross-encoder picks n_results of them.
+        """
+        if rerank is None:
+            rerank = self.config.RERANK
+        if n_results is None:
+            n_results = default_n_results
+        key = (
+            collection_name,
+            self.collection_version(collection_name),
+            tuple(query_texts),
+            n_results,
+            json.dumps(where, sort_keys=True),
+            json.dumps(where_document, sort_keys=True),
+            tuple(include or ()),
+            rerank,
+        )
+        _query_results.max_entries = self.config.QUERY_RESULT_CACHE_SIZE
+        results = _query_results.get(key)
+        if results is None:
+            collection = self.get_collection(collection_name)
+            fetch_include = include
+            if rerank:
+                fetch_include = list(include or default_query_include)
+                if "documents" not in fetch_include:
+                    fetch_include.append("documents")
+            results = collection.query(
+                query_embeddings=self.embed_queries(query_texts),
+                n_results=(
+                    max(n_results, self.config.RERANK_CANDIDATES)
+                    if rerank else n_results
+                ),
+                where=where,
+                where_document=where_document,
+                include=fetch_include,
+            )
+            if rerank:
+                results = self._rerank_results(
+                    query_texts, results, n_results,
+                    include or default_query_include)
+            _query_results.put(key, results)
+        # Callers are free to modify what they get back.
+        return copy.deepcopy(results)
+
+    def hybrid_query_collection(
+        self,
+        collection_name,
+        query_text,
+        n_results=7,
+        where=None,
+        include=("documents", "metadatas"),
+    ):
+        """Fuses vector hits with BM25 hits from the lexical index using
+        reciprocal rank fusion, so exact identifiers such as prim paths and
+        property names are found even when their embeddings are not close.
+
+        Returns results shaped like query_collection's for one query.
+        """
+        rerank = self.config.RERANK
+        requested = include
+        if rerank and "documents" not in include:
+            include = tuple(include) + ("documents",)
+        candidates = max(n_results, self.config.HYBRID_CANDIDATES)
+        vector_results = self.query_collection(
+            collection_name,
+            query_texts=[query_text],
+            n_results=candidates,
             where=where,
-            where_document=where_document,
-            include=include,
+            include=list(include),
+            rerank=False,
         )
+        lexical_hits = []
+        lexical_index = self.lexical_index(collection_name)
+        layers = _scope_layers(where)
+        if lexical_index is not None and layers is not False:
+            try:
+                lexical_hits = [
+                    doc_id for doc_id, _ in lexical_index.search(
+                        query_text, candidates, layers)
+                ]
+            finally:
+                lexical_index.close()
+
+        k = self.config.RRF_K
+        scores = {}
+        for ranking in (vector_results["ids"][0], lexical_hits):
+            for rank, doc_id in enumerate(ranking):
+                scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+        fused = sorted(scores, key=scores.get, reverse=True)
+        fused = fused[: max(n_results, self.config.RERANK_CANDIDATES)
+                      if rerank else n_results]
+
+        found = {
+            field: dict(zip(vector_results["ids"][0], vector_results[field][0]))
+            for field in include
+        }
+        missing = [doc_id for doc_id in fused if doc_id not in found[include[0]]]
+        if missing:
+            stored = self.get_collection(collection_name).get(
+                ids=missing, include=list(include))
+            for field in include:
+                found[field].update(zip(stored["ids"], stored[field]))
+        fused = [doc_id for doc_id in fused if doc_id in found[include[0]]]
+        results = {"ids": [fused]}
+        for field in include:
+            results[field] = [[found[field][doc_id] for doc_id in fused]]
+        if rerank:
+            results = self._rerank_results(
+                [query_text], results, n_results, requested)
+        return results
+
+    def _rerank_results(self, query_texts, results, n_results, include):
+        """Reorders each query's hits by cross-encoder score, keeps the best
+        n_results and drops fields the caller did not ask for."""
+        for idx, query_text in enumerate(query_texts):
+            order = self.reranker.rerank(
+                query_text,
+                results["documents"][idx],
+                n_results,
+                self.config.RERANK_LATENCY_BUDGET,
+            )
+            for field in result_fields:
+                if results.get(field) is not None:
+                    results[field][idx] = [
+                        results[field][idx][i] for i in order]
+        for field in result_fields:
+            if field != "ids" and field not in include and field in results:
+                results[field] = None
+        return results
+
+    def lexical_index(self, collection_name):
+        """Opens the collection's lexical index, or returns None when hybrid
+        retrieval is off or the collection has none yet."""
+        if not self.config.HYBRID_RETRIEVAL:
+            return None
+        directory = self.collection_data_dir(collection_name, create=False)
+        if not os.path.exists(os.path.join(directory, LEXICAL_INDEX_FILENAME)):
+            return None
+        return LexicalIndex(directory)
+
+    def _index_documents(self, collection_name, ids, documents, metadatas):
+        if documents is None:
+            return
+        lexical_index = self.lexical_index(collection_name)
+        if lexical_index is None:
+            return
+        layers = [
+            (metadata or {}).get("layer", "")
+            for metadata in (metadatas or [None] * len(ids))
+        ]
+        try:
+            lexical_index.add(ids, documents, layers)
+        finally:
+            lexical_index.close()
 
     def update_collection(
             self,
@@ -146,6 +631,8 @@ class ChromaDBCollections:
             embeddings=embeddings,
             metadatas=metadatas,
             documents=documents)
+        self._index_documents(collection_name, ids, documents, metadatas)
+        self._collection_changed(collection_name)
 
     def upsert_collection(
             self,
@@ -160,13 +647,376 @@ class ChromaDBCollections:
             embeddings=embeddings,
             metadatas=metadatas,
             documents=documents)
+        self._index_documents(collection_name, ids, documents, metadatas)
+        self._collection_changed(collection_name)
 
     def delete_from_collection(self, collection_name, ids=None, where=None):
         collection = self.get_collection(collection_name)
-        collection.delete(ids=ids, where=where)
+        lexical_index = self.lexical_index(collection_name)
+        try:
+            if lexical_index is not None and where is not None:
+                ids = collection.get(ids=ids, where=where)["ids"]
+            collection.delete(ids=ids, where=where)
+            if lexical_index is not None:
+                lexical_index.delete(ids or [])
+        finally:
+            if lexical_index is not None:
+                lexical_index.close()
+        self._collection_changed(collection_name)
 
     def reset_chromadb(self):
         self.client.reset()
+        with _versions_lock:
+            _collection_versions.clear()
+        _query_results.clear()
+        self._discard_answers()
+        shutil.rmtree(self.config.COLLECTIONS_DATA_PATH, ignore_errors=True)
 
     def heartbeat_chromadb(self):
         return self.client.heartbeat()
+
+
+class _CollectionUpdate:
+    """The stages of one incremental collection update, run concurrently by
+    an EmbedPipeline. Each stage runs on its own thread and only touches
+    the state it owns until finish is called."""
+
+    def __init__(
+        self,
+        collections,
+        collection_name,
+        total_layers,
+        signal_progress_update=None,
+        progress_range=(0, 100),
+    ):
+        self.collections = collections
+        self.config = collections.config
+        self.collection_name = collection_name
+        self.total_layers = total_layers
+        self.signal_progress_update = signal_progress_update
+        self.progress_range = progress_range
+        self.chunk_tokens = collections.chunk_tokens()
+        self.batch_size = collections.embedding_batch_size()
+        self.collection = collections.get_or_create_collection(
+            collection_name, embedding_function=collections.embedding_function
+        )
+        self.manifest = CollectionManifest(
+            collections.collection_data_dir(collection_name))
+        settings = collections.embedding_settings()
+        stored = self.collection.count()
+        # Chunks without a manifest were embedded before manifests existed,
+        # their ids and settings are unknown.
+        if (
+            self.manifest.layers
+            and (self.manifest.settings != settings or not stored)
+        ) or (not self.manifest.layers and stored):
+            logger.info("Collection manifest is out of date, rebuilding.")
+            collections.client.delete_collection(collection_name)
+            self.collection = collections.get_or_create_collection(
+                collection_name,
+                embedding_function=collections.embedding_function,
+            )
+            self.manifest.reset()
+        self.manifest.settings = settings
+
+        self.lexical_index = None
+        if self.config.HYBRID_RETRIEVAL:
+            self.lexical_index = LexicalIndex(
+                collections.collection_data_dir(collection_name))
+            if not self.manifest.layers:
+                self.lexical_index.clear()
+            elif not len(self.lexical_index):
+                self._backfill_lexical_index()
+
+        self.cache = collections.open_embedding_cache()
+        self.deduplicator = ChunkDeduplicator()
+        # Content already stored under some id can be copied instead of
+        # embedded again.
+        self.stored_ids = (
+            self.manifest.ids_by_digest()
+            if self.config.DEDUPLICATE_CHUNKS else {}
+        )
+        self.seen_layers = set()
+        self.fingerprints = {}
+        self.unchanged_layers = 0
+        self.written_ids = {}
+        self.progress_layers = set()
+        self.embedded_chunks = 0
+        self.copied_chunks = 0
+        self.moved_chunks = 0
+        self.deleted_chunks = 0
+        self.embedding_seconds = 0.0
+
+    def _backfill_lexical_index(self):
+        """Indexes the chunks of a collection built before it had a lexical
+        index."""
+        ids = [
+            doc_id
+            for layer_path in self.manifest.layers
+            for doc_id in self.manifest.chunks(layer_path)
+        ]
+        logger.info(f"Building lexical index for {len(ids)} chunks")
+        for start in range(0, len(ids), self.batch_size):
+            stored = self.collection.get(
+                ids=ids[start: start + self.batch_size],
+                include=["documents", "metadatas"],
+            )
+            self.lexical_index.add(
+                stored["ids"],
+                stored["documents"],
+                [(metadata or {}).get("layer", "")
+                 for metadata in stored["metadatas"]],
+            )
+
+    def select_changed(self, layers):
+        for layer_path, file in layers:
+            self.seen_layers.add(layer_path)
+            fingerprint = layer_fingerprint(layer_path, file)
+            if self.manifest.is_unchanged(layer_path, fingerprint):
+                self.unchanged_layers += 1
+                continue
+            self.fingerprints[layer_path] = fingerprint
+            yield layer_path, file
+
+    def chunk_batches(self, layers):
+        layer_of = {}
+
+        def files():
+            for layer_path, file in layers:
+                layer_of[file] = layer_path
+                yield file
+
+        chunks = iter_files_to_chunks(
+            files(),
+            max_tokens=self.chunk_tokens,
+            workers=self.config.CHUNKING_WORKERS,
+            total_files=self.total_layers,
+        )
+        while True:
+            batch = [
+                (layer_of[chunk.source], chunk)
+                for chunk in itertools.islice(chunks, self.batch_size)
+            ]
+            if not batch:
+                return
+            yield batch
+
+    def embed_batches(self, batches):
+        for batch in batches:
+            to_embed, to_copy, to_update = [], [], []
+            for layer_path, chunk in batch:
+                doc_id, digest, is_new = self.deduplicator.add(chunk, layer_path)
+                if not is_new:
+                    continue
+                metadata = {
+                    "layer": layer_path,
+                    "prim_path": chunk.prim_path,
+                    "start_line": chunk.start_line,
+                    "end_line": chunk.end_line,
+                }
+                previous = self.manifest.chunks(layer_path).get(doc_id)
+                if previous is not None:
+                    if previous["locations"][0] != [
+                        chunk.prim_path, chunk.start_line, chunk.end_line
+                    ]:
+                        to_update.append((doc_id, metadata))
+                elif digest in self.stored_ids:
+                    to_copy.append(
+                        (doc_id, chunk.text, metadata, self.stored_ids[digest]))
+                else:
+                    to_embed.append((doc_id, chunk.text, metadata, digest))
+                    if self.config.DEDUPLICATE_CHUNKS:
+                        self.stored_ids[digest] = doc_id
+
+            vectors = []
+            batch_start = time.perf_counter()
+            if to_embed:
+                _, docs, _, digests = zip(*to_embed)
+                vectors = self.collections._embed_documents(
+                    docs, digests, self.cache)
+            batch_seconds = time.perf_counter() - batch_start
+            self.embedding_seconds += batch_seconds
+            rate = len(to_embed) / batch_seconds if batch_seconds else 0.0
+            logger.info(
+                f"Batch of {len(batch)} chunks: {len(to_embed)} embedded in "
+                f"{batch_seconds:.2f}s ({rate:.1f} chunks/sec)"
+            )
+            yield batch, to_embed, vectors, to_copy, to_update
+
+    def write_batches(self, jobs):
+        for batch, to_embed, vectors, to_copy, to_update in jobs:
+            if to_embed:
+                ids, docs, metadatas, _ = zip(*to_embed)
+                self.collection = self.collections._add_with_retry(
+                    self.collection,
+                    self.collection_name,
+                    documents=list(docs),
+                    metadatas=list(metadatas),
+                    embeddings=vectors,
+                    ids=list(ids),
+                )
+            if to_copy:
+                source_ids = list({source for *_, source in to_copy})
+                stored = self.collection.get(
+                    ids=source_ids, include=["embeddings"])
+                stored_vectors = dict(zip(stored["ids"], stored["embeddings"]))
+                lost = [job for job in to_copy if job[3] not in stored_vectors]
+                if lost:
+                    to_copy = [
+                        job for job in to_copy if job[3] in stored_vectors]
+                    to_embed = to_embed + self._embed_lost_copies(lost)
+            if to_copy:
+                ids, docs, metadatas, sources = zip(*to_copy)
+                self.collection = self.collections._add_with_retry(
+                    self.collection,
+                    self.collection_name,
+                    documents=list(docs),
+                    metadatas=list(metadatas),
+                    embeddings=[stored_vectors[source] for source in sources],
+                    ids=list(ids),
+                )
+            if to_update:
+                ids, metadatas = zip(*to_update)
+                self.collection.update(ids=list(ids), metadatas=list(metadatas))
+            if self.lexical_index is not None and (to_embed or to_copy):
+                ids, docs, metadatas, _ = zip(*(to_embed + to_copy))
+                self.lexical_index.add(
+                    ids, docs, [metadata["layer"] for metadata in metadatas])
+            for doc_id, _, metadata, _ in to_embed + to_copy:
+                self.written_ids.setdefault(
+                    metadata["layer"], set()).add(doc_id)
+            self.embedded_chunks += len(to_embed)
+            self.copied_chunks += len(to_copy)
+            self.moved_chunks += len(to_update)
+            self._report_progress(batch)
+            yield len(batch)
+
+    def _embed_lost_copies(self, lost):
+        """Embeds and adds copies whose source chunk was deleted from the
+        collection after the manifest recorded it. Returns them as embed
+        jobs."""
+        logger.info(
+            f"{len(lost)} chunks lost the chunk they copy from, embedding them.")
+        ids, docs, metadatas, _ = zip(*lost)
+        digests = [chunk_digest(text) for text in docs]
+        batch_start = time.perf_counter()
+        vectors = self.collections._embed_documents(docs, digests, self.cache)
+        self.embedding_seconds += time.perf_counter() - batch_start
+        self.collection = self.collections._add_with_retry(
+            self.collection,
+            self.collection_name,
+            documents=list(docs),
+            metadatas=list(metadatas),
+            embeddings=vectors,
+            ids=list(ids),
+        )
+        for doc_id, digest in zip(ids, digests):
+            self.stored_ids[digest] = doc_id
+        return list(zip(ids, docs, metadatas, digests))
+
+    def _report_progress(self, batch):
+        if not self.signal_progress_update or not self.total_layers:
+            return
+        self.progress_layers.add(batch[-1][0])
+        layers_done = self.unchanged_layers + len(self.progress_layers)
+        progress = self.progress_range[0] + (
+            min(layers_done / self.total_layers, 1.0)
+            * (self.progress_range[1] - self.progress_range[0])
+        )
+        rate = (
+            self.embedded_chunks / self.embedding_seconds
+            if self.embedding_seconds else 0.0
+        )
+        self.signal_progress_update.emit(
+            int(progress),
+            f"Embedding: {self.embedded_chunks}/"
+            f"{self.deduplicator.total_chunks} chunks from "
+            f"{layers_done}/{self.total_layers} layers, "
+            f"{rate:.0f} chunks/s ({int(progress)}%)",
+        )
+
+    def finish(self, cancelled=False):
+        """Deletes stale chunks and records the new state in the manifest.
+
+        When cancelled nothing is deleted; layers that were partly written
+        keep their old chunks plus the ones written so far and are marked
+        as changed, so the next run picks up where this one stopped.
+        """
+        manifest = self.manifest
+        deduplicator = self.deduplicator
+        changed = bool(self.written_ids)
+        if cancelled:
+            for layer_path, doc_ids in self.written_ids.items():
+                chunks = dict(manifest.chunks(layer_path))
+                current = deduplicator.chunks(layer_path)
+                chunks.update(
+                    (doc_id, current[doc_id]) for doc_id in doc_ids)
+                manifest.layers[layer_path] = {
+                    "fingerprint": "",
+                    "chunks": chunks,
+                }
+        else:
+            removed_layers = set(manifest.layers) - self.seen_layers
+            stale_ids = [
+                doc_id
+                for layer_path in removed_layers
+                for doc_id in manifest.chunks(layer_path)
+            ]
+            for layer_path in self.fingerprints:
+                current = deduplicator.chunks(layer_path)
+                stale_ids.extend(
+                    doc_id
+                    for doc_id in manifest.chunks(layer_path)
+                    if doc_id not in current
+                )
+            for start in range(0, len(stale_ids), self.batch_size):
+                self.collection.delete(
+                    ids=stale_ids[start: start + self.batch_size])
+            if self.lexical_index is not None:
+                self.lexical_index.delete(stale_ids)
+            self.deleted_chunks = len(stale_ids)
+
+            for layer_path in removed_layers:
+                del manifest.layers[layer_path]
+            for layer_path, fingerprint in self.fingerprints.items():
+                manifest.layers[layer_path] = {
+                    "fingerprint": fingerprint,
+                    "chunks": deduplicator.chunks(layer_path),
+                }
+            changed = changed or bool(self.fingerprints or removed_layers)
+        if changed:
+            manifest.version += 1
+        manifest.save()
+        if changed:
+            self.collections._collection_changed(
+                self.collection_name, manifest.version)
+
+        if self.lexical_index is not None:
+            self.lexical_index.close()
+        if self.cache:
+            try:
+                self.cache.evict()
+                self.cache.save()
+            finally:
+                self.cache.close()
+            logger.info(
+                f"Embedding cache: {self.cache.hits} hits, "
+                f"{self.cache.misses} misses ({self.cache.hit_rate:.0%} hit rate)"
+            )
+        if self.embedding_seconds:
+            logger.info(
+                f"Embedding throughput: "
+                f"{self.embedded_chunks / self.embedding_seconds:.1f} chunks/sec"
+            )
+        logger.info(
+            f"Embedded {self.embedded_chunks}, copied {self.copied_chunks}, "
+            f"moved {self.moved_chunks} and deleted {self.deleted_chunks} "
+            f"chunks; deduplication ratio {deduplicator.dedup_ratio:.2f}x."
+            + (" Cancelled." if cancelled else "")
+        )
+        if getattr(self.collection, "quantized", False):
+            logger.info(
+                f"{self.collection.quantization} vectors of "
+                f"{self.collection_name} hold "
+                f"{self.collection.nbytes / 2**20:.1f} MiB in memory."
+            )
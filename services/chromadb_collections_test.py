@@ -0,0 +1,220 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from usdchat.config.config import Config
+from usdchat.services.chromadb_collections import (ChromaDBCollections,
+                                                   layer_scope)
+from usdchat.services.numpy_vector_store import NumpyCollection
+
+
+class CountingEmbedding:
+    """Deterministic stand-in for the embedding model that counts the
+    documents it embeds."""
+
+    def __init__(self):
+        self.embedded = 0
+
+    def __call__(self, documents):
+        self.embedded += len(documents)
+        return [
+            [byte / 255.0 for byte in hashlib.blake2b(
+                text.encode("utf-8"), digest_size=8).digest()]
+            for text in documents
+        ]
+
+
+class StubCollections(ChromaDBCollections):
+    def __init__(self, config, embedding):
+        super().__init__(config)
+        self._embedding = embedding
+
+    @property
+    def embedding_function(self):
+        return self._embedding
+
+
+def layer_text(name, sizes):
+    prims = [
+        f'def Cube "{name}_{idx}"\n{{\n    double size = {size}\n}}'
+        for idx, size in enumerate(sizes)
+    ]
+    return "#usda 1.0\n" + "\n".join(prims) + "\n"
+
+
+class CollectionsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        directory = self.directory
+
+        class TestConfig(Config):
+            WORKING_DIRECTORY = directory
+            COLLECTIONS_DATA_PATH = os.path.join(directory, "data")
+            VECTOR_STORE = "numpy"
+            NUMPY_STORE_PATH = os.path.join(directory, "store")
+            ANSWER_CACHE_PATH = os.path.join(directory, "answers.sqlite")
+            EMBEDDING_CACHE_MAX_ENTRIES = 0
+            CHUNKING_WORKERS = 1
+            CHUNK_TOKENS = 40
+
+        self.embedding = CountingEmbedding()
+        self.collections = StubCollections(TestConfig, self.embedding)
+        # Versions are tracked per name for the whole process.
+        self.name = self.id().rsplit(".", 1)[-1]
+        self.layers = {}
+
+    def tearDown(self):
+        self.collections.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write_layer(self, name, sizes, mtime):
+        path = os.path.join(self.directory, f"{name}.usda")
+        with open(path, "w") as f:
+            f.write(layer_text(name, sizes))
+        os.utime(path, ns=(mtime, mtime))
+        self.layers[name] = path
+
+    def update(self):
+        embedded = self.embedding.embedded
+        count = self.collections.update_collection_from_layers(
+            self.name,
+            [(path, path) for path in self.layers.values()],
+            len(self.layers),
+        )
+        return count, self.embedding.embedded - embedded
+
+    def stored(self, layer_name):
+        path = os.path.join(self.directory, f"{layer_name}.usda")
+        return self.collections.get_collection(self.name).get(
+            where={"layer": path})
+
+
+class CollectionUpdateTest(CollectionsTestCase):
+    def test_unchanged_rerun_embeds_nothing(self):
+        self.write_layer("a", range(24), 10**9)
+        self.write_layer("b", range(24, 48), 10**9)
+        count, embedded = self.update()
+        self.assertGreater(count, 0)
+        self.assertEqual(embedded, count)
+        version = self.collections.collection_version(self.name)
+
+        self.assertEqual(self.update(), (count, 0))
+        self.assertEqual(self.collections.collection_version(self.name), version)
+
+    def test_only_changed_chunks_are_embedded(self):
+        self.write_layer("a", range(24), 10**9)
+        self.write_layer("b", range(24, 48), 10**9)
+        count, _ = self.update()
+        before = set(self.stored("a")["ids"])
+
+        self.write_layer("a", [*range(23), 99], 2 * 10**9)
+        new_count, embedded = self.update()
+        after = set(self.stored("a")["ids"])
+        self.assertEqual(new_count, count)
+        self.assertEqual(embedded, len(after - before))
+        self.assertEqual(len(before - after), len(after - before))
+        self.assertLess(embedded, len(after))
+        self.assertTrue(
+            any("99" in doc for doc in self.stored("a")["documents"]))
+
+    def test_removed_layer_is_deleted(self):
+        self.write_layer("a", range(24), 10**9)
+        self.write_layer("b", range(24, 48), 10**9)
+        count, _ = self.update()
+        stored_b = len(self.stored("b")["ids"])
+
+        del self.layers["b"]
+        self.assertEqual(self.update(), (count - stored_b, 0))
+        self.assertEqual(self.collections.collection_layers(self.name),
+                         [self.layers["a"]])
+        self.assertEqual(self.stored("b")["ids"], [])
+
+    def test_duplicate_content_is_copied_not_embedded(self):
+        self.write_layer("a", range(24), 10**9)
+        count, embedded = self.update()
+        # b holds a copy of a's prims.
+        self.write_layer("b", range(24), 10**9)
+        shutil.copy(self.layers["a"], self.layers["b"])
+        new_count, embedded = self.update()
+        self.assertEqual((new_count, embedded), (2 * count, 0))
+        doc_id = self.stored("b")["ids"][0]
+        layers = {
+            occurrence[0]
+            for occurrence in self.collections.get_chunk_occurrences(
+                self.name, doc_id)
+        }
+        self.assertEqual(layers, set(self.layers.values()))
+
+    def test_copy_of_a_deleted_chunk_is_embedded(self):
+        self.write_layer("a", range(24), 10**9)
+        count, _ = self.update()
+        lost = self.stored("a")["ids"][:3]
+        self.collections.delete_from_collection(self.name, ids=lost)
+
+        self.write_layer("b", range(24), 10**9)
+        shutil.copy(self.layers["a"], self.layers["b"])
+        new_count, embedded = self.update()
+        self.assertEqual(embedded, 3)
+        self.assertEqual(new_count, 2 * count - 3)
+
+
+class HybridQueryTest(CollectionsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write_layer("a", range(24), 10**9)
+        self.write_layer("b", range(24, 48), 10**9)
+        self.update()
+
+    def test_identifier_match_is_fused_into_top_hits(self):
+        for name in ("a_7", "b_6"):
+            with self.subTest(name=name):
+                results = self.collections.hybrid_query_collection(
+                    self.name, f"where is {name} defined?", n_results=3)
+                self.assertEqual(len(results["ids"][0]), 3)
+                # The best BM25 hit ties at worst with the best vector hit.
+                self.assertTrue(any(
+                    f'"{name}"' in doc for doc in results["documents"][0][:2]))
+
+    def test_layer_scope_limits_both_retrievers(self):
+        results = self.collections.hybrid_query_collection(
+            self.name, "where is a_7 defined?", n_results=5,
+            where=layer_scope([self.layers["b"]]))
+        self.assertEqual(
+            {metadata["layer"] for metadata in results["metadatas"][0]},
+            {self.layers["b"]},
+        )
+        self.assertFalse(
+            any('"a_7"' in doc for doc in results["documents"][0]))
+
+
+class QueryCacheTest(CollectionsTestCase):
+    def query(self, text):
+        return self.collections.query_collection(
+            self.name, query_texts=[text], n_results=1)
+
+    def test_results_are_reused_until_the_collection_changes(self):
+        self.write_layer("a", range(24), 10**9)
+        self.update()
+        text = 'def Cube "new"'
+        first = self.query(text)
+        first["ids"][0].clear()
+        with mock.patch.object(
+            NumpyCollection, "query", side_effect=AssertionError("not cached")
+        ):
+            cached = self.query(text)
+        self.assertEqual(len(cached["ids"][0]), 1)
+        self.assertNotEqual(cached["ids"], [["new"]])
+
+        version = self.collections.collection_version(self.name)
+        self.collections.embed_and_add_documents(
+            self.name, [text], [{"layer": "new.usda"}], ["new"])
+        self.assertEqual(
+            self.collections.collection_version(self.name), version + 1)
+        self.assertEqual(self.query(text)["ids"], [["new"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
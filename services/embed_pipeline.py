@@ -0,0 +1,149 @@
+import logging
+import queue
+import threading
+import time
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+poll_seconds = 0.1
+_DONE = object()
+
+
+class StageStats:
+    """Items produced by a stage and the time it spent working on them, as
+    opposed to waiting for its input or for room in its output queue."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.wall_seconds = 0.0
+
+    @property
+    def rate(self):
+        return self.items / self.busy_seconds if self.busy_seconds else 0.0
+
+    @property
+    def utilization(self):
+        if not self.wall_seconds:
+            return 0.0
+        return self.busy_seconds / self.wall_seconds
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.items} items, {self.rate:.1f}/s, "
+            f"busy {self.utilization:.0%}"
+        )
+
+
+class EmbedPipeline:
+    """Runs a chain of stages concurrently, each on its own thread, with a
+    bounded queue between neighbours so memory stays flat however far one
+    stage gets ahead of the next.
+
+    A stage is a function taking an iterator over the items of the previous
+    stage (the source, for the first one) and yielding its own. Setting
+    stop_event makes every stage stop at its next item.
+    """
+
+    def __init__(self, stop_event=None, queue_size=4):
+        self.stop_event = stop_event or threading.Event()
+        self.queue_size = queue_size
+        self.stages = []
+        self.stats = []
+        self.cancelled = False
+        self._error = None
+
+    def add_stage(self, name, func):
+        self.stages.append((name, func))
+        return self
+
+    def run(self, source):
+        """Feeds source through all stages and returns the items yielded by
+        the last one. Raises the first error raised by any stage."""
+        self.stats = [StageStats(name) for name, _ in self.stages]
+        self._error = None
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        threads = []
+        for idx, (name, func) in enumerate(self.stages):
+            inputs = iter(source) if idx == 0 else self._drain(queues[idx - 1],
+                                                               self.stats[idx])
+            thread = threading.Thread(
+                target=self._run_stage,
+                args=(func, inputs, queues[idx], self.stats[idx]),
+                name=f"embed-{name}",
+                daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+
+        results = list(self._drain(queues[-1]))
+        for thread in threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+        self.cancelled = self.stop_event.is_set()
+        logger.info("Pipeline " + "; ".join(str(stats) for stats in self.stats))
+        return results
+
+    def bottleneck(self):
+        """The stage that spent the largest share of its time working."""
+        if not self.stats:
+            return None
+        return max(self.stats, key=lambda stats: stats.utilization)
+
+    def _drain(self, items, stats=None):
+        while not self.stop_event.is_set():
+            start = time.perf_counter()
+            try:
+                item = items.get(timeout=poll_seconds)
+            except queue.Empty:
+                continue
+            finally:
+                if stats:
+                    stats.busy_seconds -= time.perf_counter() - start
+            if item is _DONE:
+                return
+            yield item
+
+    def _put(self, output, item, stats):
+        start = time.perf_counter()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    output.put(item, timeout=poll_seconds)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            stats.busy_seconds -= time.perf_counter() - start
+
+    def _run_stage(self, func, inputs, output, stats):
+        start = time.perf_counter()
+        outputs = func(inputs)
+        try:
+            for item in outputs:
+                if not self._put(output, item, stats):
+                    break
+                stats.items += 1
+        except Exception as e:
+            logger.exception(f"Embed pipeline stage {stats.name} failed")
+            if self._error is None:
+                self._error = e
+            self.stop_event.set()
+        finally:
+            # Closing the source too lets it release what it holds, such as
+            # a pool of pending conversions.
+            for iterator in (outputs, inputs):
+                close = getattr(iterator, "close", None)
+                if close:
+                    close()
+            stats.wall_seconds = time.perf_counter() - start
+            stats.busy_seconds += stats.wall_seconds
+            busy_seconds = stats.busy_seconds
+            self._put(output, _DONE, stats)
+            stats.busy_seconds = busy_seconds
@@ -0,0 +1,203 @@
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from usdchat.utils.file_lock import acquire_directory_lock
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "index.npy"
+LEGACY_INDEX_FILENAME = "index.json"
+VECTORS_FILENAME = "vectors.npy"
+initial_capacity = 4096
+
+
+class EmbeddingCache:
+    """Keeps the vectors computed for chunk contents on disk, so text shared
+    between collections goes through the embedding model only once.
+
+    Every embedding model gets its own folder holding a memory-mapped
+    float32 array of vectors and an index.npy with the content digest and
+    last use time of each row. The least recently used rows are recycled
+    once more than max_entries are stored.
+
+    Only one instance at a time, in any process, may use a folder: it holds
+    a lock on it until close(). Opening a folder that is in use raises
+    BlockingIOError.
+    """
+
+    def __init__(self, directory, model_name, max_entries):
+        self.directory = os.path.join(
+            directory, re.sub(r"[^\w.-]", "_", model_name))
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._session_start = time.time()
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = acquire_directory_lock(self.directory)
+        self._discard_legacy_index()
+        self._vectors = self._open_vectors()
+        rows = len(self._vectors) if self._vectors is not None else 0
+        # entries maps digest to row, _last_used is indexed by row.
+        self.entries, self._last_used = self._load_index(rows)
+        used = set(self.entries.values())
+        self._free_rows = [row for row in range(rows - 1, -1, -1)
+                           if row not in used]
+
+    def close(self):
+        """Releases the folder without saving, call save() first."""
+        with self._lock:
+            self._vectors = None
+            if self._lock_file is not None:
+                # Closing the file releases the lock.
+                self._lock_file.close()
+                self._lock_file = None
+
+    def _index_path(self):
+        return os.path.join(self.directory, INDEX_FILENAME)
+
+    def _vectors_path(self):
+        return os.path.join(self.directory, VECTORS_FILENAME)
+
+    def _discard_legacy_index(self):
+        """Caches written before index.npy kept a JSON index that is too slow
+        to load at full size, they are rebuilt from scratch."""
+        legacy_path = os.path.join(self.directory, LEGACY_INDEX_FILENAME)
+        if os.path.exists(legacy_path):
+            logger.info(f"Discarding old embedding cache index {legacy_path}")
+            os.remove(legacy_path)
+            if os.path.exists(self._vectors_path()):
+                os.remove(self._vectors_path())
+
+    def _load_index(self, rows):
+        last_used = np.zeros(rows)
+        try:
+            index = np.load(self._index_path(), allow_pickle=False)
+            digests = index["digest"][:rows].tolist()
+            last_used[:len(digests)] = index["last_used"][:rows]
+        except (OSError, ValueError):
+            return {}, last_used
+        entries = {
+            digest.decode("ascii"): row
+            for row, digest in enumerate(digests)
+            if digest
+        }
+        return entries, last_used
+
+    def _open_vectors(self):
+        if not os.path.exists(self._vectors_path()):
+            return None
+        try:
+            return np.load(self._vectors_path(), mmap_mode="r+")
+        except (OSError, ValueError):
+            logger.warning(f"Discarding unreadable embedding cache {self.directory}")
+            return None
+
+    def _grow(self, dimensions, needed):
+        rows = len(self._vectors) if self._vectors is not None else 0
+        capacity = max(initial_capacity, rows * 2, rows + needed)
+        tmp_path = self._vectors_path() + ".tmp"
+        vectors = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float32,
+            shape=(capacity, dimensions))
+        if rows:
+            vectors[:rows] = self._vectors
+            self._vectors.flush()
+        vectors.flush()
+        del vectors
+        self._vectors = None
+        os.replace(tmp_path, self._vectors_path())
+        self._vectors = np.load(self._vectors_path(), mmap_mode="r+")
+        self._last_used = np.concatenate(
+            [self._last_used, np.zeros(capacity - rows)])
+        self._free_rows = list(range(capacity - 1, rows - 1, -1)) + self._free_rows
+
+    def lookup(self, digests):
+        """Returns a dict of digest to vector for the digests in the cache."""
+        found = {}
+        now = time.time()
+        with self._lock:
+            for digest in digests:
+                row = self.entries.get(digest)
+                if row is None or self._vectors is None:
+                    self.misses += 1
+                    continue
+                self._last_used[row] = now
+                found[digest] = self._vectors[row].tolist()
+                self.hits += 1
+        return found
+
+    def add(self, digests, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+        now = time.time()
+        with self._lock:
+            if (self._vectors is not None
+                    and self._vectors.shape[1] != vectors.shape[1]):
+                logger.warning("Embedding size changed, clearing the cache")
+                self.entries = {}
+                self._vectors = None
+                self._last_used = np.zeros(0)
+                self._free_rows = []
+                os.remove(self._vectors_path())
+            new = [d for d in digests if d not in self.entries]
+            if len(new) > len(self._free_rows):
+                self._grow(vectors.shape[1], len(new) - len(self._free_rows))
+            for digest, vector in zip(digests, vectors):
+                row = self.entries.get(digest)
+                if row is None:
+                    row = self._free_rows.pop()
+                    self.entries[digest] = row
+                self._last_used[row] = now
+                self._vectors[row] = vector
+
+    def evict(self):
+        """Releases the rows of the least recently used entries until at
+        most max_entries remain. Entries used in this session are kept."""
+        with self._lock:
+            excess = len(self.entries) - self.max_entries
+            if excess <= 0:
+                return
+            digests = list(self.entries)
+            rows = np.fromiter(
+                self.entries.values(), dtype=np.int64, count=len(digests))
+            last_used = self._last_used[rows]
+            evicted = 0
+            for idx in np.argsort(last_used, kind="stable")[:excess]:
+                if last_used[idx] >= self._session_start:
+                    break
+                self._free_rows.append(int(rows[idx]))
+                del self.entries[digests[idx]]
+                evicted += 1
+            logger.info(f"Evicted {evicted} cached embeddings")
+
+    def save(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+            width = max(map(len, self.entries), default=1)
+            index = np.zeros(
+                len(self._last_used),
+                dtype=[("digest", f"S{width}"), ("last_used", "f8")],
+            )
+            index["last_used"] = self._last_used
+            if self.entries:
+                index["digest"][list(self.entries.values())] = list(self.entries)
+            tmp_path = self._index_path() + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, index)
+            os.replace(tmp_path, self._index_path())
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from usdchat.services.embedding_cache import EmbeddingCache
+
+
+class EmbeddingCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def open_cache(self, max_entries=10):
+        cache = EmbeddingCache(self.directory, "text-embedding/test", max_entries)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_vectors_survive_a_reopen(self):
+        cache = self.open_cache()
+        cache.add(["a", "b"], [[1.0, 2.0], [3.0, 4.0]])
+        cache.save()
+        cache.close()
+
+        cache = self.open_cache()
+        self.assertEqual(
+            cache.lookup(["a", "b", "c"]), {"a": [1.0, 2.0], "b": [3.0, 4.0]})
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_folder_is_locked_until_closed(self):
+        cache = self.open_cache()
+        with self.assertRaises(BlockingIOError):
+            EmbeddingCache(self.directory, "text-embedding/test", 10)
+        cache.close()
+        self.open_cache()
+
+    def test_evicts_least_recently_used_from_earlier_sessions(self):
+        cache = self.open_cache(max_entries=2)
+        cache.add(["old", "older", "oldest"], [[1.0], [2.0], [3.0]])
+        cache._last_used[cache.entries["old"]] = 3
+        cache._last_used[cache.entries["older"]] = 2
+        cache._last_used[cache.entries["oldest"]] = 1
+        cache.save()
+        cache.close()
+
+        cache = self.open_cache(max_entries=2)
+        cache.evict()
+        self.assertEqual(set(cache.entries), {"old", "older"})
+        # The released row is reused before the file grows.
+        rows = len(cache._last_used)
+        cache.add(["new"], [[4.0]])
+        self.assertEqual(len(cache._last_used), rows)
+
+        cache.lookup(["older"])
+        cache.evict()
+        self.assertEqual(set(cache.entries), {"older", "new"})
+
+    def test_entries_used_this_session_are_kept(self):
+        cache = self.open_cache(max_entries=1)
+        cache.add(["a", "b"], [[1.0], [2.0]])
+        cache.evict()
+        self.assertEqual(set(cache.entries), {"a", "b"})
+
+    def test_legacy_json_index_is_discarded(self):
+        folder = os.path.join(self.directory, "text-embedding_test")
+        os.makedirs(folder)
+        with open(os.path.join(folder, "index.json"), "w") as f:
+            json.dump({"a": {"row": 0, "last_used": time.time()}}, f)
+
+        cache = self.open_cache()
+        self.assertEqual(cache.entries, {})
+        self.assertFalse(os.path.exists(os.path.join(folder, "index.json")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_FILENAME = "lexical.sqlite"
+TOKEN_PATTERN = re.compile(r"[\w:/.]+")
+PART_PATTERN = re.compile(r"[:/.]+")
+bm25_k1 = 1.2
+bm25_b = 0.75
+# Terms found in more than this share of the documents barely move BM25
+# scores but are expensive to look up, so queries skip them.
+max_document_frequency = 0.5
+
+
+def tokenize_usd(text):
+    """Splits USDA text or a question into lowercase terms. Prim paths and
+    namespaced properties are kept whole as well as split into their
+    parts, so both /World/Set/Chair_12 and Chair_12 match."""
+    terms = []
+    for match in TOKEN_PATTERN.findall(text.lower()):
+        token = match.strip(":/.")
+        if not token:
+            continue
+        parts = [part for part in PART_PATTERN.split(token) if part]
+        if len(parts) > 1 or match.startswith("/"):
+            terms.append(match.rstrip(":."))
+        terms.extend(parts)
+    return terms
+
+
+class LexicalIndex:
+    """A BM25 inverted index of a collection's chunks, stored in SQLite next
+    to the collection so it can be updated one chunk at a time."""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, LEXICAL_INDEX_FILENAME)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY, layer TEXT, length INTEGER);
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT, id TEXT, tf INTEGER, PRIMARY KEY (term, id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_id ON postings (id);
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT PRIMARY KEY, df INTEGER) WITHOUT ROWID;
+            """
+        )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def clear(self):
+        with self._lock, self._connection:
+            for table in ("documents", "postings", "terms"):
+                self._connection.execute(f"DELETE FROM {table}")
+
+    def add(self, ids, texts, layers):
+        """Indexes documents, replacing any already stored under the same
+        ids."""
+        self.delete(ids)
+        with self._lock, self._connection:
+            for doc_id, text, layer in zip(ids, texts, layers):
+                counts = Counter(tokenize_usd(text))
+                self._connection.execute(
+                    "INSERT INTO documents VALUES (?, ?, ?)",
+                    (doc_id, layer, sum(counts.values())),
+                )
+                self._connection.executemany(
+                    "INSERT INTO postings VALUES (?, ?, ?)",
+                    [(term, doc_id, tf) for term, tf in counts.items()],
+                )
+                self._connection.executemany(
+                    "INSERT INTO terms VALUES (?, 1) "
+                    "ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                    [(term,) for term in counts],
+                )
+
+    def delete(self, ids):
+        with self._lock, self._connection:
+            for doc_id in ids:
+                terms = [
+                    row[0] for row in self._connection.execute(
+                        "SELECT term FROM postings WHERE id = ?", (doc_id,))
+                ]
+                if not terms:
+                    continue
+                self._connection.executemany(
+                    "UPDATE terms SET df = df - 1 WHERE term = ?",
+                    [(term,) for term in terms],
+                )
+                self._connection.execute(
+                    "DELETE FROM postings WHERE id = ?", (doc_id,))
+                self._connection.execute(
+                    "DELETE FROM documents WHERE id = ?", (doc_id,))
+            self._connection.execute("DELETE FROM terms WHERE df <= 0")
+
+    def search(self, query, n_results, layers=None):
+        """Returns up to n_results (id, score) pairs, best first, optionally
+        only for documents from the given layers."""
+        terms = set(tokenize_usd(query))
+        if not terms:
+            return []
+        layers = set(layers) if layers is not None else None
+        with self._lock:
+            total, total_length = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM documents"
+            ).fetchone()
+            if not total:
+                return []
+            average_length = total_length / total
+            scores = Counter()
+            for term in terms:
+                row = self._connection.execute(
+                    "SELECT df FROM terms WHERE term = ?", (term,)
+                ).fetchone()
+                if not row or row[0] > total * max_document_frequency:
+                    continue
+                df = row[0]
+                idf = math.log((total - df + 0.5) / (df + 0.5) + 1)
+                for doc_id, tf, length, layer in self._connection.execute(
+                    "SELECT p.id, p.tf, d.length, d.layer FROM postings p "
+                    "JOIN documents d ON d.id = p.id WHERE p.term = ?",
+                    (term,),
+                ):
+                    if layers is not None and layer not in layers:
+                        continue
+                    scores[doc_id] += idf * tf * (bm25_k1 + 1) / (
+                        tf + bm25_k1 * (
+                            1 - bm25_b + bm25_b * length / average_length)
+                    )
+        return scores.most_common(n_results)
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM documents").fetchone()[0]
@@ -0,0 +1,65 @@
+import shutil
+import tempfile
+import unittest
+
+from usdchat.services.lexical_index import LexicalIndex, tokenize_usd
+
+DOCUMENTS = {
+    "chair": 'def Xform "Chair_12" {\n    rel material:binding = </Looks/Wood>\n}',
+    "table": 'def Xform "Table_3" {\n    token visibility = "inherited"\n}',
+    "lamp": 'def Xform "Lamp_1" {\n    token visibility = "invisible"\n}',
+    "sofa": 'def Xform "Sofa_2" {\n    double size = 2\n}',
+    "rug": 'def Xform "Rug_5" {\n    double size = 5\n}',
+}
+
+
+class TokenizeUsdTest(unittest.TestCase):
+    def test_paths_and_namespaces_are_kept_whole_and_split(self):
+        terms = tokenize_usd("Bind </World/Set/Chair_12> via material:binding.")
+        for term in ("/world/set/chair_12", "world", "set", "chair_12",
+                     "material:binding", "material", "binding", "bind", "via"):
+            self.assertIn(term, terms)
+        self.assertNotIn("material:binding.", terms)
+
+
+class LexicalIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index = LexicalIndex(self.directory)
+        self.index.add(
+            list(DOCUMENTS),
+            list(DOCUMENTS.values()),
+            ["a.usda", "a.usda", "b.usda", "b.usda", "b.usda"],
+        )
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def ids(self, query, n_results=5, layers=None):
+        return [doc_id for doc_id, _ in self.index.search(
+            query, n_results, layers)]
+
+    def test_exact_identifiers_rank_first(self):
+        self.assertEqual(self.ids("which material is on Chair_12?"), ["chair"])
+        self.assertEqual(self.ids("/Looks/Wood")[0], "chair")
+        self.assertEqual(
+            self.ids("invisible visibility")[:2], ["lamp", "table"])
+        self.assertEqual(self.ids("nothing matches this"), [])
+
+    def test_search_within_layers(self):
+        self.assertEqual(self.ids("visibility", layers=["b.usda"]), ["lamp"])
+        self.assertEqual(self.ids("Chair_12", layers=["b.usda"]), [])
+
+    def test_delete_and_replace(self):
+        self.index.delete(["chair"])
+        self.assertEqual(self.ids("Chair_12"), [])
+        self.assertEqual(len(self.index), 4)
+        self.index.add(["table"], ['def Xform "Chair_12" {}'], ["a.usda"])
+        self.assertEqual(self.ids("Chair_12"), ["table"])
+        self.assertEqual(self.ids("Table_3"), [])
+        self.assertEqual(len(self.index), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,691 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from usdchat.services.vector_store import VectorCollection, VectorStore
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+VECTORS_FILENAME = "vectors.npy"
+CODES_FILENAME = "codes.npy"
+SCALES_FILENAME = "scales.npy"
+RECORDS_FILENAME = "records.json"
+QUANTIZATIONS = ("none", "float16", "int8")
+DISTANCE_METRICS = ("cosine", "ip", "l2")
+initial_capacity = 1024
+# Rows scored per matrix multiplication, bounds the temporary score matrix.
+search_block_rows = 65536
+
+_COMPARISONS = {
+    "$eq": lambda value, operand: value == operand,
+    "$ne": lambda value, operand: value != operand,
+    "$gt": lambda value, operand: value is not None and value > operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+    "$in": lambda value, operand: value in operand,
+    "$nin": lambda value, operand: value not in operand,
+}
+
+
+def matches_where(metadata, where):
+    """Evaluates a ChromaDB metadata filter against one record."""
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, part) for part in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, part) for part in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if not _COMPARISONS[operator](value, operand):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def matches_document(document, where_document):
+    """Evaluates a ChromaDB document filter against one record."""
+    document = document or ""
+    for key, condition in where_document.items():
+        if key == "$and":
+            if not all(matches_document(document, part) for part in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_document(document, part) for part in condition):
+                return False
+        elif key == "$contains":
+            if condition not in document:
+                return False
+        elif key == "$not_contains":
+            if condition in document:
+                return False
+        else:
+            raise ValueError(f"Unsupported document filter {key}")
+    return True
+
+
+def generation_filename(filename, generation):
+    """vectors.npy of generation 2 is vectors.2.npy, generation 0 keeps the
+    plain name."""
+    if not generation:
+        return filename
+    stem, extension = os.path.splitext(filename)
+    return f"{stem}.{generation}{extension}"
+
+
+def distance_metric(metadata):
+    """The hnsw:space of collection metadata, cosine when it is not set."""
+    metric = (metadata or {}).get("hnsw:space", "cosine")
+    if metric not in DISTANCE_METRICS:
+        raise ValueError(
+            f"Unsupported distance metric {metric}, expected one of "
+            f"{', '.join(DISTANCE_METRICS)}"
+        )
+    return metric
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize(vectors, quantization):
+    """Returns the compact codes of normalized vectors, and for int8 the
+    per-vector scales that map codes back to values."""
+    if quantization == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class NumpyCollection(VectorCollection):
+    """A collection kept as one contiguous matrix of normalized embeddings,
+    searched exactly with a matrix product.
+
+    Since vectors are normalized every supported hnsw:space ranks rows the
+    same way. Distances are 1 - cosine similarity for "cosine" and "ip", and
+    the squared euclidean distance between the unit vectors for "l2".
+
+    The matrix is saved with np.save and memory-mapped when loaded, so a
+    collection that is only queried is never copied into memory.
+
+    With float16 or int8 quantization only the compact codes are held in
+    memory. Queries score the codes, then rerank the best
+    n_results * rerank_factor rows against the full precision vectors, which
+    stay in a memory-mapped file and are only paged in for that shortlist.
+
+    Deletes and vector updates write the arrays under the next generation's
+    file names, and records.json names the generation it belongs to, so a
+    crash before or after persist() finishes leaves ids and rows aligned.
+    """
+
+    def __init__(self, directory, name, embedding_function=None, metadata=None,
+                 quantization="none", rerank_factor=4, on_rename=None):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown vector quantization {quantization}")
+        self.directory = directory
+        self.name = name
+        self.embedding_function = embedding_function
+        self.metadata = metadata or {}
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self.on_rename = on_rename
+        self._lock = threading.RLock()
+        self._ids = []
+        self._rows = {}
+        self._documents = []
+        self._metadatas = []
+        self._vectors = None
+        self._codes = None
+        self._scales = None
+        self._size = 0
+        self._generation = 0
+        # Set once saved rows change, until persist() moves to it.
+        self._next_generation = None
+        self._writable = False
+        self._dirty = False
+        self._load()
+
+    @property
+    def quantized(self):
+        return self.quantization != "none"
+
+    @property
+    def nbytes(self):
+        """Memory held by the matrix queries scan."""
+        matrices = (self._codes, self._scales) if self.quantized else (
+            self._vectors,)
+        return sum(
+            matrix[: self._size].nbytes
+            for matrix in matrices if matrix is not None
+        )
+
+    def _path(self, filename, generation=None):
+        if generation is None:
+            generation = self._generation
+        return os.path.join(
+            self.directory, generation_filename(filename, generation))
+
+    def _working_generation(self):
+        if self._next_generation is None:
+            return self._generation
+        return self._next_generation
+
+    def _load(self):
+        records_path = os.path.join(self.directory, RECORDS_FILENAME)
+        if not os.path.exists(records_path):
+            return
+        with open(records_path, "r") as f:
+            records = json.load(f)
+        self.metadata = records.get("metadata") or self.metadata
+        self.quantization = records.get("quantization", "none")
+        self._generation = records.get("generation", 0)
+        self._ids = records["ids"]
+        self._documents = records["documents"]
+        self._metadatas = records["metadatas"]
+        self._rows = {doc_id: row for row, doc_id in enumerate(self._ids)}
+        self._size = len(self._ids)
+        if not self._size:
+            return
+        if self.quantized:
+            self._vectors = np.load(
+                self._path(VECTORS_FILENAME), mmap_mode="r+")
+            self._codes = np.load(self._path(CODES_FILENAME))
+            if self.quantization == "int8":
+                self._scales = np.load(self._path(SCALES_FILENAME))
+            self._writable = True
+        else:
+            self._vectors = np.load(
+                self._path(VECTORS_FILENAME), mmap_mode="r")
+
+    def _save_array(self, filename, array, generation):
+        path = self._path(filename, generation)
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, array)
+        os.replace(path + ".tmp", path)
+
+    def _remove_generation(self, generation):
+        for filename in (VECTORS_FILENAME, CODES_FILENAME, SCALES_FILENAME):
+            path = self._path(filename, generation)
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not remove {path}: {e}")
+
+    def persist(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            generation = self._working_generation()
+            if self._size and self.quantized:
+                self._vectors.flush()
+                self._save_array(
+                    CODES_FILENAME, self._codes[: self._size], generation)
+                if self._scales is not None:
+                    self._save_array(
+                        SCALES_FILENAME, self._scales[: self._size], generation)
+            elif self._size:
+                self._save_array(
+                    VECTORS_FILENAME, self._vectors[: self._size], generation)
+            records_path = os.path.join(self.directory, RECORDS_FILENAME)
+            with open(records_path + ".tmp", "w") as f:
+                json.dump(
+                    {
+                        "metadata": self.metadata,
+                        "quantization": self.quantization,
+                        "generation": generation,
+                        "ids": self._ids,
+                        "documents": self._documents,
+                        "metadatas": self._metadatas,
+                    },
+                    f,
+                )
+            os.replace(records_path + ".tmp", records_path)
+            self._dirty = False
+            previous, self._generation = self._generation, generation
+            self._next_generation = None
+            if previous != generation:
+                self._remove_generation(previous)
+
+    def _embed(self, documents):
+        if self.embedding_function is None:
+            raise ValueError(
+                f"Collection {self.name} has no embedding function")
+        return self.embedding_function(list(documents))
+
+    def _reserve(self, dimensions, extra):
+        """Makes room for extra more rows, copying a memory-mapped matrix
+        into memory before the first change."""
+        # Reloaded codes and scales only hold the saved rows while the
+        # vectors file keeps its spare capacity, so the smallest one counts.
+        capacity = min(
+            (len(matrix)
+             for matrix in (self._vectors, self._codes, self._scales)
+             if matrix is not None),
+            default=0,
+        )
+        if self._vectors is not None and self._vectors.shape[1] != dimensions:
+            raise ValueError(
+                f"Embedding dimension {dimensions} does not match collection "
+                f"dimensionality {self._vectors.shape[1]}"
+            )
+        if self._writable and self._size + extra <= capacity:
+            return
+        capacity = max(self._size + extra, capacity * 2, initial_capacity)
+        if not self.quantized:
+            vectors = np.empty((capacity, dimensions), dtype=np.float32)
+            if self._size:
+                vectors[: self._size] = self._vectors[: self._size]
+            self._vectors = vectors
+            self._writable = True
+            return
+        self._grow_vectors_file(capacity, dimensions)
+        codes = np.empty(
+            (capacity, dimensions),
+            dtype=np.float16 if self.quantization == "float16" else np.int8,
+        )
+        if self._size:
+            codes[: self._size] = self._codes[: self._size]
+        self._codes = codes
+        if self.quantization == "int8":
+            scales = np.empty(capacity, dtype=np.float32)
+            if self._size:
+                scales[: self._size] = self._scales[: self._size]
+            self._scales = scales
+
+    def _begin_rewrite(self):
+        """Called before saved rows change. Quantized collections move their
+        vectors to the next generation's file first, so the saved one stays
+        as records.json describes it until persist() replaces both."""
+        if self._next_generation is not None:
+            return
+        self._next_generation = self._generation + 1
+        if self.quantized and self._vectors is not None:
+            self._grow_vectors_file(len(self._vectors), self._vectors.shape[1])
+
+    def _grow_vectors_file(self, capacity, dimensions):
+        """Moves the full precision vectors to a larger memory-mapped file."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(VECTORS_FILENAME, self._working_generation())
+        tmp_path = path + ".tmp"
+        vectors = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float32,
+            shape=(capacity, dimensions))
+        if self._size:
+            vectors[: self._size] = self._vectors[: self._size]
+        vectors.flush()
+        del vectors
+        self._vectors = None
+        os.replace(tmp_path, path)
+        self._vectors = np.load(path, mmap_mode="r+")
+        self._writable = True
+
+    def _store(self, rows, vectors):
+        self._vectors[rows] = vectors
+        if self.quantized:
+            codes, scales = quantize(vectors, self.quantization)
+            self._codes[rows] = codes
+            if scales is not None:
+                self._scales[rows] = scales
+
+    def _select(self, ids=None, where=None, where_document=None):
+        if ids is not None:
+            rows = [self._rows[doc_id] for doc_id in ids if doc_id in self._rows]
+        else:
+            rows = range(self._size)
+        if where:
+            rows = [row for row in rows
+                    if matches_where(self._metadatas[row], where)]
+        if where_document:
+            rows = [row for row in rows
+                    if matches_document(self._documents[row], where_document)]
+        return list(rows)
+
+    def _records(self, rows, include):
+        result = {"ids": [self._ids[row] for row in rows]}
+        for field in ("embeddings", "documents", "metadatas"):
+            result[field] = None
+        if "embeddings" in include:
+            result["embeddings"] = [
+                self._vectors[row].tolist() for row in rows]
+        if "documents" in include:
+            result["documents"] = [self._documents[row] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self._metadatas[row] for row in rows]
+        return result
+
+    def add(self, ids, embeddings=None, metadatas=None, documents=None):
+        if len(set(ids)) != len(ids):
+            raise ValueError("Expected IDs to be unique")
+        with self._lock:
+            new = [idx for idx, doc_id in enumerate(ids)
+                   if doc_id not in self._rows]
+            if len(new) < len(ids):
+                logger.warning(
+                    f"Add of existing ids skipped in {self.name}: "
+                    f"{len(ids) - len(new)}"
+                )
+            if not new:
+                return
+            if embeddings is None:
+                embeddings = self._embed(documents[idx] for idx in new)
+                vectors = normalize(embeddings)
+            else:
+                vectors = normalize([embeddings[idx] for idx in new])
+            self._reserve(vectors.shape[1], len(new))
+            self._store(slice(self._size, self._size + len(new)), vectors)
+            for idx in new:
+                self._rows[ids[idx]] = self._size
+                self._ids.append(ids[idx])
+                self._documents.append(documents[idx] if documents else None)
+                self._metadatas.append(metadatas[idx] if metadatas else None)
+                self._size += 1
+            self._dirty = True
+
+    def get(self, ids=None, where=None, limit=None, where_document=None,
+            include=None):
+        include = include or ["metadatas", "documents"]
+        with self._lock:
+            rows = self._select(ids, where, where_document)
+            if limit is not None:
+                rows = rows[:limit]
+            return self._records(rows, include)
+
+    def update(self, ids, embeddings=None, metadatas=None, documents=None):
+        with self._lock:
+            present = [idx for idx, doc_id in enumerate(ids)
+                       if doc_id in self._rows]
+            if len(present) < len(ids):
+                logger.warning(
+                    f"Update of missing ids skipped in {self.name}: "
+                    f"{len(ids) - len(present)}"
+                )
+            if not present:
+                return
+            rows = [self._rows[ids[idx]] for idx in present]
+            if embeddings is None and documents is not None:
+                embeddings_for_rows = self._embed(
+                    documents[idx] for idx in present)
+            elif embeddings is not None:
+                embeddings_for_rows = [embeddings[idx] for idx in present]
+            else:
+                embeddings_for_rows = None
+            if embeddings_for_rows is not None:
+                vectors = normalize(embeddings_for_rows)
+                self._begin_rewrite()
+                self._reserve(vectors.shape[1], 0)
+                self._store(rows, vectors)
+            for idx, row in zip(present, rows):
+                if documents is not None:
+                    self._documents[row] = documents[idx]
+                if metadatas is not None:
+                    self._metadatas[row] = metadatas[idx]
+            self._dirty = True
+
+    def upsert(self, ids, embeddings=None, metadatas=None, documents=None):
+        with self._lock:
+            existing = [idx for idx, doc_id in enumerate(ids)
+                        if doc_id in self._rows]
+            new = [idx for idx, doc_id in enumerate(ids)
+                   if doc_id not in self._rows]
+
+            def pick(values, indices):
+                return None if values is None else [values[i] for i in indices]
+
+            for indices, write in ((existing, self.update), (new, self.add)):
+                if indices:
+                    write(
+                        ids=pick(ids, indices),
+                        embeddings=pick(embeddings, indices),
+                        metadatas=pick(metadatas, indices),
+                        documents=pick(documents, indices),
+                    )
+
+    def delete(self, ids=None, where=None, where_document=None):
+        with self._lock:
+            rows = set(self._select(ids, where, where_document))
+            if not rows:
+                return
+            keep = [row for row in range(self._size) if row not in rows]
+            self._begin_rewrite()
+            self._reserve(self._vectors.shape[1], 0)
+            for matrix in (self._vectors, self._codes, self._scales):
+                if matrix is not None:
+                    matrix[: len(keep)] = matrix[keep]
+            self._ids = [self._ids[row] for row in keep]
+            self._documents = [self._documents[row] for row in keep]
+            self._metadatas = [self._metadatas[row] for row in keep]
+            self._rows = {doc_id: row for row, doc_id in enumerate(self._ids)}
+            self._size = len(keep)
+            self._dirty = True
+
+    def query(self, query_embeddings=None, query_texts=None, n_results=10,
+              where=None, where_document=None, include=None):
+        include = include or ["metadatas", "documents", "distances"]
+        if query_embeddings is None:
+            query_embeddings = self._embed(query_texts)
+        queries = normalize(query_embeddings)
+        with self._lock:
+            rows = None
+            if where or where_document:
+                rows = np.array(
+                    self._select(None, where, where_document), dtype=np.int64)
+            if self.quantized:
+                top_rows, top_scores = self._top_k(
+                    queries, rows, n_results * self.rerank_factor)
+                top_rows, top_scores = self._rerank(
+                    queries, top_rows, n_results)
+            else:
+                top_rows, top_scores = self._top_k(queries, rows, n_results)
+            result = {"ids": []}
+            for field in ("embeddings", "documents", "metadatas", "distances"):
+                result[field] = [] if field in include else None
+            for query_rows, query_scores in zip(top_rows.tolist(), top_scores):
+                records = self._records(query_rows, include)
+                for field, values in records.items():
+                    if values is not None:
+                        result[field].append(values)
+                if "distances" in include:
+                    distances = 1.0 - query_scores
+                    if distance_metric(self.metadata) == "l2":
+                        distances *= 2.0
+                    result["distances"].append(distances.tolist())
+            return result
+
+    def _block_scores(self, queries, index):
+        if not self.quantized:
+            return queries @ self._vectors[index].T
+        scores = queries @ self._codes[index].astype(np.float32).T
+        if self._scales is not None:
+            scores *= self._scales[index]
+        return scores
+
+    def _top_k(self, queries, rows, k):
+        """Top k rows for every query, scoring search_block_rows rows per
+        matrix product."""
+        total = self._size if rows is None else len(rows)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, total, search_block_rows):
+            stop = min(start + search_block_rows, total)
+            if rows is None:
+                block_rows = np.arange(start, stop)
+                index = slice(start, stop)
+            else:
+                block_rows = index = rows[start:stop]
+            scores = np.concatenate(
+                [best_scores, self._block_scores(queries, index)], axis=1)
+            candidates = np.concatenate(
+                [best_rows, np.broadcast_to(block_rows, (len(queries), len(block_rows)))],
+                axis=1,
+            )
+            if scores.shape[1] > k:
+                keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                candidates = np.take_along_axis(candidates, keep, axis=1)
+            best_rows, best_scores = candidates, scores
+        order = np.argsort(-best_scores, axis=1)
+        return (
+            np.take_along_axis(best_rows, order, axis=1),
+            np.take_along_axis(best_scores, order, axis=1),
+        )
+
+    def _rerank(self, queries, shortlist, k):
+        """Rescores a shortlist of rows at full precision and keeps the
+        best k."""
+        if not shortlist.size:
+            return shortlist, np.empty(shortlist.shape, dtype=np.float32)
+        exact = np.einsum(
+            "qd,qmd->qm", queries, self._vectors[shortlist.ravel()].reshape(
+                shortlist.shape + (-1,)))
+        order = np.argsort(-exact, axis=1)[:, :k]
+        return (
+            np.take_along_axis(shortlist, order, axis=1),
+            np.take_along_axis(exact, order, axis=1),
+        )
+
+    def count(self):
+        return self._size
+
+    def modify(self, name=None, metadata=None):
+        with self._lock:
+            if metadata is not None:
+                distance_metric(metadata)
+                self.metadata = metadata
+                self._dirty = True
+            if name and name != self.name:
+                new_directory = os.path.join(
+                    os.path.dirname(self.directory), name)
+                if os.path.exists(self.directory):
+                    os.rename(self.directory, new_directory)
+                old_name, self.directory, self.name = self.name, new_directory, name
+                if self.on_rename is not None:
+                    self.on_rename(old_name, self)
+            self.persist()
+
+
+class NumpyVectorStore(VectorStore):
+    """Keeps every collection in memory as a NumPy matrix and searches it
+    by brute force. Faster than HNSW for the small per-shot collections
+    usdchat builds, and exact. New collections use the given quantization,
+    existing ones keep the one they were built with."""
+
+    def __init__(self, path, quantization="none", rerank_factor=4):
+        self.path = path
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self._lock = threading.Lock()
+        self._collections = {}
+        os.makedirs(self.path, exist_ok=True)
+
+    def _directory(self, name):
+        return os.path.join(self.path, name)
+
+    def _exists(self, name):
+        return name in self._collections or os.path.exists(
+            os.path.join(self._directory(name), RECORDS_FILENAME))
+
+    def _open(self, name, embedding_function=None, metadata=None):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = NumpyCollection(
+                self._directory(name),
+                name,
+                embedding_function,
+                metadata,
+                quantization=self.quantization,
+                rerank_factor=self.rerank_factor,
+                on_rename=self._renamed,
+            )
+            self._collections[name] = collection
+        if embedding_function is not None:
+            collection.embedding_function = embedding_function
+        return collection
+
+    def _renamed(self, old_name, collection):
+        with self._lock:
+            self._collections.pop(old_name, None)
+            self._collections[collection.name] = collection
+
+    def create_collection(self, name, embedding_function=None, metadata=None):
+        distance_metric(metadata)
+        with self._lock:
+            if self._exists(name):
+                raise ValueError(f"Collection {name} already exists")
+            collection = self._open(name, embedding_function, metadata)
+            collection._dirty = True
+            collection.persist()
+            return collection
+
+    def get_collection(self, name, embedding_function=None):
+        with self._lock:
+            if not self._exists(name):
+                raise ValueError(f"Collection {name} does not exist")
+            return self._open(name, embedding_function)
+
+    def get_or_create_collection(self, name, embedding_function=None,
+                                 metadata=None):
+        distance_metric(metadata)
+        with self._lock:
+            created = not self._exists(name)
+            collection = self._open(name, embedding_function, metadata)
+            if created:
+                collection._dirty = True
+                collection.persist()
+            return collection
+
+    def delete_collection(self, name):
+        with self._lock:
+            if not self._exists(name):
+                raise ValueError(f"Collection {name} does not exist")
+            self._collections.pop(name, None)
+            shutil.rmtree(self._directory(name), ignore_errors=True)
+
+    def list_collections(self):
+        with self._lock:
+            return [
+                self._open(name)
+                for name in sorted(os.listdir(self.path))
+                if self._exists(name)
+            ]
+
+    def reset(self):
+        with self._lock:
+            self._collections.clear()
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.makedirs(self.path, exist_ok=True)
+        return True
+
+    def heartbeat(self):
+        return time.time_ns()
+
+    def persist(self, name):
+        with self._lock:
+            collection = self._collections.get(name)
+        if collection is not None:
+            collection.persist()
+
+    def close(self):
+        with self._lock:
+            collections = list(self._collections.values())
+        for collection in collections:
+            collection.persist()
@@ -0,0 +1,158 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from usdchat.services.numpy_vector_store import NumpyVectorStore
+
+
+def random_vectors(count, dimensions=8, seed=0):
+    return np.random.default_rng(seed).standard_normal(
+        (count, dimensions)).tolist()
+
+
+class QuantizedCollectionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="usdchat_numpy_store_test_")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def reopen(self, quantization):
+        store = NumpyVectorStore(self.directory, quantization=quantization)
+        return store, store.get_collection("shot")
+
+    def test_add_and_delete_after_reload(self):
+        for quantization in ("float16", "int8"):
+            with self.subTest(quantization=quantization):
+                store = NumpyVectorStore(
+                    self.directory, quantization=quantization)
+                collection = store.create_collection("shot")
+                collection.add(
+                    ids=["a", "b", "c"], embeddings=random_vectors(3))
+                store.close()
+
+                store, collection = self.reopen(quantization)
+                collection.add(
+                    ids=[f"n{idx}" for idx in range(5)],
+                    embeddings=random_vectors(5, seed=1),
+                )
+                collection.add(ids=["one"], embeddings=random_vectors(1, seed=2))
+                collection.delete(ids=["b", "n3"])
+                self.assertEqual(collection.count(), 7)
+                store.close()
+
+                store, collection = self.reopen(quantization)
+                vectors = collection.get(
+                    ids=["one"], include=["embeddings"])["embeddings"]
+                result = collection.query(
+                    query_embeddings=vectors, n_results=1,
+                    include=["distances"])
+                self.assertEqual(result["ids"], [["one"]])
+                self.assertAlmostEqual(result["distances"][0][0], 0.0, places=5)
+                store.reset()
+
+    def test_query_with_no_matching_rows(self):
+        store = NumpyVectorStore(self.directory, quantization="int8")
+        collection = store.create_collection("shot")
+        collection.add(
+            ids=["a", "b"],
+            embeddings=random_vectors(2),
+            metadatas=[{"layer": "a.usd"}, {"layer": "b.usd"}],
+            documents=["a", "b"],
+        )
+        result = collection.query(
+            query_embeddings=random_vectors(1), n_results=3,
+            where={"layer": "missing.usd"})
+        self.assertEqual(result["ids"], [[]])
+        self.assertEqual(result["documents"], [[]])
+        self.assertEqual(result["distances"], [[]])
+
+    def assert_rows_match_ids(self, quantization, ids):
+        store, collection = self.reopen(quantization)
+        self.assertEqual(collection.get()["ids"], ids)
+        for doc_id, vector in zip("abcd", random_vectors(4)):
+            if doc_id not in ids:
+                continue
+            result = collection.query(
+                query_embeddings=[vector], n_results=1, include=[])
+            self.assertEqual(result["ids"], [[doc_id]])
+
+    def test_crash_during_delete_keeps_rows_aligned(self):
+        ids = ["a", "b", "c", "d"]
+        for quantization in ("none", "float16", "int8"):
+            with self.subTest(quantization=quantization):
+                store = NumpyVectorStore(
+                    self.directory, quantization=quantization)
+                collection = store.create_collection("shot")
+                collection.add(ids=ids, embeddings=random_vectors(4))
+                store.close()
+
+                # Crash before persist.
+                store, collection = self.reopen(quantization)
+                collection.delete(ids=["b"])
+                if collection._vectors is not None and quantization != "none":
+                    collection._vectors.flush()
+                self.assert_rows_match_ids(quantization, ids)
+
+                # Crash after the arrays are written, before the records.
+                store, collection = self.reopen(quantization)
+                collection.delete(ids=["b"])
+                with mock.patch(
+                    "usdchat.services.numpy_vector_store.json.dump",
+                    side_effect=OSError("disk full"),
+                ):
+                    with self.assertRaises(OSError):
+                        collection.persist()
+                self.assert_rows_match_ids(quantization, ids)
+
+                store, collection = self.reopen(quantization)
+                collection.delete(ids=["b"])
+                store.close()
+                self.assert_rows_match_ids(quantization, ["a", "c", "d"])
+                self.assertEqual(
+                    sorted(os.listdir(os.path.join(self.directory, "shot"))),
+                    sorted(["records.json", "vectors.1.npy"]
+                           + (["codes.1.npy"] if quantization != "none" else [])
+                           + (["scales.1.npy"] if quantization == "int8" else [])),
+                )
+                store.reset()
+
+
+class DistanceMetricTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="usdchat_numpy_store_test_")
+        self.store = NumpyVectorStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def distances(self, metric):
+        collection = self.store.create_collection(
+            metric, metadata={"hnsw:space": metric})
+        collection.add(ids=["same", "opposite"],
+                       embeddings=[[3.0, 4.0], [-3.0, -4.0]])
+        result = collection.query(
+            query_embeddings=[[0.6, 0.8]], n_results=2, include=["distances"])
+        self.assertEqual(result["ids"], [["same", "opposite"]])
+        return result["distances"][0]
+
+    def test_distances_follow_the_metric(self):
+        for metric, expected in (
+                ("cosine", [0.0, 2.0]), ("ip", [0.0, 2.0]), ("l2", [0.0, 4.0])):
+            with self.subTest(metric=metric):
+                for distance, value in zip(self.distances(metric), expected):
+                    self.assertAlmostEqual(distance, value, places=5)
+
+    def test_unsupported_metric_raises(self):
+        with self.assertRaises(ValueError):
+            self.store.get_or_create_collection(
+                "shot", metadata={"hnsw:space": "manhattan"})
+        self.assertEqual(self.store.list_collections(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
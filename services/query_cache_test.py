@@ -0,0 +1,34 @@
+import unittest
+
+from usdchat.services.query_cache import LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_least_recently_used_entry_is_dropped(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+        self.assertEqual(cache.hit_rate, 0.75)
+
+    def test_discard_where(self):
+        cache = LRUCache(10)
+        for key in (("shot", 1), ("shot", 2), ("asset", 1)):
+            cache.put(key, key)
+        cache.discard_where(lambda key: key[0] == "shot")
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get(("asset", 1)), ("asset", 1))
+
+    def test_zero_entries_disables_caching(self):
+        cache = LRUCache(0)
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import logging
+import time
+
+from usdchat.services.query_cache import LRUCache
+from usdchat.utils.chunk_dedup import chunk_digest
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """Scores (question, chunk) pairs with a small sentence-transformers
+    cross-encoder on the CPU. Scores are cached by question and chunk
+    content, so chunks that keep coming back are only scored once."""
+
+    def __init__(self, model_name, batch_size=16, cache_size=10000):
+        # Imported here so sentence-transformers only loads when reranking.
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = CrossEncoder(model_name, device="cpu")
+        self.scores = LRUCache(cache_size)
+
+    def rerank(self, query_text, documents, top_n, latency_budget):
+        """Returns the indices of the top_n documents, best first.
+
+        Candidates are scored in batches in the order given, and scoring
+        stops once latency_budget seconds are spent. Unscored candidates
+        then follow the scored ones in their original order.
+        """
+        start = time.perf_counter()
+        keys = [(query_text, chunk_digest(document)) for document in documents]
+        scores = {}
+        pending = []
+        for idx, key in enumerate(keys):
+            score = self.scores.get(key)
+            if score is None:
+                pending.append(idx)
+            else:
+                scores[idx] = score
+
+        scored_batches = 0
+        for batch_start in range(0, len(pending), self.batch_size):
+            if time.perf_counter() - start > latency_budget:
+                logger.info(
+                    f"Rerank latency budget spent, "
+                    f"{len(pending) - batch_start} candidates left unscored."
+                )
+                break
+            batch = pending[batch_start: batch_start + self.batch_size]
+            batch_scores = self.model.predict(
+                [(query_text, documents[idx]) for idx in batch],
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+            )
+            for idx, score in zip(batch, batch_scores):
+                scores[idx] = float(score)
+                self.scores.put(keys[idx], float(score))
+            scored_batches += 1
+
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        ranked += [idx for idx in range(len(documents)) if idx not in scores]
+        logger.info(
+            f"Reranked {len(documents)} candidates in "
+            f"{time.perf_counter() - start:.3f}s "
+            f"({len(documents) - len(pending)} cached, "
+            f"{scored_batches} batches scored)."
+        )
+        return ranked[:top_n]
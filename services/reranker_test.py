@@ -0,0 +1,53 @@
+import sys
+import types
+import unittest
+from unittest import mock
+
+from usdchat.services.reranker import CrossEncoderReranker
+
+
+class KeywordCrossEncoder:
+    """Scores a chunk by how often it mentions the question's last word."""
+
+    def __init__(self, model_name, device=None):
+        self.predicted = 0
+
+    def predict(self, pairs, batch_size=16, show_progress_bar=False):
+        self.predicted += len(pairs)
+        return [
+            float(document.count(question.split()[-1]))
+            for question, document in pairs
+        ]
+
+
+class CrossEncoderRerankerTest(unittest.TestCase):
+    def setUp(self):
+        module = types.ModuleType("sentence_transformers")
+        module.CrossEncoder = KeywordCrossEncoder
+        with mock.patch.dict(sys.modules, {"sentence_transformers": module}):
+            self.reranker = CrossEncoderReranker("test-model", batch_size=2)
+        self.documents = ["chair", "lamp lamp", "lamp", "rug", "lamp lamp lamp"]
+
+    def test_best_scores_first_and_cached(self):
+        self.assertEqual(
+            self.reranker.rerank("where is the lamp", self.documents, 3, 10.0),
+            [4, 1, 2],
+        )
+        self.assertEqual(self.reranker.model.predicted, 5)
+        self.assertEqual(
+            self.reranker.rerank(
+                "where is the lamp", self.documents[::-1], 2, 10.0),
+            [0, 3],
+        )
+        self.assertEqual(self.reranker.model.predicted, 5)
+
+    def test_unscored_candidates_keep_retrieval_order(self):
+        self.assertEqual(
+            self.reranker.rerank("where is the lamp", self.documents, 3, -1.0),
+            [0, 1, 2],
+        )
+        self.assertEqual(self.reranker.model.predicted, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import logging
+import threading
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_resources = {}
+
+
+class _SharedEntry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.resource = None
+        self.created = False
+        self.references = 0
+
+
+def acquire_shared(key, factory):
+    """Returns the process-wide resource registered under key and takes a
+    reference to it. factory builds the resource on first use; callers
+    asking for a resource that is still being built wait for it."""
+    with _lock:
+        entry = _resources.get(key)
+        if entry is None:
+            entry = _resources[key] = _SharedEntry()
+        entry.references += 1
+
+    with entry.lock:
+        if not entry.created:
+            try:
+                entry.resource = factory()
+            except Exception:
+                with _lock:
+                    entry.references -= 1
+                    if not entry.references and _resources.get(key) is entry:
+                        del _resources[key]
+                raise
+            entry.created = True
+            logger.info(f"Created shared {key[0]} {key[1:]}")
+    return entry.resource
+
+
+def release_shared(key):
+    """Drops a reference taken by acquire_shared and tears the resource down
+    once nothing uses it any more."""
+    with _lock:
+        entry = _resources.get(key)
+        if entry is None:
+            return
+        entry.references -= 1
+        if entry.references > 0:
+            return
+        del _resources[key]
+
+    close = getattr(entry.resource, "close", None)
+    if callable(close):
+        close()
+    logger.info(f"Released shared {key[0]} {key[1:]}")
+
+
+def shared_references(key):
+    with _lock:
+        entry = _resources.get(key)
+        return entry.references if entry else 0
@@ -0,0 +1,118 @@
+from abc import ABC, abstractmethod
+
+
+class VectorCollection(ABC):
+    """The collection operations ChromaDBCollections relies on. Arguments
+    and results follow ChromaDB's collection API, so chromadb's own
+    Collection objects are used as they are."""
+
+    name: str
+
+    @abstractmethod
+    def add(self, ids, embeddings=None, metadatas=None, documents=None):
+        pass
+
+    @abstractmethod
+    def get(self, ids=None, where=None, limit=None, where_document=None,
+            include=None):
+        pass
+
+    @abstractmethod
+    def update(self, ids, embeddings=None, metadatas=None, documents=None):
+        pass
+
+    @abstractmethod
+    def upsert(self, ids, embeddings=None, metadatas=None, documents=None):
+        pass
+
+    @abstractmethod
+    def delete(self, ids=None, where=None, where_document=None):
+        pass
+
+    @abstractmethod
+    def query(self, query_embeddings=None, query_texts=None, n_results=10,
+              where=None, where_document=None, include=None):
+        pass
+
+    @abstractmethod
+    def count(self):
+        pass
+
+    @abstractmethod
+    def modify(self, name=None, metadata=None):
+        pass
+
+
+class VectorStore(ABC):
+    """A database of named vector collections."""
+
+    @abstractmethod
+    def create_collection(self, name, embedding_function=None, metadata=None):
+        pass
+
+    @abstractmethod
+    def get_collection(self, name, embedding_function=None):
+        pass
+
+    @abstractmethod
+    def get_or_create_collection(self, name, embedding_function=None,
+                                 metadata=None):
+        pass
+
+    @abstractmethod
+    def delete_collection(self, name):
+        pass
+
+    @abstractmethod
+    def list_collections(self):
+        """Returns the collections, each with a name attribute."""
+
+    @abstractmethod
+    def reset(self):
+        pass
+
+    @abstractmethod
+    def heartbeat(self):
+        pass
+
+    def persist(self, name):
+        """Makes changes to a collection durable; stores that write through
+        have nothing to do."""
+
+
+class ChromaVectorStore(VectorStore):
+    """ChromaDB's persistent client, backed by HNSW and SQLite."""
+
+    def __init__(self, path):
+        # Imported here so the other backends work without chromadb.
+        import chromadb
+
+        self.client = chromadb.PersistentClient(path=path)
+
+    def create_collection(self, name, embedding_function=None, metadata=None):
+        return self.client.create_collection(
+            name=name, embedding_function=embedding_function, metadata=metadata
+        )
+
+    def get_collection(self, name, embedding_function=None):
+        return self.client.get_collection(
+            name=name, embedding_function=embedding_function
+        )
+
+    def get_or_create_collection(self, name, embedding_function=None,
+                                 metadata=None):
+        return self.client.get_or_create_collection(
+            name=name, embedding_function=embedding_function, metadata=metadata
+        )
+
+    def delete_collection(self, name):
+        self.client.delete_collection(name=name)
+
+    def list_collections(self):
+        return self.client.list_collections()
+
+    def reset(self):
+        return self.client.reset()
+
+    def heartbeat(self):
+        return self.client.heartbeat()
@@ -0,0 +1,122 @@
+import logging
+import re
+from typing import Optional
+
+import numpy as np
+
+from usdchat.config.config import Config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+array_summary_min_elements = Config.ARRAY_SUMMARY_MIN_ELEMENTS
+array_summary_samples = Config.ARRAY_SUMMARY_SAMPLES
+
+ARRAY_PATTERN = re.compile(r"\[([^\[\]]*)\]")
+ARRAY_TYPE_PATTERN = re.compile(r"\b(\w+)\[\]\s")
+NON_INTEGER_PATTERN = re.compile(r"[.eEna]")
+_SEPARATORS = str.maketrans("(),", "   ")
+
+
+def _format_value(value, is_integer):
+    if is_integer:
+        return str(int(value))
+    return f"{value:.4g}"
+
+
+def _format_element(values, is_integer):
+    if values.size == 1:
+        return _format_value(values[0], is_integer)
+    return "(" + ", ".join(_format_value(v, is_integer) for v in values) + ")"
+
+
+def _first_tuple(body):
+    start = body.index("(")
+    depth = 0
+    for idx in range(start, len(body)):
+        if body[idx] == "(":
+            depth += 1
+        elif body[idx] == ")":
+            depth -= 1
+            if depth == 0:
+                return body[start: idx + 1]
+    return body[start:]
+
+
+def summarize_array(
+    body: str,
+    min_elements: int = array_summary_min_elements,
+    samples: int = array_summary_samples,
+    type_name: str = "",
+) -> Optional[str]:
+    """Describes the contents of a numeric USDA array literal.
+
+    body is the text between the brackets, either scalars or tuples, and
+    type_name the declared element type if known. Returns None when the
+    array is too small to bother with or is not numeric (tokens, strings,
+    asset paths).
+    """
+    if body.count(",") + 1 < min_elements:
+        return None
+
+    width = 1
+    if "(" in body:
+        width = len(_first_tuple(body).translate(_SEPARATORS).split())
+
+    cleaned = body.translate(_SEPARATORS)
+    try:
+        values = np.array(cleaned.split(), dtype=np.float64)
+    except ValueError:
+        return None
+    if values.size == 0 or values.size % width:
+        return None
+
+    count = values.size // width
+    if count < min_elements:
+        return None
+
+    is_integer = NON_INTEGER_PATTERN.search(cleaned) is None
+    elements = values.reshape(count, width)
+    finite = elements[np.isfinite(elements).all(axis=1)]
+    if not finite.size:
+        finite = elements
+    kind = type_name
+    if not kind:
+        kind = "int" if is_integer else "float"
+        if width > 1:
+            kind += str(width)
+
+    first = ", ".join(
+        _format_element(element, is_integer) for element in elements[:samples]
+    )
+    return (
+        f"{count} x {kind}; "
+        f"min {_format_element(finite.min(axis=0), is_integer)}; "
+        f"max {_format_element(finite.max(axis=0), is_integer)}; "
+        f"first {first}; "
+        f"last {_format_element(elements[-1], is_integer)}"
+    )
+
+
+def summarize_arrays(
+    line: str,
+    min_elements: int = array_summary_min_elements,
+    samples: int = array_summary_samples,
+) -> str:
+    """Replaces every large numeric array on a line (points, normals,
+    indices, primvars, time samples) with a compact descriptor."""
+    # Anything shorter cannot hold min_elements comma separated values.
+    if "[" not in line or len(line) < 2 * min_elements:
+        return line
+
+    type_match = ARRAY_TYPE_PATTERN.search(line)
+    type_name = type_match.group(1) if type_match else ""
+
+    def replace(match):
+        summary = summarize_array(
+            match.group(1), min_elements, samples, type_name)
+        return match.group(0) if summary is None else f"[{summary}]"
+
+    return ARRAY_PATTERN.sub(replace, line)
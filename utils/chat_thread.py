@@ -1,7 +1,5 @@
 from PySide6.QtCore import QThread, Signal
 
-from usdchat import chat_bridge
-
 
 class ChatThread(QThread):
     signal_bot_response = Signal(str)
@@ -24,14 +22,6 @@ class ChatThread(QThread):
         self.all_responses = ""
         self.usdviewApi = usdviewApi
         self.config = config
-        self.finished.connect(
-            chat_bridge.ChatBridge(
-                self.chat_bot,
-                self.chat_widget,
-                self.usdviewApi,
-                config=self.config,
-            ).clean_up_thread
-        )
 
     def run(self):
         response_generator = self.chat_bot.stream_chat(self.messages)
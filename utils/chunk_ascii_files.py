@@ -1,10 +1,19 @@
+import collections
+import itertools
 import logging
+import mmap
+import multiprocessing
+import os
+import queue
 import re
-from typing import List
-
-import tiktoken
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List
 
 from usdchat.config.config import Config
+from usdchat.utils.array_summary import summarize_arrays
+from usdchat.utils.tokenizer_registry import (find_texts_over_token_limit,
+                                              get_tokenizer)
+from usdchat.utils.usda_chunker import Chunk, iter_usda_chunks
 
 logging.basicConfig(
     level=logging.INFO,
@@ -13,19 +22,22 @@ logger = logging.getLogger(__name__)
 
 tokenizer_model = Config.TOKENIZER_MODEL
 max_embedding_tokens = Config.MAX_EMBEDDING_TOKENS
-
-
-def num_tokens_from_text(text: str, model: str = tokenizer_model) -> int:
-    encoding = tiktoken.encoding_for_model(model)
-    token_count = len(encoding.encode(text))
-    return token_count
+chunk_strategy = Config.CHUNK_STRATEGY
+chunking_workers = Config.CHUNKING_WORKERS
+summarize_arrays_enabled = Config.SUMMARIZE_ARRAYS
+line_block_size = 4096
+mmap_min_bytes = 64 * 1024 * 1024
+read_buffer_bytes = 1024 * 1024
+worker_batch_chunks = 256
+worker_queue_batches = 4
+queue_poll_seconds = 0.1
 
 
 def split_long_line(
     line: str, max_tokens: int, model: str = tokenizer_model
 ) -> List[str]:
-    encoding = tiktoken.encoding_for_model(model)
-    tokens = encoding.encode(line)
+    encoding = get_tokenizer(model)
+    tokens = encoding.encode_ordinary(line)
     if len(tokens) <= max_tokens:
         return [line]
     chunks = []
@@ -41,73 +53,232 @@ def shorten_last_list(
         max_tokens: int,
         model: str = tokenizer_model) -> str:
     pattern = re.compile(r"\[([^\]]+)\]")
-    matches = pattern.findall(line)
+    matches = list(pattern.finditer(line))
     if not matches:
         split_long_line(line, max_tokens, model)
         return line
     last_match = matches[-1]
-    items = last_match.split(",")
+    items = last_match.group(1).split(",")
     shortened_items = items[:4] + items[-4:]
     shortened_list_str = ",".join(shortened_items)
-    shortened_text = re.sub(pattern, f"[{shortened_list_str}]", line, count=1)
-    return shortened_text
+    return (
+        f"{line[:last_match.start()]}[{shortened_list_str}]"
+        f"{line[last_match.end():]}"
+    )
+
+
+def is_usda_text(file, text):
+    return file.endswith(".usda") or text.lstrip().startswith("#usda")
+
 
+def iter_file_lines(file: str) -> Iterator[str]:
+    """Yields the lines of a file without reading it into memory at once.
 
-def split_text_to_chunks(
-    text: str,
+    Large files are memory-mapped so that the OS pages them in on demand,
+    smaller ones go through a buffered reader.
+    """
+    size = os.path.getsize(file)
+    if size == 0:
+        return
+    if size < mmap_min_bytes:
+        with open(
+            file, "r", encoding="utf-8", errors="ignore", buffering=read_buffer_bytes
+        ) as f:
+            yield from f
+        return
+
+    with open(file, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        for raw_line in iter(mapped.readline, b""):
+            yield raw_line.decode("utf-8", errors="ignore")
+
+
+def iter_line_chunks(
+    lines: Iterable[str],
     max_tokens: int = max_embedding_tokens,
     model: str = tokenizer_model,
-    signal_progress_update=None,
-    progress_range=(50, 60),
-) -> List[str]:
-    chunks = []
-    lines = text.split("\n")
-    total_lines = len(lines)
-    for idx, line in enumerate(lines):
-        if num_tokens_from_text(line, model) > max_tokens:
-            line = shorten_last_list(line, max_tokens, model)
-
-        # Report progress
-        if signal_progress_update:
-            progress = progress_range[0] + (
-                ((idx + 1) / total_lines) * (progress_range[1] - progress_range[0])
-            )
-            signal_progress_update.emit(
-                int(progress),
-                f"File Processing: {idx + 1}/{total_lines} files ({int(progress)}%)",
+    source: str = "",
+    summarize: bool = summarize_arrays_enabled,
+) -> Iterator[Chunk]:
+    line_numbers = itertools.count(1)
+    numbered = ((next(line_numbers), line.rstrip("\r\n")) for line in lines)
+    while True:
+        block = [
+            (number, line)
+            for number, line in itertools.islice(numbered, line_block_size)
+        ]
+        if not block:
+            return
+        texts = [line for _, line in block]
+        if summarize:
+            texts = [summarize_arrays(text) for text in texts]
+        for idx in find_texts_over_token_limit(texts, max_tokens, model):
+            texts[idx] = shorten_last_list(texts[idx], max_tokens, model)
+        for (number, _), text in zip(block, texts):
+            # Blank lines carry nothing worth embedding.
+            if text.strip():
+                yield Chunk(text, "", number, number, source)
+
+
+def iter_file_chunks(
+    file: str,
+    max_tokens: int = max_embedding_tokens,
+    model: str = tokenizer_model,
+    strategy: str = chunk_strategy,
+) -> Iterator[Chunk]:
+    lines = iter_file_lines(file)
+    first_line = next(lines, None)
+    if first_line is None:
+        return
+    lines = itertools.chain([first_line], lines)
+
+    if strategy == "prim" and is_usda_text(file, first_line):
+        yield from iter_usda_chunks(lines, max_tokens, model, source=file)
+    else:
+        yield from iter_line_chunks(lines, max_tokens, model, source=file)
+
+
+def _chunk_file(file, max_tokens, model, strategy, batches, cancelled):
+    """Process pool entry point, chunks a single file in a worker and sends
+    the chunks back through the bounded batches queue, None marking the end."""
+    try:
+        chunks = iter_file_chunks(file, max_tokens, model, strategy)
+        while True:
+            batch = list(itertools.islice(chunks, worker_batch_chunks))
+            if not batch or not _put_batch(batches, batch, cancelled):
+                return
+    finally:
+        _put_batch(batches, None, cancelled)
+
+
+def _put_batch(batches, batch, cancelled):
+    """Blocks while the queue is full, giving up once the run is cancelled."""
+    while not cancelled.is_set():
+        try:
+            batches.put(batch, timeout=queue_poll_seconds)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _iter_worker_chunks(batches, future):
+    while True:
+        try:
+            batch = batches.get(timeout=queue_poll_seconds)
+        except queue.Empty:
+            if future.done():
+                # Raises the worker's error, e.g. a broken pool.
+                future.result()
+            continue
+        if batch is None:
+            future.result()
+            return
+        yield from batch
+
+
+def _report_file_progress(
+        signal_progress_update,
+        files_done,
+        total_files,
+        progress_range):
+    if not signal_progress_update or not total_files:
+        return
+    progress = progress_range[0] + (
+        (files_done / total_files) * (progress_range[1] - progress_range[0])
+    )
+    signal_progress_update.emit(
+        int(progress),
+        f"File Processing: {files_done}/{total_files} files ({int(progress)}%)",
+    )
+
+
+def resolve_chunking_workers(workers, total_files):
+    """Maps the configured worker count to the processes actually used,
+    0 meaning one per CPU."""
+    workers = workers or os.cpu_count() or 1
+    return max(1, min(workers, total_files))
+
+
+def _iter_files_in_pool(files, max_tokens, model, strategy, workers):
+    """Chunks files in a process pool and yields (file, chunks) in input
+    order. Only a bounded window of files is in flight at any time, and each
+    worker blocks once its file has worker_queue_batches batches waiting."""
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager, ProcessPoolExecutor(
+        max_workers=workers, mp_context=context
+    ) as pool:
+        cancelled = manager.Event()
+
+        def submit(file):
+            batches = manager.Queue(worker_queue_batches)
+            future = pool.submit(
+                _chunk_file, file, max_tokens, model, strategy, batches, cancelled
             )
+            return file, batches, future
 
-        chunks.append(line)
-    return chunks
+        remaining = iter(files)
+        in_flight = collections.deque(
+            submit(file) for file in itertools.islice(remaining, workers * 2)
+        )
+        try:
+            while in_flight:
+                file, batches, future = in_flight.popleft()
+                next_file = next(remaining, None)
+                if next_file is not None:
+                    in_flight.append(submit(next_file))
+                yield file, _iter_worker_chunks(batches, future)
+        finally:
+            cancelled.set()
+            for _, _, future in in_flight:
+                future.cancel()
 
 
-def split_files_to_chunks(
+def iter_files_to_chunks(
     files,
     max_tokens=max_embedding_tokens,
     model=tokenizer_model,
     signal_progress_update=None,
     progress_range=(40, 50),
-):
-    chunks = []
-    total_files = len(files)
-    for idx, file in enumerate(files):
-        logger.info(f"processing file: {file}")
-        with open(file, "r", encoding="utf-8", errors="ignore") as f:
-            text = f.read()
-        if not text.strip():
-            logger.warning(f"No text available in file: {file}")
-            continue
+    strategy=chunk_strategy,
+    workers=chunking_workers,
+    total_files=None,
+) -> Iterator[Chunk]:
+    """Lazily chunks files, yielding chunks as they are produced so callers
+    never hold more than they consume.
 
-        # Report progress
-        if signal_progress_update:
-            progress = progress_range[0] + (
-                ((idx + 1) / total_files) * (progress_range[1] - progress_range[0])
-            )
-            signal_progress_update.emit(
-                int(progress),
-                f"File Processing: {idx + 1}/{total_files} files ({int(progress)}%)",
-            )
+    files may be any iterable; pass total_files for progress when it has no
+    length. With more than one worker and more than one file the files are
+    chunked in a process pool and merged back in the order of files.
+    """
+    if total_files is None:
+        total_files = len(files)
+    workers = resolve_chunking_workers(workers, total_files)
+    # Starting the pool costs more than chunking a single file, so wait for a
+    # second file before using it.
+    files = iter(files)
+    first_files = list(itertools.islice(files, 2))
+    files = itertools.chain(first_files, files)
+    if workers > 1 and len(first_files) > 1:
+        logger.info(f"Chunking {total_files} files with {workers} processes")
+        per_file = _iter_files_in_pool(
+            files, max_tokens, model, strategy, workers)
+    else:
+        per_file = (
+            (file, iter_file_chunks(file, max_tokens, model, strategy))
+            for file in files
+        )
 
-        chunks += split_text_to_chunks(text, max_tokens, model)
+    for idx, (file, chunks) in enumerate(per_file):
+        logger.info(f"processing file: {file}")
+        produced = False
+        for chunk in chunks:
+            produced = True
+            yield chunk
+        if not produced:
+            logger.warning(f"No text available in file: {file}")
 
-    return chunks
+        _report_file_progress(
+            signal_progress_update, idx + 1, total_files, progress_range
+        )
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from usdchat.utils import chunk_ascii_files
+from usdchat.utils.chunk_ascii_files import (iter_file_chunks,
+                                             iter_files_to_chunks,
+                                             resolve_chunking_workers)
+
+
+class ChunkFilesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def write_layers(self, count, prims=5):
+        return [
+            self.write(
+                f"layer_{idx}.usda",
+                "#usda 1.0\n" + "\n".join(
+                    f'def Cube "L{idx}_{prim}"\n{{\n    double size = {prim}\n}}'
+                    for prim in range(prims)
+                ),
+            )
+            for idx in range(count)
+        ]
+
+
+class StreamingTest(ChunkFilesTestCase):
+    def test_files_are_read_as_chunks_are_consumed(self):
+        files = self.write_layers(10)
+        pulled = []
+
+        def tracked():
+            for file in files:
+                pulled.append(file)
+                yield file
+
+        chunks = iter_files_to_chunks(
+            tracked(), max_tokens=40, workers=1, total_files=len(files))
+        first = next(chunks)
+        self.assertEqual(first.source, files[0])
+        self.assertLessEqual(len(pulled), 2)
+        rest = list(chunks)
+        self.assertEqual(len(pulled), len(files))
+        sources = [chunk.source for chunk in [first] + rest]
+        self.assertEqual(list(dict.fromkeys(sources)), files)
+
+    def test_line_strategy_and_empty_files(self):
+        text = "first line\n\nthird line\n"
+        path = self.write("notes.txt", text)
+        chunks = list(iter_file_chunks(path, max_tokens=40, strategy="line"))
+        self.assertEqual(
+            [(chunk.text, chunk.start_line) for chunk in chunks],
+            [("first line", 1), ("third line", 3)],
+        )
+        empty = self.write("empty.usda", "")
+        self.assertEqual(list(iter_files_to_chunks([empty], workers=1)), [])
+
+
+class ProcessPoolTest(ChunkFilesTestCase):
+    def chunks(self, files, workers, total_files=None):
+        return [
+            tuple(chunk)
+            for chunk in iter_files_to_chunks(
+                files, max_tokens=40, workers=workers, total_files=total_files)
+        ]
+
+    def test_worker_count(self):
+        self.assertEqual(resolve_chunking_workers(8, 3), 3)
+        self.assertEqual(resolve_chunking_workers(2, 30), 2)
+        self.assertEqual(resolve_chunking_workers(0, 1), 1)
+        self.assertGreaterEqual(resolve_chunking_workers(0, 30), 1)
+
+    def test_single_file_is_chunked_in_process(self):
+        # Only one of the stage's layers changed.
+        files = self.write_layers(1)
+        with mock.patch.object(
+            chunk_ascii_files, "_iter_files_in_pool",
+            side_effect=AssertionError("pool started"),
+        ):
+            self.assertTrue(
+                self.chunks(iter(files), workers=4, total_files=10))
+
+    def test_pool_matches_serial_order(self):
+        # More chunks than one worker batch in the middle file.
+        files = self.write_layers(1) + [
+            self.write("big.txt", "\n".join(
+                f"line {idx}" for idx in range(
+                    chunk_ascii_files.worker_batch_chunks * 2 + 10))),
+        ] + self.write_layers(3)[1:]
+        serial = self.chunks(files, workers=1)
+        self.assertEqual(self.chunks(files, workers=2), serial)
+
+    def test_pool_stops_when_closed_early(self):
+        files = self.write_layers(6)
+        chunks = iter_files_to_chunks(files, max_tokens=40, workers=2)
+        self.assertEqual(next(chunks).source, files[0])
+        chunks.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import hashlib
+import logging
+from typing import Dict, Tuple
+
+from usdchat.utils.usda_chunker import Chunk
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def normalize_chunk_text(text: str) -> str:
+    """Collapses whitespace so indentation and line breaks don't make
+    otherwise identical USDA text look different."""
+    return " ".join(text.split())
+
+
+def chunk_digest(text: str) -> str:
+    normalized = normalize_chunk_text(text).encode("utf-8")
+    return hashlib.blake2b(normalized, digest_size=16).hexdigest()
+
+
+def chunk_id(layer_path: str, digest: str) -> str:
+    """Stable id of a chunk: the same content in the same layer always maps
+    to the same id, wherever in the layer it moves."""
+    key = f"{layer_path}|{digest}".encode("utf-8")
+    return hashlib.blake2b(key, digest_size=16).hexdigest()
+
+
+class ChunkDeduplicator:
+    """Tracks which chunks were already seen and where each occurrence came
+    from, per layer, so repeated content is stored once per layer and
+    embedded once overall."""
+
+    def __init__(self):
+        self.layers: Dict[str, Dict[str, dict]] = {}
+        self.digests = set()
+        self.total_chunks = 0
+
+    def add(self, chunk: Chunk, layer_path: str) -> Tuple[str, str, bool]:
+        """Records an occurrence of chunk in layer_path and returns its id,
+        its digest and whether the id is new in this run."""
+        digest = chunk_digest(chunk.text)
+        doc_id = chunk_id(layer_path, digest)
+        location = [chunk.prim_path, chunk.start_line, chunk.end_line]
+        self.total_chunks += 1
+        self.digests.add(digest)
+        chunks = self.layers.setdefault(layer_path, {})
+        entry = chunks.get(doc_id)
+        if entry is None:
+            chunks[doc_id] = {"digest": digest, "locations": [location]}
+            return doc_id, digest, True
+        entry["locations"].append(location)
+        return doc_id, digest, False
+
+    def chunks(self, layer_path: str) -> Dict[str, dict]:
+        return self.layers.get(layer_path, {})
+
+    @property
+    def distinct_chunks(self) -> int:
+        return len(self.digests)
+
+    @property
+    def dedup_ratio(self) -> float:
+        """Chunks seen per distinct chunk, 1.0 means nothing was repeated."""
+        if not self.digests:
+            return 1.0
+        return self.total_chunks / len(self.digests)
@@ -0,0 +1,46 @@
+import unittest
+
+from usdchat.utils.chunk_dedup import ChunkDeduplicator, chunk_digest
+from usdchat.utils.usda_chunker import Chunk
+
+
+def make_chunk(text, prim_path="/A", start_line=1):
+    return Chunk(
+        text=text,
+        prim_path=prim_path,
+        start_line=start_line,
+        end_line=start_line + text.count("\n"),
+    )
+
+
+class ChunkDeduplicatorTest(unittest.TestCase):
+    def test_digest_ignores_whitespace(self):
+        self.assertEqual(
+            chunk_digest('def Cube "A"\n{\n    double size = 1\n}'),
+            chunk_digest('def Cube "A" {\n\tdouble size = 1 }'),
+        )
+        self.assertNotEqual(
+            chunk_digest("double size = 1"), chunk_digest("double size = 2"))
+
+    def test_repeats_are_stored_once_per_layer(self):
+        deduplicator = ChunkDeduplicator()
+        first = deduplicator.add(make_chunk("double size = 1"), "a.usda")
+        again = deduplicator.add(
+            make_chunk("double  size = 1", "/B", 9), "a.usda")
+        other_layer = deduplicator.add(make_chunk("double size = 1"), "b.usda")
+
+        self.assertTrue(first[2])
+        self.assertEqual(again, (first[0], first[1], False))
+        self.assertTrue(other_layer[2])
+        self.assertNotEqual(other_layer[0], first[0])
+        self.assertEqual(other_layer[1], first[1])
+        self.assertEqual(
+            deduplicator.chunks("a.usda")[first[0]]["locations"],
+            [["/A", 1, 1], ["/B", 9, 9]],
+        )
+        self.assertEqual(deduplicator.distinct_chunks, 1)
+        self.assertEqual(deduplicator.dedup_ratio, 3.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
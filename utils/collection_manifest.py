@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+def layer_fingerprint(layer_path, ascii_path):
+    """Identifies one revision of a layer by size and modification time of
+    the layer itself, or of its ASCII conversion if it isn't a local file."""
+    for path in (layer_path, ascii_path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    return ""
+
+
+class CollectionManifest:
+    """Records which layers a collection was built from and which chunk ids
+    each of them contributed, so a rebuild only touches changed layers.
+
+    layers maps a layer path to its fingerprint and its chunks, every chunk
+    id mapping to the content digest and the (prim_path, start_line,
+    end_line) locations it was found at in that layer.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, MANIFEST_FILENAME)
+        self.version = 0
+        self.settings = {}
+        self.layers = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.version = data.get("version", 0)
+        self.settings = data.get("settings", {})
+        self.layers = data.get("layers", {})
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "version": self.version,
+                    "settings": self.settings,
+                    "layers": self.layers,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.path)
+
+    def reset(self):
+        self.settings = {}
+        self.layers = {}
+
+    def is_unchanged(self, layer_path, fingerprint):
+        entry = self.layers.get(layer_path)
+        return bool(entry) and bool(
+            fingerprint) and entry["fingerprint"] == fingerprint
+
+    def chunks(self, layer_path):
+        entry = self.layers.get(layer_path)
+        return entry["chunks"] if entry else {}
+
+    def ids_by_digest(self):
+        """Maps every content digest to one chunk id that stores it."""
+        ids = {}
+        for entry in self.layers.values():
+            for chunk_id, chunk in entry["chunks"].items():
+                ids.setdefault(chunk["digest"], chunk_id)
+        return ids
+
+    def occurrences(self, digest):
+        """Every (layer_path, prim_path, start_line, end_line) at which
+        content with the given digest appears."""
+        return [
+            (layer_path, *location)
+            for layer_path, entry in self.layers.items()
+            for chunk in entry["chunks"].values()
+            if chunk["digest"] == digest
+            for location in chunk["locations"]
+        ]
+
+    def find_chunk(self, chunk_id):
+        for entry in self.layers.values():
+            chunk = entry["chunks"].get(chunk_id)
+            if chunk:
+                return chunk
+        return None
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from usdchat.utils.collection_manifest import (CollectionManifest,
+                                               layer_fingerprint)
+
+
+class CollectionManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_fingerprint_prefers_the_layer_over_its_conversion(self):
+        layer = os.path.join(self.directory, "a.usdc")
+        ascii_path = os.path.join(self.directory, "a.usda")
+        for path, mtime in ((layer, 10**9), (ascii_path, 2 * 10**9)):
+            with open(path, "w") as f:
+                f.write("data")
+            os.utime(path, ns=(mtime, mtime))
+        self.assertEqual(layer_fingerprint(layer, ascii_path), f"4:{10**9}")
+        self.assertEqual(
+            layer_fingerprint("anon:layer", ascii_path), f"4:{2 * 10**9}")
+        self.assertEqual(layer_fingerprint("anon:layer", "missing"), "")
+
+    def test_changes_survive_a_reload(self):
+        manifest = CollectionManifest(self.directory)
+        manifest.version = 3
+        manifest.layers["a.usda"] = {
+            "fingerprint": "4:1",
+            "chunks": {
+                "id1": {"digest": "d1", "locations": [["/A", 1, 4]]},
+                "id2": {"digest": "d2", "locations": [["/B", 5, 8]]},
+            },
+        }
+        manifest.layers["b.usda"] = {
+            "fingerprint": "4:1",
+            "chunks": {
+                "id3": {"digest": "d1", "locations": [["/A", 1, 4]]},
+            },
+        }
+        manifest.save()
+
+        manifest = CollectionManifest(self.directory)
+        self.assertEqual(manifest.version, 3)
+        self.assertTrue(manifest.is_unchanged("a.usda", "4:1"))
+        self.assertFalse(manifest.is_unchanged("a.usda", "4:2"))
+        self.assertFalse(manifest.is_unchanged("a.usda", ""))
+        self.assertFalse(manifest.is_unchanged("c.usda", "4:1"))
+        self.assertEqual(manifest.ids_by_digest(), {"d1": "id1", "d2": "id2"})
+        self.assertEqual(
+            sorted(manifest.occurrences("d1")),
+            [("a.usda", "/A", 1, 4), ("b.usda", "/A", 1, 4)],
+        )
+        self.assertEqual(manifest.find_chunk("id2")["digest"], "d2")
+        self.assertIsNone(manifest.find_chunk("missing"))
+
+
+if __name__ == "__main__":
+    unittest.main()
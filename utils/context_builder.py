@@ -0,0 +1,102 @@
+import logging
+from typing import Dict, List, Sequence, Tuple
+
+from usdchat.utils.tokenizer_registry import (num_tokens_from_text,
+                                              num_tokens_from_texts,
+                                              tokenizer_model)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Context windows by model name prefix, the longest matching prefix wins.
+MODEL_CONTEXT_TOKENS: Dict[str, int] = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+    "gpt-3.5-turbo-1106": 16385,
+    "gpt-3.5-turbo-0125": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-1106": 128000,
+    "gpt-4-0125": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+}
+default_context_tokens = 4096
+# Tokens the chat format adds around every message, and to prime the reply.
+tokens_per_message = 3
+tokens_per_reply = 3
+context_separator = "\n\n"
+
+
+def model_context_tokens(model: str) -> int:
+    matches = [prefix for prefix in MODEL_CONTEXT_TOKENS if model.startswith(prefix)]
+    if not matches:
+        logger.warning(
+            f"Unknown context size for {model}, assuming {default_context_tokens}."
+        )
+        return default_context_tokens
+    return MODEL_CONTEXT_TOKENS[max(matches, key=len)]
+
+
+def num_tokens_from_messages(
+    messages: Sequence[dict], model: str = tokenizer_model
+) -> int:
+    """Tokens a list of chat messages takes in a request."""
+    counts = num_tokens_from_texts(
+        [message.get("content") or "" for message in messages], model)
+    return sum(counts) + tokens_per_message * len(messages) + tokens_per_reply
+
+
+def context_token_budget(
+    messages: Sequence[dict],
+    model: str,
+    max_completion_tokens: int,
+    max_context_tokens: int,
+    context_size: int = 0,
+) -> int:
+    """Tokens left for retrieved context once the messages and the reply
+    fit in the model's context window, capped at max_context_tokens."""
+    context_size = context_size or model_context_tokens(model)
+    available = (
+        context_size
+        - max_completion_tokens
+        - num_tokens_from_messages(messages, model)
+    )
+    return max(0, min(available, max_context_tokens))
+
+
+def select_context_chunks(
+    chunks: Sequence[Tuple[str, str]],
+    token_budget: int,
+    model: str = tokenizer_model,
+) -> Tuple[List[str], int]:
+    """Picks chunks for the prompt from (key, text) pairs ranked best first.
+
+    Chunks repeating an earlier key are dropped, and a chunk that would
+    overrun token_budget is skipped so a smaller, lower ranked one can
+    still fit. Returns the selected texts and the tokens they use.
+    """
+    seen = set()
+    unique = []
+    for key, text in chunks:
+        if key not in seen:
+            seen.add(key)
+            unique.append(text)
+
+    separator_tokens = num_tokens_from_text(context_separator, model)
+    selected = []
+    used = 0
+    for text, tokens in zip(unique, num_tokens_from_texts(unique, model)):
+        cost = tokens + (separator_tokens if selected else 0)
+        if used + cost > token_budget:
+            continue
+        selected.append(text)
+        used += cost
+    logger.info(
+        f"Context: {len(selected)} of {len(unique)} unique chunks "
+        f"({len(chunks) - len(unique)} duplicates), "
+        f"{used}/{token_budget} tokens."
+    )
+    return selected, used
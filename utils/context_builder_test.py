@@ -0,0 +1,54 @@
+import unittest
+
+from usdchat.utils.context_builder import (context_separator,
+                                           context_token_budget,
+                                           model_context_tokens,
+                                           num_tokens_from_messages,
+                                           select_context_chunks)
+from usdchat.utils.tokenizer_registry import num_tokens_from_text
+
+
+class ContextBudgetTest(unittest.TestCase):
+    def test_longest_model_prefix_wins(self):
+        self.assertEqual(model_context_tokens("gpt-4"), 8192)
+        self.assertEqual(model_context_tokens("gpt-4-32k-0613"), 32768)
+        self.assertEqual(model_context_tokens("gpt-4o-mini"), 128000)
+        self.assertEqual(model_context_tokens("some-local-model"), 4096)
+
+    def test_budget_leaves_room_for_messages_and_reply(self):
+        messages = [
+            {"role": "system", "content": "You answer questions."},
+            {"role": "user", "content": "Where is the chair?"},
+        ]
+        used = num_tokens_from_messages(messages, "gpt-4")
+        self.assertEqual(
+            context_token_budget(messages, "gpt-4", 500, 10**6, 1000),
+            1000 - 500 - used,
+        )
+        self.assertEqual(
+            context_token_budget(messages, "gpt-4", 500, 100, 1000), 100)
+        self.assertEqual(
+            context_token_budget(messages, "gpt-4", 1000, 100, 1000), 0)
+
+
+class SelectContextChunksTest(unittest.TestCase):
+    def test_duplicates_dropped_and_chunks_over_budget_skipped(self):
+        big = "def Mesh " + "a " * 200
+        small = 'def Cube "Chair"'
+        chunks = [("1", small), ("1", small), ("2", big), ("3", "def Xform")]
+        separator = num_tokens_from_text(context_separator)
+        budget = (num_tokens_from_text(small) + separator
+                  + num_tokens_from_text("def Xform"))
+
+        selected, used = select_context_chunks(chunks, budget)
+        self.assertEqual(selected, [small, "def Xform"])
+        self.assertEqual(used, budget)
+
+        selected, used = select_context_chunks(chunks, budget - 1)
+        self.assertEqual(selected, [small])
+        self.assertEqual(used, num_tokens_from_text(small))
+        self.assertEqual(select_context_chunks(chunks, 0), ([], 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
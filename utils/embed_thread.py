@@ -1,9 +1,11 @@
 import logging
+import threading
 
 from PySide6.QtCore import QThread, Signal
 
 from usdchat.services.chromadb_collections import ChromaDBCollections
-from utils.resolve_stage_layers import resolve_all_layers
+from utils.resolve_stage_layers import (collect_stage_layers,
+                                        iter_converted_layers)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -15,41 +17,72 @@ class EmbedThread(QThread):
     signal_embed_complete = Signal(int)
     signal_progress_update = Signal(int, str)
 
-    def __init__(self, stage_path, collection_name, config=None):
+    def __init__(
+        self,
+        stage_path,
+        collection_name,
+        config=None,
+        load_mode="all",
+        load_paths=None,
+        include_all_variants=False,
+    ):
         super().__init__()
         self.stop_flag = False
+        self.stop_event = threading.Event()
         self.stage_path = stage_path
         self.collection_name = collection_name
         self.config = config
+        self.load_mode = load_mode
+        self.load_paths = load_paths or []
+        self.include_all_variants = include_all_variants
         self.chromadb_collections = ChromaDBCollections(config=self.config)
 
     def run(self):
-        final_paths = resolve_all_layers(
-            self.stage_path, self.signal_progress_update)
-        if self.stop_flag:
-            self.signal_progress_update.emit(0, "😭 Embedding cancelled.")
-            return
-
-        # self.chromadb_collections.reset_chromadb()
+        try:
+            self._embed_stage()
+        except Exception as e:
+            # Leaves the RAG frame waiting on a signal that never comes
+            # otherwise.
+            logger.exception(f"Embedding {self.stage_path} failed")
+            self.signal_progress_update.emit(0, f"😭 Embedding failed: {e}")
+            self.signal_embed_complete.emit(0)
+        finally:
+            self.chromadb_collections.close()
 
+    def _embed_stage(self):
+        layer_paths = collect_stage_layers(
+            self.stage_path,
+            config=self.config,
+            load_mode=self.load_mode,
+            load_paths=self.load_paths,
+            include_all_variants=self.include_all_variants,
+        )
         if self.stop_flag:
             self.signal_progress_update.emit(0, "😭 Embedding cancelled.")
             return
+        self.signal_progress_update.emit(
+            5, f"Resolving Stage: {len(layer_paths)} layers")
 
-        chunks = self.chromadb_collections.create_and_store_embeddings(
-            files=final_paths,
-            collection_name=self.collection_name,
+        # Layers are chunked and embedded while the rest are still being
+        # converted.
+        total_chunks = self.chromadb_collections.update_collection_from_layers(
+            self.collection_name,
+            iter_converted_layers(layer_paths, config=self.config),
+            len(layer_paths),
             signal_progress_update=self.signal_progress_update,
+            progress_range=(5, 100),
+            stop_event=self.stop_event,
         )
-        if self.stop_flag:
+        if self.stop_flag or total_chunks is None:
             self.signal_progress_update.emit(0, "😭 Embedding cancelled.")
             return
 
-        if chunks:
-            self.signal_embed_complete.emit(len(chunks))
+        if total_chunks:
+            self.signal_embed_complete.emit(total_chunks)
         else:
             logger.error("No chunks embedded.")
             self.signal_embed_complete.emit(0)
 
     def stop(self):
         self.stop_flag = True
+        self.stop_event.set()
@@ -0,0 +1,29 @@
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_FILENAME = "lock"
+
+
+def acquire_directory_lock(directory):
+    """Takes an exclusive lock on a cache folder, held until the returned
+    file is closed. Raises BlockingIOError if another process, or another
+    open cache in this one, already holds it."""
+    lock_file = open(os.path.join(directory, LOCK_FILENAME), "a+")
+    try:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            try:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+            except OSError as e:
+                raise BlockingIOError(*e.args) from e
+    except BaseException:
+        lock_file.close()
+        raise
+    return lock_file
@@ -0,0 +1,137 @@
+import hashlib
+import logging
+
+from usdchat.utils.context_builder import tokens_per_message
+from usdchat.utils.tokenizer_registry import get_tokenizer
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Messages the chat widget and ChatBridge write for code execution.
+tool_output_prefix = "python_output:"
+fix_request_marker = "I get the below error, please fix it."
+summary_header = "Summary of the earlier conversation:"
+summary_line_characters = 200
+
+
+def is_tool_output(message):
+    content = message.get("content") or ""
+    return content.startswith(tool_output_prefix) or fix_request_marker in content
+
+
+class HistoryCompactor:
+    """Trims a conversation to a token budget before it is sent.
+
+    Leading system messages are always kept. The newest messages are kept
+    verbatim until max_tokens is reached, except that tool outputs and
+    auto-fix requests are cut to their first and last tokens. Older
+    messages are dropped, and the user questions among them go into a
+    rolling summary of at most summary_tokens tokens.
+
+    Token counts are remembered per message, so each call only encodes
+    messages it has not seen before.
+    """
+
+    def __init__(self, model, max_tokens, summary_tokens, tool_output_tokens):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.tool_output_tokens = tool_output_tokens
+        self._counts = {}
+        self._previous_counts = {}
+
+    def _key(self, message):
+        content = f"{message.get('role')}\0{message.get('content') or ''}"
+        return hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+
+    def count(self, message):
+        key = self._key(message)
+        count = self._counts.get(key)
+        if count is None:
+            count = self._previous_counts.get(key)
+        if count is None:
+            encoding = get_tokenizer(self.model)
+            count = tokens_per_message + len(
+                encoding.encode_ordinary(message.get("content") or ""))
+        self._counts[key] = count
+        return count
+
+    def elide(self, message):
+        """Keeps the first and last tokens of a long tool output."""
+        if self.count(message) - tokens_per_message <= self.tool_output_tokens:
+            return message
+        encoding = get_tokenizer(self.model)
+        tokens = encoding.encode_ordinary(message["content"])
+        keep = self.tool_output_tokens // 2
+        content = (
+            f"{encoding.decode(tokens[:keep])}\n"
+            f"... [{len(tokens) - 2 * keep} tokens elided] ...\n"
+            f"{encoding.decode(tokens[-keep:])}"
+        )
+        return {**message, "content": content}
+
+    def summarize(self, messages):
+        """One line per user question, the newest that fit summary_tokens."""
+        budget = self.summary_tokens - self.count(
+            {"role": "system", "content": summary_header})
+        lines = []
+        for message in reversed(messages):
+            if message.get("role") != "user" or is_tool_output(message):
+                continue
+            question = " ".join((message.get("content") or "").split())
+            if len(question) > summary_line_characters:
+                question = question[:summary_line_characters] + "..."
+            line = f"- The user asked: {question}"
+            # Each line costs its own tokens plus a newline, close enough to
+            # the message overhead counted here.
+            budget -= self.count({"role": "system", "content": line})
+            if budget < 0:
+                break
+            lines.append(line)
+        if not lines:
+            return None
+        return {
+            "role": "system",
+            "content": "\n".join([summary_header] + lines[::-1]),
+        }
+
+    def compact(self, messages):
+        """Returns a new message list that fits max_tokens."""
+        leading = 0
+        while leading < len(messages) and messages[leading].get("role") == "system":
+            leading += 1
+        system = list(messages[:leading])
+        history = messages[leading:]
+        # Counts not used by this call belong to messages that are gone.
+        self._previous_counts, self._counts = self._counts, {}
+
+        budget = self.max_tokens - sum(self.count(message) for message in system)
+        budget -= self.summary_tokens if self.summary_tokens else 0
+        recent = []
+        used = 0
+        for idx in range(len(history) - 1, -1, -1):
+            message = history[idx]
+            if is_tool_output(message) and idx != len(history) - 1:
+                message = self.elide(message)
+            tokens = self.count(message)
+            if recent and used + tokens > budget:
+                break
+            recent.append(message)
+            used += tokens
+        recent.reverse()
+        dropped = history[: len(history) - len(recent)]
+
+        compacted = system
+        if dropped and self.summary_tokens:
+            summary = self.summarize(dropped)
+            if summary is not None:
+                compacted.append(summary)
+        compacted.extend(recent)
+        if dropped:
+            logger.info(
+                f"History: kept {len(recent)} of {len(history)} messages, "
+                f"{used} tokens verbatim."
+            )
+        return compacted
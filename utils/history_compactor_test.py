@@ -0,0 +1,70 @@
+import unittest
+
+from usdchat.utils.history_compactor import (HistoryCompactor,
+                                             summary_header,
+                                             tool_output_prefix)
+
+SYSTEM = {"role": "system", "content": "You are a very helpful ChatBot!"}
+
+
+def conversation(turns):
+    messages = [SYSTEM]
+    for idx in range(turns):
+        messages += [
+            {"role": "user", "content": f"Question {idx} about the stage?"},
+            {"role": "assistant", "content": f"Answer {idx}. " + "word " * 40},
+        ]
+    return messages
+
+
+class HistoryCompactorTest(unittest.TestCase):
+    def compactor(self, max_tokens, summary_tokens=60, tool_output_tokens=20):
+        return HistoryCompactor(
+            "gpt-4", max_tokens, summary_tokens, tool_output_tokens)
+
+    def test_short_history_is_unchanged(self):
+        messages = conversation(2)
+        self.assertEqual(self.compactor(10000).compact(messages), messages)
+
+    def test_old_messages_are_summarized_within_budget(self):
+        messages = conversation(20)
+        compactor = self.compactor(400)
+        compacted = compactor.compact(messages)
+
+        self.assertEqual(compacted[0], SYSTEM)
+        self.assertEqual(compacted[-1], messages[-1])
+        self.assertLessEqual(
+            sum(compactor.count(message) for message in compacted), 400)
+        summary = compacted[1]["content"]
+        self.assertTrue(summary.startswith(summary_header))
+        kept = compacted[2:]
+        first_kept = messages.index(kept[0])
+        self.assertEqual(kept, messages[first_kept:])
+        # The newest dropped questions are summarized, the oldest may not fit.
+        dropped_questions = [
+            message["content"] for message in messages[1:first_kept]
+            if message["role"] == "user"
+        ]
+        self.assertIn(dropped_questions[-1], summary)
+        self.assertNotIn("Answer", summary)
+
+    def test_without_summary_tokens_dropped_messages_are_gone(self):
+        compacted = self.compactor(400, summary_tokens=0).compact(
+            conversation(20))
+        self.assertFalse(
+            any(summary_header in message["content"] for message in compacted))
+
+    def test_older_tool_outputs_are_elided(self):
+        output = {
+            "role": "user",
+            "content": tool_output_prefix + " " + "line\n" * 200,
+        }
+        messages = [SYSTEM, output, {"role": "assistant", "content": "Done."},
+                    output]
+        compacted = self.compactor(10000).compact(messages)
+        self.assertIn("tokens elided", compacted[1]["content"])
+        self.assertEqual(compacted[-1], output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from usdchat.utils.file_lock import acquire_directory_lock
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "index.json"
+hash_block_bytes = 1024 * 1024
+
+
+def hash_file(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(hash_block_bytes), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class LayerConversionCache:
+    """Keeps USDA conversions of binary layers on disk between runs.
+
+    Entries are keyed on the layer's real path, size and modification time
+    (and optionally a hash of its contents), so an unchanged layer is never
+    converted twice. The least recently used entries are evicted once the
+    cache grows past max_bytes.
+
+    Only one instance at a time, in any process, may use a folder: it holds
+    a lock on it until close(). Opening a folder that is in use raises
+    BlockingIOError.
+    """
+
+    def __init__(self, directory, max_bytes, hash_content=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hash_content = hash_content
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._session_start = time.time()
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = acquire_directory_lock(self.directory)
+        self.entries = self._load_index()
+
+    def close(self):
+        """Releases the folder without saving, call save() first."""
+        with self._lock:
+            if self._lock_file is not None:
+                # Closing the file releases the lock.
+                self._lock_file.close()
+                self._lock_file = None
+
+    def _index_path(self):
+        return os.path.join(self.directory, INDEX_FILENAME)
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def key_for(self, layer_path) -> Optional[str]:
+        """Returns the cache key of a layer, or None if it isn't a plain
+        file that can be fingerprinted."""
+        try:
+            stat = os.stat(layer_path)
+        except OSError:
+            return None
+        parts = [os.path.realpath(layer_path), str(stat.st_size),
+                 str(stat.st_mtime_ns)]
+        if self.hash_content:
+            parts.append(hash_file(layer_path))
+        return hashlib.blake2b(
+            "|".join(parts).encode("utf-8"), digest_size=16
+        ).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, f"{key}.usda")
+
+    def lookup(self, key) -> Optional[str]:
+        path = self.entry_path(key)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and os.path.exists(path):
+                entry["last_used"] = time.time()
+                self.hits += 1
+                return path
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def add(self, key, layer_path):
+        path = self.entry_path(key)
+        with self._lock:
+            self.entries[key] = {
+                "layer": layer_path,
+                "size": os.path.getsize(path),
+                "last_used": time.time(),
+            }
+        return path
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits its
+        budget. Entries used since this cache was opened are kept."""
+        with self._lock:
+            total = sum(entry["size"] for entry in self.entries.values())
+            by_age = sorted(
+                self.entries.items(), key=lambda item: item[1]["last_used"]
+            )
+            for key, entry in by_age:
+                if total <= self.max_bytes:
+                    break
+                if entry["last_used"] >= self._session_start:
+                    break
+                try:
+                    os.remove(self.entry_path(key))
+                except OSError:
+                    pass
+                total -= entry["size"]
+                del self.entries[key]
+                logger.info(f"Evicted cached conversion of {entry['layer']}")
+
+    def save(self):
+        with self._lock:
+            tmp_path = self._index_path() + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self._index_path())
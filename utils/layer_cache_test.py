@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from usdchat.utils.layer_cache import LayerConversionCache
+
+
+class LayerConversionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_directory = os.path.join(self.directory, "cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def open_cache(self, max_bytes=1024, hash_content=False):
+        cache = LayerConversionCache(
+            self.cache_directory, max_bytes, hash_content=hash_content)
+        self.addCleanup(cache.close)
+        return cache
+
+    def write_layer(self, name, text, mtime=None):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(text)
+        if mtime is not None:
+            os.utime(path, ns=(mtime, mtime))
+        return path
+
+    def convert(self, cache, layer_path, text="#usda 1.0\n"):
+        key = cache.key_for(layer_path)
+        with open(cache.entry_path(key), "w") as f:
+            f.write(text)
+        cache.add(key, layer_path)
+        return key
+
+    def test_key_follows_size_and_mtime(self):
+        cache = self.open_cache()
+        layer = self.write_layer("a.usdc", "one", mtime=10**9)
+        key = cache.key_for(layer)
+        self.assertEqual(cache.key_for(layer), key)
+        os.utime(layer, ns=(2 * 10**9, 2 * 10**9))
+        self.assertNotEqual(cache.key_for(layer), key)
+        self.assertIsNone(cache.key_for(os.path.join(self.directory, "gone")))
+
+    def test_content_hash_tells_same_size_edits_apart(self):
+        layer = self.write_layer("a.usdc", "one", mtime=10**9)
+        cache = self.open_cache()
+        hashed = LayerConversionCache(
+            os.path.join(self.directory, "hashed"), 1024, hash_content=True)
+        self.addCleanup(hashed.close)
+        keys = (cache.key_for(layer), hashed.key_for(layer))
+        self.write_layer("a.usdc", "two", mtime=10**9)
+        self.assertEqual(cache.key_for(layer), keys[0])
+        self.assertNotEqual(hashed.key_for(layer), keys[1])
+
+    def test_lookup_after_reopen(self):
+        cache = self.open_cache()
+        layer = self.write_layer("a.usdc", "one")
+        key = self.convert(cache, layer)
+        self.assertIsNone(cache.lookup(cache.key_for(
+            self.write_layer("b.usdc", "two"))))
+        cache.save()
+        cache.close()
+
+        cache = self.open_cache()
+        self.assertEqual(cache.lookup(key), cache.entry_path(key))
+        os.remove(cache.entry_path(key))
+        self.assertIsNone(cache.lookup(key))
+        self.assertNotIn(key, cache.entries)
+
+    def test_evicts_least_recently_used_from_earlier_sessions(self):
+        cache = self.open_cache(max_bytes=100)
+        keys = [
+            self.convert(
+                cache, self.write_layer(f"{idx}.usdc", str(idx)), "x" * 40)
+            for idx in range(3)
+        ]
+        for age, key in enumerate(keys):
+            cache.entries[key]["last_used"] = age
+        cache.save()
+        cache.close()
+
+        cache = self.open_cache(max_bytes=100)
+        cache.evict()
+        self.assertEqual(set(cache.entries), set(keys[1:]))
+        self.assertFalse(os.path.exists(cache.entry_path(keys[0])))
+
+        cache.max_bytes = 0
+        cache.lookup(keys[2])
+        cache.evict()
+        self.assertEqual(set(cache.entries), {keys[2]})
+
+    def test_folder_is_locked_until_closed(self):
+        cache = self.open_cache()
+        with self.assertRaises(BlockingIOError):
+            LayerConversionCache(self.cache_directory, 1024)
+        cache.close()
+        self.open_cache()
+
+
+if __name__ == "__main__":
+    unittest.main()
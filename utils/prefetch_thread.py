@@ -0,0 +1,30 @@
+from PySide6.QtCore import QThread
+
+
+class PrefetchThread(QThread):
+    """Retrieves context for a question while it is still being typed, so
+    the results are ready when it is sent."""
+
+    def __init__(self, retrieve, key, query_text, n_results, query_layers,
+                 results):
+        super().__init__()
+        self.stop_flag = False
+        self.retrieve = retrieve
+        self.key = key
+        self.query_text = query_text
+        self.n_results = n_results
+        self.query_layers = query_layers
+        self.results = results
+
+    def run(self):
+        if self.stop_flag:
+            return
+        query_results = self.retrieve(
+            self.query_text, self.n_results, self.query_layers)
+        # The text changed while retrieving, nobody will ask for this.
+        if self.stop_flag:
+            return
+        self.results.put(self.key, query_results)
+
+    def stop(self):
+        self.stop_flag = True
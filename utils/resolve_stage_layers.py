@@ -1,22 +1,32 @@
+import atexit
+import hashlib
 import logging
 import os
+import shutil
 import subprocess
 import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from pxr import Sdf, Usd
+from pxr import Sdf, Usd, UsdUtils
+
+from usdchat.config.config import Config
+from usdchat.utils.layer_cache import LayerConversionCache
 
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+layer_export_workers = Config.LAYER_EXPORT_WORKERS
+include_unloaded_payloads = Config.INCLUDE_UNLOADED_PAYLOADS
+
 
 def collect_layer_paths_from_prim(prim):
     """Collects all unique layer paths from a given prim."""
     return {prim_spec.layer.realPath for prim_spec in prim.GetPrimStack()}
 
 
-def collect_all_layer_paths(stage):
+def collect_all_layer_paths_by_traversal(stage):
     """Collects all unique layer paths from all prims in a given stage."""
     return {
         layer_path
@@ -25,61 +35,241 @@ def collect_all_layer_paths(stage):
     }
 
 
-def convert_to_ascii(layer_path, tmp_dir, conversion_dict):
-    """Converts a given USD file to ASCII using usdcat if it's not already in ASCII."""
-    output_path = os.path.join(tmp_dir, os.path.basename(layer_path))
-    if output_path.endswith(".usdc") or output_path.endswith(".usdz"):
-        output_path = output_path.rsplit(".", 1)[0] + ".usda"
+def collect_all_layer_paths(
+        stage,
+        include_unloaded_payloads=include_unloaded_payloads):
+    """Collects all unique layer paths a stage depends on without visiting
+    its prims.
+
+    The layers come from the stage's composition (layer stacks, references,
+    loaded payloads and value clips). With include_unloaded_payloads the
+    asset dependencies of the root layer are walked as well, which adds
+    layers behind unloaded payloads and unselected variants.
+    """
+    layer_paths = {
+        layer.realPath
+        for layer in stage.GetUsedLayers(includeClipLayers=True)
+        if layer.realPath
+    }
+    if include_unloaded_payloads:
+        layers, _, unresolved_paths = UsdUtils.ComputeAllDependencies(
+            stage.GetRootLayer().identifier
+        )
+        layer_paths.update(layer.realPath for layer in layers if layer.realPath)
+        for path in unresolved_paths:
+            logger.warning(f"Unresolved asset path: {path}")
+    return layer_paths
+
+
+def collect_variant_layer_paths(stage):
+    """Collects the layers behind every variant of every variant set.
+
+    Each variant is selected in turn through the session layer, so the
+    authored selections in the stage's layers are left untouched.
+    Variant sets that only appear under a non-default selection of
+    another variant set are not enumerated.
+    """
+    layer_paths = set()
+    session_layer = stage.GetSessionLayer()
+    variant_prim_paths = [
+        prim.GetPath() for prim in stage.Traverse() if prim.HasVariantSets()
+    ]
+    for prim_path in variant_prim_paths:
+        prim = stage.GetPrimAtPath(prim_path)
+        if not prim:
+            continue
+        variant_sets = prim.GetVariantSets()
+        for set_name in variant_sets.GetNames():
+            variant_set = variant_sets.GetVariantSet(set_name)
+            for variant_name in variant_set.GetVariantNames():
+                with Usd.EditContext(stage, session_layer):
+                    variant_set.SetVariantSelection(variant_name)
+                layer_paths.update(
+                    layer.realPath
+                    for layer in stage.GetUsedLayers(includeClipLayers=True)
+                    if layer.realPath
+                )
+            with Usd.EditContext(stage, session_layer):
+                variant_set.ClearVariantSelection()
+    return layer_paths
+
+
+def open_stage_for_embedding(filepath, load_mode="all", load_paths=None):
+    """Opens the stage to embed.
+
+    load_mode "all" loads every payload. "none" opens the stage with
+    Usd.Stage.LoadNone; when load_paths are given only those prim subtrees
+    are populated and loaded.
+    """
+    if load_mode != "none":
+        return Usd.Stage.Open(filepath)
+
+    if not load_paths:
+        return Usd.Stage.Open(filepath, Usd.Stage.LoadNone)
+
+    mask = Usd.StagePopulationMask()
+    for path in load_paths:
+        mask.Add(Sdf.Path(path))
+    stage = Usd.Stage.OpenMasked(filepath, mask, Usd.Stage.LoadNone)
+    for path in load_paths:
+        if stage.GetPrimAtPath(path):
+            stage.Load(path)
+        else:
+            logger.warning(f"No prim at {path} to load.")
+    return stage
+
+
+def ascii_output_path(layer_path, tmp_dir):
+    """Named by a hash of the full path, layers with the same file name in
+    different directories share tmp_dir."""
+    stem = os.path.splitext(os.path.basename(layer_path))[0]
+    digest = hashlib.blake2b(
+        os.path.abspath(layer_path).encode("utf-8"), digest_size=8).hexdigest()
+    return os.path.join(tmp_dir, f"{stem}_{digest}.usda")
+
+
+def export_layer_to_ascii(layer, output_path):
+    """Writes an already opened layer as USDA text in process, the .usda
+    extension of output_path selects the text file format."""
+    return bool(layer.Export(output_path))
+
+
+def convert_with_usdcat(layer_path, output_path):
+    result = subprocess.run(["usdcat", "-o", output_path, layer_path])
+    return result.returncode == 0
+
+
+def convert_to_ascii(layer_path, tmp_dir, conversion_dict, cache=None):
+    """Converts a given USD file to ASCII if it's not already in ASCII.
+
+    Conversions are reused from the cache when the layer hasn't changed.
+    Otherwise the layer is exported in process from the opened Sdf.Layer,
+    usdcat is only spawned when that export fails.
+    """
+    if layer_path.endswith(".usda"):
+        logger.info(f"{layer_path} is already in ASCII format.")
+        return
+
+    key = cache.key_for(layer_path) if cache else None
+    if key:
+        cached_path = cache.lookup(key)
+        if cached_path:
+            logger.info(f"Reusing cached ASCII conversion of {layer_path}")
+            conversion_dict[layer_path] = cached_path
+            return
+        output_path = cache.entry_path(key)
+    else:
+        output_path = ascii_output_path(layer_path, tmp_dir)
 
     layer = Sdf.Layer.FindOrOpen(layer_path)
-    if layer and not layer_path.endswith(".usda"):
-        logger.info(f"Converting {layer_path} to ASCII...")
-        subprocess.run(["usdcat", "-o", output_path, layer_path])
+    if not layer:
+        logger.info(f"{layer_path} couldn't be opened.")
+        return
+
+    logger.info(f"Converting {layer_path} to ASCII...")
+    try:
+        exported = export_layer_to_ascii(layer, output_path)
+    except Exception as e:
+        logger.warning(f"In-process export of {layer_path} failed: {e}")
+        exported = False
+    if not exported:
+        logger.info(f"Falling back to usdcat for {layer_path}")
+        exported = convert_with_usdcat(layer_path, output_path)
+    if exported:
+        if key:
+            cache.add(key, layer_path)
         conversion_dict[layer_path] = output_path
-    else:
-        logger.info(
-            f"{layer_path} is already in ASCII format or couldn't be opened.")
 
 
-def resolve_all_layers(
+def open_layer_cache(config):
+    directory = config.LAYER_CACHE_DIRECTORY or os.path.join(
+        config.WORKING_DIRECTORY, "usdchat_layer_cache"
+    )
+    return LayerConversionCache(
+        directory,
+        max_bytes=config.LAYER_CACHE_MAX_BYTES,
+        hash_content=config.LAYER_CACHE_HASH_CONTENT,
+    )
+
+
+class StageLayers(list):
+    """Sorted layer paths of a stage. Also holds the stage's opened layers,
+    so converting them reuses what the stage already read instead of
+    reading every file again."""
+
+    def __init__(self, layer_paths, layers):
+        super().__init__(sorted(layer_paths))
+        self.layers = layers
+
+
+def collect_stage_layers(
     filepath,
-    signal_progress_update,
-    progress_range=(
-        0,
-        20)):
-    """Main function to collect and print all unique layer paths from a USD stage."""
-    stage = Usd.Stage.Open(filepath)
-    all_layer_paths = collect_all_layer_paths(stage)
+    config=None,
+    load_mode="all",
+    load_paths=None,
+    include_all_variants=False,
+):
+    """Returns the sorted paths of every layer the stage at filepath is
+    composed from, as StageLayers.
 
-    tmp_dir = tempfile.mkdtemp(prefix="usd_ascii_")
-    logger.info(f"Temporary directory created: {tmp_dir}")
+    load_mode and load_paths control which payloads are loaded (see
+    open_stage_for_embedding), include_all_variants adds the layers behind
+    non-selected variants.
+    """
+    config = config or Config
+    stage = open_stage_for_embedding(filepath, load_mode, load_paths)
+    all_layer_paths = collect_all_layer_paths(
+        stage, config.INCLUDE_UNLOADED_PAYLOADS)
+    if include_all_variants:
+        all_layer_paths |= collect_variant_layer_paths(stage)
+    # The stage still has them open, so this only takes a reference.
+    layers = [
+        Sdf.Layer.FindOrOpen(layer_path) for layer_path in all_layer_paths]
+    return StageLayers(all_layer_paths, [layer for layer in layers if layer])
 
-    conversion_dict = {}
-    total_layers = len(all_layer_paths)
-    logger.info(f"All collected layers ({total_layers}):")
-    processed_layers = 0
-    for layer_path in all_layer_paths:
-        logger.info(layer_path)
-        convert_to_ascii(layer_path, tmp_dir, conversion_dict)
-
-        # Update progress
-        processed_layers += 1
-        progress_percentage = int(
-            progress_range[0]
-            + (
-                (processed_layers / total_layers)
-                * (progress_range[1] - progress_range[0])
-            )
-        )
-        signal_progress_update.emit(
-            progress_percentage,
-            f"Resolving Stage: {processed_layers}/{total_layers} layers ({progress_percentage}%)",
-        )
 
-    final_paths = [conversion_dict.get(path, path) for path in all_layer_paths]
+def iter_converted_layers(layer_paths, workers=layer_export_workers, config=None):
+    """Converts layers to USDA on a thread pool and yields (layer_path,
+    ascii_path) as each conversion finishes. Closing the generator early
+    cancels the conversions that haven't started.
 
-    logger.info(f"\nFinal paths ({len(final_paths)}):")
-    for path in final_paths:
-        logger.info(path)
+    When another update holds the conversion cache, layers are converted
+    without it into a folder that is removed when the process exits."""
+    try:
+        cache = open_layer_cache(config or Config)
+    except BlockingIOError:
+        cache = None
+        tmp_dir = tempfile.mkdtemp(prefix="usdchat_layers_")
+        # Converted files are read after this generator ends, so they
+        # can't be removed in its finally.
+        atexit.register(shutil.rmtree, tmp_dir, True)
+        logger.warning(
+            f"Layer conversion cache is in use by another update, "
+            f"converting into {tmp_dir}"
+        )
+    else:
+        tmp_dir = os.path.join(cache.directory, "uncached")
+        os.makedirs(tmp_dir, exist_ok=True)
+        logger.info(f"Layer conversion cache: {cache.directory}")
 
-    return final_paths
+    conversion_dict = {}
+    executor = ThreadPoolExecutor(max_workers=workers or None)
+    futures = {
+        executor.submit(
+            convert_to_ascii, layer_path, tmp_dir, conversion_dict, cache
+        ): layer_path
+        for layer_path in layer_paths
+    }
+    try:
+        for future in as_completed(futures):
+            future.result()
+            layer_path = futures[future]
+            yield layer_path, conversion_dict.get(layer_path, layer_path)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        if cache is not None:
+            cache.evict()
+            cache.save()
+            cache.close()
+            logger.info(
+                f"Layer cache hits: {cache.hits}, conversions: {cache.misses}")
@@ -0,0 +1,86 @@
+import logging
+import threading
+from typing import Dict, List, Sequence
+
+import tiktoken
+
+from usdchat.config.config import Config
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+tokenizer_model = Config.TOKENIZER_MODEL
+fallback_encoding = "cl100k_base"
+default_block_size = 4096
+
+_tokenizers: Dict[str, tiktoken.Encoding] = {}
+_tokenizers_lock = threading.Lock()
+
+
+def get_tokenizer(model: str = tokenizer_model) -> tiktoken.Encoding:
+    """Returns the shared tiktoken encoding for a model, loading it only once."""
+    encoding = _tokenizers.get(model)
+    if encoding is not None:
+        return encoding
+
+    with _tokenizers_lock:
+        encoding = _tokenizers.get(model)
+        if encoding is None:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                logger.warning(
+                    f"No tokenizer registered for {model}, using {fallback_encoding}."
+                )
+                encoding = tiktoken.get_encoding(fallback_encoding)
+            _tokenizers[model] = encoding
+    return encoding
+
+
+def num_tokens_from_text(text: str, model: str = tokenizer_model) -> int:
+    return len(get_tokenizer(model).encode_ordinary(text))
+
+
+def num_tokens_from_texts(
+    texts: Sequence[str],
+    model: str = tokenizer_model,
+    block_size: int = default_block_size,
+) -> List[int]:
+    """Counts tokens for many texts at once using batched encoding."""
+    encoding = get_tokenizer(model)
+    counts = [0] * len(texts)
+    for start in range(0, len(texts), block_size):
+        block = texts[start: start + block_size]
+        pending = [idx for idx, text in enumerate(block) if text]
+        if not pending:
+            continue
+        encoded = encoding.encode_ordinary_batch([block[idx] for idx in pending])
+        for idx, tokens in zip(pending, encoded):
+            counts[start + idx] = len(tokens)
+    return counts
+
+
+def find_texts_over_token_limit(
+    texts: Sequence[str],
+    max_tokens: int,
+    model: str = tokenizer_model,
+    block_size: int = default_block_size,
+) -> List[int]:
+    """Returns the indices of texts that encode to more than max_tokens.
+
+    A token always spans at least one UTF-8 byte, so texts whose byte length
+    is within the limit are accepted without reaching the encoder.
+    """
+    candidates = [
+        idx
+        for idx, text in enumerate(texts)
+        if len(text) * 4 > max_tokens and len(text.encode("utf-8")) > max_tokens
+    ]
+    if not candidates:
+        return []
+
+    counts = num_tokens_from_texts(
+        [texts[idx] for idx in candidates], model, block_size)
+    return [idx for idx, count in zip(candidates, counts) if count > max_tokens]
@@ -0,0 +1,415 @@
+import logging
+import re
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from usdchat.config.config import Config
+from usdchat.utils.array_summary import summarize_arrays
+from usdchat.utils.tokenizer_registry import (get_tokenizer,
+                                              num_tokens_from_texts)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+tokenizer_model = Config.TOKENIZER_MODEL
+max_embedding_tokens = Config.MAX_EMBEDDING_TOKENS
+summarize_arrays_enabled = Config.SUMMARIZE_ARRAYS
+line_block_size = 4096
+
+PRIM_HEADER_PATTERN = re.compile(
+    r'^(def|over|class)\b(?:\s+([\w:]+))?\s*"([^"]*)"')
+VARIANT_SET_PATTERN = re.compile(r'^variantSet\s+"([^"]*)"')
+VARIANT_PATTERN = re.compile(r'^"([^"]*)"')
+
+
+class Chunk(NamedTuple):
+    text: str
+    prim_path: str
+    start_line: int
+    end_line: int
+    source: str = ""
+
+
+class _Scope:
+    """An open prim, variant or dictionary body together with the lines not
+    yet emitted for it."""
+
+    def __init__(self, path, context="", context_tokens=0, variant_set=None):
+        self.path = path
+        self.context = context
+        self.context_tokens = context_tokens
+        self.variant_set = variant_set
+        self.lines: List[Tuple[int, str]] = []
+        self.tokens = 0
+        self.has_content = False
+        self.split = False
+
+    def take(self):
+        lines, self.lines = self.lines, []
+        self.tokens = 0
+        self.has_content = False
+        return lines
+
+
+class UsdaChunker:
+    """Packs the prims of a USDA layer into chunks of at most max_tokens.
+
+    Lines are consumed as a stream: whole prims are kept together while they
+    fit in the budget, oversized prims are split between their properties and
+    children, and only the unflushed lines of the currently open scopes are
+    held in memory. Variant sets, variants and dictionary values such as
+    timeSamples are scopes too, so they split between their entries. Only a
+    single line over the budget is cut between tokens.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = max_embedding_tokens,
+        model: str = tokenizer_model,
+        source: str = "",
+        summarize: bool = summarize_arrays_enabled,
+    ):
+        self.max_tokens = max_tokens
+        self.model = model
+        self.source = source
+        self.summarize = summarize
+        self._stack = [_Scope("/")]
+        self._statement: List[Tuple[int, str]] = []
+        self._statement_tokens = 0
+        self._statement_open = False
+        self._statement_head = ""
+        self._statement_opens_body = False
+        self._depth = 0
+        self._braces = 0
+        self._quote: Optional[str] = None
+        self._ready: List[Chunk] = []
+        # Headers of split scopes, emitted with the next chunk.
+        self._carry: List[Tuple[int, str]] = []
+        self._carry_tokens = 0
+        self._carry_path = ""
+
+    def chunk_lines(self, lines: Iterable[str]) -> Iterator[Chunk]:
+        block = []
+        line_number = 0
+        for line in lines:
+            block.append(line.rstrip("\r\n"))
+            if len(block) >= line_block_size:
+                yield from self._feed_block(block, line_number)
+                line_number += len(block)
+                block = []
+        if block:
+            yield from self._feed_block(block, line_number)
+        yield from self.finish()
+
+    def finish(self) -> Iterator[Chunk]:
+        if self._statement_open:
+            self._end_statement()
+        while len(self._stack) > 1:
+            self._close_scope(None)
+        self._flush(self._stack[0])
+        if self._carry:
+            self._emit(self._carry_path, [], tokens=0)
+        yield from self._drain()
+
+    def _feed_block(self, block, first_line_number):
+        if self.summarize:
+            block = [summarize_arrays(line) for line in block]
+        counts = num_tokens_from_texts(block, self.model)
+        for offset, (line, tokens) in enumerate(zip(block, counts)):
+            self._feed_line(first_line_number + offset + 1, line, tokens + 1)
+        return self._drain()
+
+    def _drain(self):
+        ready, self._ready = self._ready, []
+        return iter(ready)
+
+    def _feed_line(self, line_number, line, tokens):
+        stripped = line.strip()
+        # Lines of a statement that spilled keep continuing it.
+        if not self._statement_open and not self._quote:
+            if not stripped:
+                return
+            if stripped.startswith("}"):
+                self._close_scope((line_number, line), tokens)
+                return
+            self._statement_open = True
+            self._statement_head = stripped
+            # Prim and variant headers continue until their body brace.
+            self._statement_opens_body = bool(
+                PRIM_HEADER_PATTERN.match(stripped)
+                or (self._stack[-1].variant_set is not None
+                    and VARIANT_PATTERN.match(stripped))
+            )
+
+        self._statement.append((line_number, line))
+        self._statement_tokens += tokens
+        brace = self._scan_line(line)
+
+        if brace >= 0 and line[brace] == "{":
+            # A body that also closes on this line leaves nothing open.
+            closed = self._scan_line(line, brace + 1, in_body=True) >= 0
+            self._open_scope()
+            if closed:
+                self._close_scope(None)
+        elif brace >= 0:
+            self._end_statement()
+            self._close_scope(None)
+        elif not self._quote and self._depth <= 0 and self._braces <= 0:
+            if not self._statement_opens_body:
+                self._end_statement()
+        elif self._statement_tokens > self.max_tokens:
+            # Spill statements that keep growing past the budget so that a
+            # single huge value never has to be held in memory whole.
+            self._flush_ancestors(len(self._stack))
+            self._emit_oversized(self._stack[-1], self._statement)
+            self._statement = []
+            self._statement_tokens = 0
+
+    def _scan_line(self, line, start=0, in_body=False):
+        """Tracks nesting across the line from start and returns the index of
+        a brace that opens a body or closes the current one, otherwise -1.
+        In a body braces only nest until the one that closes it."""
+        i = start
+        n = len(line)
+        while i < n:
+            if self._quote:
+                end = line.find(self._quote, i)
+                if end < 0:
+                    return -1
+                i = end + len(self._quote)
+                self._quote = None
+                continue
+            ch = line[i]
+            if ch == "#":
+                return -1
+            if ch in "\"'":
+                if line.startswith(ch * 3, i):
+                    self._quote = ch * 3
+                    i += 3
+                    continue
+                i = _skip_quoted(line, i, ch)
+                continue
+            if ch == "@":
+                delimiter = "@@@" if line.startswith("@@@", i) else "@"
+                end = line.find(delimiter, i + len(delimiter))
+                i = n if end < 0 else end + len(delimiter)
+                continue
+            if ch == "<":
+                end = line.find(">", i + 1)
+                i = n if end < 0 else end + 1
+                continue
+            if ch in "([":
+                self._depth += 1
+            elif ch in ")]":
+                self._depth -= 1
+            elif ch == "{":
+                if not in_body and self._depth <= 0 and self._braces <= 0:
+                    return i
+                self._braces += 1
+            elif ch == "}":
+                if self._braces <= 0:
+                    return i
+                self._braces -= 1
+            i += 1
+        return -1
+
+    def _reset_statement(self):
+        self._statement = []
+        self._statement_tokens = 0
+        self._statement_open = False
+        self._statement_head = ""
+        self._statement_opens_body = False
+        self._depth = 0
+        self._braces = 0
+
+    def _end_statement(self):
+        lines, tokens = self._statement, self._statement_tokens
+        self._reset_statement()
+        if lines:
+            self._add_unit(len(self._stack) - 1, lines, tokens)
+
+    def _open_scope(self):
+        header, tokens = self._statement, self._statement_tokens
+        head = self._statement_head
+        self._reset_statement()
+
+        parent = self._stack[-1]
+        variant_set = None
+        prim = PRIM_HEADER_PATTERN.match(head)
+        variant = VARIANT_PATTERN.match(head)
+        if prim:
+            # Prims inside a variant follow the selection without a slash.
+            separator = "" if parent.path.endswith("}") else "/"
+            path = f"{parent.path.rstrip('/')}{separator}{prim.group(3)}"
+            context = prim.group(0)
+        elif parent.variant_set is not None and variant:
+            path = f"{parent.path}{{{parent.variant_set}={variant.group(1)}}}"
+            context = head.split("{", 1)[0].strip()
+        else:
+            # Variant sets and dictionary values belong to the prim.
+            path = parent.path
+            context = head.split("{", 1)[0].strip()
+            match = VARIANT_SET_PATTERN.match(head)
+            variant_set = match.group(1) if match else None
+        scope = _Scope(path, context, max(1, len(context) // 4), variant_set)
+        self._stack.append(scope)
+        if tokens > self.max_tokens:
+            self._flush_ancestors(len(self._stack) - 1)
+            self._emit_oversized(scope, header)
+            scope.split = True
+        else:
+            scope.lines = list(header)
+            scope.tokens = tokens
+            # Headers that author metadata are worth a chunk of their own.
+            scope.has_content = len(header) > 2
+
+    def _close_scope(self, closing_line, tokens=0):
+        if len(self._stack) == 1:
+            return
+        scope = self._stack[-1]
+        # A closing brace isn't worth going over the budget for.
+        if (
+            closing_line is not None
+            and not scope.split
+            and scope.tokens + tokens <= self.max_tokens
+        ):
+            scope.lines.append(closing_line)
+            scope.tokens += tokens
+        self._stack.pop()
+        if scope.split:
+            self._flush(scope)
+        elif scope.lines:
+            self._add_unit(len(self._stack) - 1, scope.lines, scope.tokens)
+
+    def _add_unit(self, index, lines, tokens):
+        scope = self._stack[index]
+        if tokens > self.max_tokens:
+            self._flush_ancestors(index + 1)
+            self._emit_oversized(scope, lines)
+            scope.split = True
+            return
+
+        if scope.lines and scope.tokens + tokens > self.max_tokens:
+            self._flush_ancestors(index + 1)
+        if not scope.lines and scope.split:
+            scope.tokens = scope.context_tokens
+        scope.lines.extend(lines)
+        scope.tokens += tokens
+        scope.has_content = True
+
+    def _flush_ancestors(self, stop):
+        """Flushes pending lines of the scopes below stop, outermost first,
+        so that chunks are emitted in file order."""
+        for scope in self._stack[:stop]:
+            if scope.has_content:
+                self._flush(scope)
+            elif scope.lines:
+                # Only the header is pending, it goes out with the first
+                # chunk of its children.
+                if not self._carry:
+                    self._carry_path = scope.path
+                self._carry_tokens += scope.tokens
+                self._carry.extend(scope.take())
+            scope.split = True
+
+    def _flush(self, scope):
+        if not scope.lines:
+            return
+        context = scope.context if scope.split else ""
+        tokens = scope.tokens
+        lines = scope.take()
+        scope.split = True
+        self._emit(scope.path, lines, context, tokens)
+
+    def _emit(self, path, lines, context="", tokens=0):
+        carried = []
+        if self._carry:
+            carry, self._carry = self._carry, []
+            carry_tokens, self._carry_tokens = self._carry_tokens, 0
+            if lines and carry_tokens + tokens <= self.max_tokens:
+                carried = carry
+            else:
+                self._ready.append(Chunk(
+                    "\n".join(text for _, text in carry), self._carry_path,
+                    carry[0][0], carry[-1][0], self.source))
+        if not lines:
+            return
+        texts = [text for _, text in carried + lines]
+        if context and not any(
+            text.strip().startswith(context)
+            for text in texts[: len(carried) + 1]
+        ):
+            texts.insert(len(carried), context)
+        lines = carried + lines
+        self._ready.append(
+            Chunk("\n".join(texts), path, lines[0][0], lines[-1][0], self.source)
+        )
+
+    def _emit_oversized(self, scope, lines):
+        """Packs lines into chunks between line boundaries. Only a line that
+        is over the budget by itself is cut between tokens."""
+        context = scope.context if scope.split else ""
+        budget = self.max_tokens - (scope.context_tokens if context else 0)
+        counts = num_tokens_from_texts([text for _, text in lines], self.model)
+        piece, piece_tokens = [], 0
+        for (line_number, text), tokens in zip(lines, counts):
+            tokens += 1
+            if piece and piece_tokens + tokens > budget:
+                self._emit(scope.path, piece, context, piece_tokens)
+                piece, piece_tokens = [], 0
+            if tokens > budget:
+                for part in _split_text(text, self.max_tokens, self.model):
+                    self._emit(
+                        scope.path, [(line_number, part)],
+                        tokens=self.max_tokens)
+                continue
+            piece.append((line_number, text))
+            piece_tokens += tokens
+        if piece:
+            self._emit(scope.path, piece, context, piece_tokens)
+
+
+def _skip_quoted(line, start, quote):
+    i = start + 1
+    n = len(line)
+    while i < n:
+        ch = line[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if ch == quote:
+            return i + 1
+        i += 1
+    return n
+
+
+def _split_text(text, max_tokens, model):
+    encoding = get_tokenizer(model)
+    tokens = encoding.encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return [text]
+    return [
+        encoding.decode(tokens[i: i + max_tokens])
+        for i in range(0, len(tokens), max_tokens)
+    ]
+
+
+def iter_usda_chunks(
+    lines: Iterable[str],
+    max_tokens: int = max_embedding_tokens,
+    model: str = tokenizer_model,
+    source: str = "",
+) -> Iterator[Chunk]:
+    return UsdaChunker(max_tokens, model, source).chunk_lines(lines)
+
+
+def split_usda_to_chunks(
+    text: str,
+    max_tokens: int = max_embedding_tokens,
+    model: str = tokenizer_model,
+) -> List[str]:
+    return [
+        chunk.text
+        for chunk in iter_usda_chunks(text.split("\n"), max_tokens, model)
+    ]
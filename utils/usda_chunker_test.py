@@ -0,0 +1,149 @@
+import unittest
+
+from usdchat.utils.usda_chunker import UsdaChunker
+
+ONE_LINE_BODY = '''#usda 1.0
+def Xform "World"
+{
+    def Xform "A" { double x = 1 }
+    def Xform "B"
+    {
+        double y = 2
+    }
+}
+def Xform "Other"
+{
+    double z = 3
+}
+'''
+
+NESTED_SCOPES = '''def Xform "World"
+{
+    def Xform "A" (
+        variants = {
+            string look = "red"
+        }
+        prepend variantSets = "look"
+    )
+    {
+        double3 xformOp:translate.timeSamples = {
+            0: (0, 0, 0),
+            1: (1, 1, 1),
+            2: (2, 2, 2),
+            3: (3, 3, 3),
+            4: (4, 4, 4),
+            5: (5, 5, 5),
+        }
+        variantSet "look" = {
+            "red" {
+                def Mesh "Body"
+                {
+                    color3f[] primvars:displayColor = [(1, 0, 0)]
+                }
+            }
+            "blue" (
+                doc = "blue look"
+            ) {
+                def Mesh "Body"
+                {
+                    color3f[] primvars:displayColor = [(0, 0, 1)]
+                }
+            }
+        }
+    }
+}
+'''
+
+
+def layer_text(prims):
+    lines = ["#usda 1.0", "(", '    defaultPrim = "World"', ")"]
+    lines += ['def Xform "World"', "{"]
+    for idx in range(prims):
+        lines += [
+            f'    def Cube "Cube_{idx}" (',
+            f'        doc = "cube number {idx}"',
+            "        customData = {",
+            f"            int index = {idx}",
+            "        }",
+            "    )",
+            "    {",
+            f"        double size = {idx}",
+            "        float3 xformOp:translate.timeSamples = {",
+            f"            0: ({idx}, 0, 0),",
+            f"            1: ({idx}, 1, 0),",
+            "        }",
+            "    }",
+        ]
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def chunk(text, max_tokens):
+    chunker = UsdaChunker(max_tokens, summarize=False)
+    return list(chunker.chunk_lines(text.split("\n")))
+
+
+class UsdaChunkerTest(unittest.TestCase):
+    def test_one_line_body_closes_its_scope(self):
+        chunks = chunk(ONE_LINE_BODY, 10)
+        paths = {c.prim_path for c in chunks}
+        self.assertNotIn("/World/A/B", paths)
+        self.assertNotIn("/World/Other", paths)
+        for text, path in (("double y", "/World/B"), ("double z", "/Other")):
+            self.assertEqual(
+                [c.prim_path for c in chunks if text in c.text], [path])
+
+    def test_variants_and_time_samples_split_between_entries(self):
+        source = [line.strip() for line in NESTED_SCOPES.split("\n")]
+        chunks = chunk(NESTED_SCOPES, 40)
+        for c in chunks:
+            for line in c.text.split("\n"):
+                # Whole source lines, or the header a split scope repeats.
+                self.assertTrue(
+                    any(text.startswith(line.strip()) for text in source),
+                    line,
+                )
+        paths = {c.prim_path for c in chunks}
+        self.assertIn("/World/A{look=red}", paths)
+        self.assertIn("/World/A{look=blue}", paths)
+
+    def test_every_line_is_kept(self):
+        text = layer_text(40)
+        for max_tokens in (254, 40):
+            with self.subTest(max_tokens=max_tokens):
+                chunked = {
+                    line
+                    for c in chunk(text, max_tokens)
+                    for line in c.text.split("\n")
+                }
+                missing = [
+                    line for line in text.split("\n")
+                    if line.strip() not in ("", "}", ")")
+                    and line not in chunked
+                ]
+                self.assertEqual(missing, [])
+
+    def test_only_a_line_over_the_budget_is_cut(self):
+        values = ", ".join(f"({idx}, {idx}, {idx})" for idx in range(200))
+        text = "\n".join([
+            'def Mesh "Big"',
+            "{",
+            "    double size = 1",
+            f"    point3f[] points = [{values}]",
+            "    double width = 2",
+            "}",
+        ])
+        chunks = chunk(text, 30)
+        self.assertGreater(len(chunks), 2)
+        self.assertTrue(
+            any(c.text.endswith("double size = 1") for c in chunks))
+        self.assertTrue(any("double width = 2" in c.text for c in chunks))
+        pieces = [c for c in chunks if c.start_line == 4]
+        self.assertEqual(
+            "".join(c.text for c in pieces),
+            f"    point3f[] points = [{values}]",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
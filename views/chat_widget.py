@@ -3,16 +3,19 @@ import os
 
 from pxr import Usd
 from PySide6.QtCore import QFile, QSize, Qt, QTextStream, QTimer, Signal
-from PySide6.QtWidgets import (QApplication, QFileDialog, QHBoxLayout,
-                               QPushButton, QScrollArea, QSizePolicy,
-                               QSpacerItem, QTextEdit, QVBoxLayout, QWidget)
+from PySide6.QtWidgets import (QApplication, QCheckBox, QFileDialog,
+                               QHBoxLayout, QLineEdit, QPushButton,
+                               QScrollArea, QSizePolicy, QSpacerItem,
+                               QTextEdit, QVBoxLayout, QWidget)
 
 from usdchat.chat_bot import Chat
 from usdchat.chat_bridge import ChatBridge
 from usdchat.services.chromadb_collections import ChromaDBCollections
 from usdchat.utils import chat_thread, embed_thread, process_code
+from usdchat.utils.resolve_stage_layers import collect_layer_paths_from_prim
 from usdchat.views.chat_bubble import ChatBubble
 from usdchat.views.chromadb_collections_ui import collections_frame
+from usdchat.views.rag_frame import LOAD_MODES
 from usdchat.views.welcome_screen import init_welcome_screen
 
 logging.basicConfig(
@@ -23,10 +26,24 @@ logger = logging.getLogger(__name__)
 
 
 class AutoResizingTextEdit(QTextEdit):
-    def __init__(self, parent=None):
+    # Emitted with the text once typing pauses for debounce_ms
+    signal_typing_paused = Signal(str)
+
+    def __init__(self, parent=None, debounce_ms=0):
         super().__init__(parent)
         self.parent_widget = parent
         self.setFixedHeight(self.fontMetrics().lineSpacing() + 20)
+        self.typing_timer = QTimer(self)
+        self.typing_timer.setSingleShot(True)
+        self.typing_timer.setInterval(debounce_ms)
+        self.typing_timer.timeout.connect(self.on_typing_paused)
+        if debounce_ms > 0:
+            self.textChanged.connect(self.typing_timer.start)
+
+    def on_typing_paused(self):
+        text = self.toPlainText().strip()
+        if text:
+            self.signal_typing_paused.emit(text)
 
     def keyPressEvent(self, event):
         super().keyPressEvent(event)
@@ -41,6 +58,7 @@ class AutoResizingTextEdit(QTextEdit):
             new_height = min(new_height, max_height)
             self.setFixedHeight(new_height)
         elif event.key() == Qt.Key_Return:
+            self.typing_timer.stop()
             if self.parent_widget:
                 self.reset_size()
                 self.parent_widget.submit_input()
@@ -78,6 +96,8 @@ class ChatBotUI(QWidget):
         self.rag_mode = True
         self.model_name = self.config.MODEL
         self.init_ui()
+        self.query_scope_key = None
+        self.query_scope = None
         self.chromadb_collections = ChromaDBCollections(config=self.config)
 
         self.init_welcome_screen = init_welcome_screen(self)
@@ -135,6 +155,7 @@ class ChatBotUI(QWidget):
             self.enable_embed_stage_button)
         self.mode_switcher.signalRagModeChanged.connect(
             self.handle_rag_mode_change)
+        self.user_input.signal_typing_paused.connect(self.prefetch_context)
         # self.signal_user_message.connect(self.settings_ui)
 
     def init_ui(self):
@@ -155,7 +176,8 @@ class ChatBotUI(QWidget):
 
         self.scroll_area_layout.addWidget(self.conversation_widget)
 
-        self.user_input = AutoResizingTextEdit(self)
+        self.user_input = AutoResizingTextEdit(
+            self, debounce_ms=self.config.PREFETCH_DEBOUNCE_MS)
         self.user_input.setObjectName("user_input")
         self.user_input.setPlaceholderText("Ask me anything...")
         self.user_input.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Fixed)
@@ -181,7 +203,26 @@ class ChatBotUI(QWidget):
 
         self.submit_button.clicked.connect(self.toggle_send_stop)
 
+        self.selection_scope_check_box = QCheckBox("🎯 Selected prims only")
+        self.selection_scope_check_box.setObjectName(
+            "selection_scope_check_box")
+        self.selection_scope_check_box.setEnabled(self.usdviewApi is not None)
+
+        self.layer_filter_line_edit = QLineEdit()
+        self.layer_filter_line_edit.setPlaceholderText(
+            "Only layers containing, e.g. assets/chair"
+        )
+        self.layer_filter_line_edit.setObjectName("layer_filter_line_edit")
+
+        self.scope_widget = QWidget()
+        scope_layout = QHBoxLayout(self.scope_widget)
+        scope_layout.setContentsMargins(0, 0, 0, 0)
+        scope_layout.addWidget(self.selection_scope_check_box)
+        scope_layout.addWidget(self.layer_filter_line_edit)
+        self.scope_widget.setVisible(self.rag_mode)
+
         self.main_layout.addWidget(self.scroll_area)
+        self.main_layout.addWidget(self.scope_widget)
         self.main_layout.addWidget(self.user_input)
         self.main_layout.addWidget(buttons_widget)
         self.setLayout(self.main_layout)
@@ -270,12 +311,63 @@ class ChatBotUI(QWidget):
         )
 
         if self.embed_stage_button.text() == "💿 Create Collection":
+            self.chat_bridge.embed_options = self.embed_options()
             self.signal_embed_stage.emit(self.embed_stage_path)
             self.enable_stop_embed_stage_button()
         else:
             self.chat_bridge.clean_up_thread()
             self.enable_embed_stage_button()
 
+    def embed_options(self):
+        load_mode_text = self.load_mode_combo_box.currentText()
+        load_paths = []
+        if load_mode_text == "Selected prims":
+            load_paths = self.load_paths_line_edit.text().split()
+            if not load_paths and self.usdviewApi:
+                load_paths = [
+                    str(path) for path in self.usdviewApi.selectedPaths]
+        return {
+            "load_mode": LOAD_MODES[load_mode_text],
+            "load_paths": load_paths,
+            "include_all_variants": self.all_variants_check_box.isChecked(),
+        }
+
+    def query_layers(self):
+        """Layers retrieval should be limited to, or None for the whole
+        collection. Kept until the selection, the layer filter or the
+        collection changes, walking the selected prims is slow."""
+        selected_paths = None
+        if self.selection_scope_check_box.isChecked() and self.usdviewApi:
+            selected_paths = tuple(
+                str(path) for path in self.usdviewApi.selectedPaths)
+        layer_filter = self.layer_filter_line_edit.text().strip()
+        scope_key = (
+            selected_paths,
+            layer_filter,
+            self.collection_name,
+            self.chromadb_collections.collection_version(self.collection_name),
+        )
+        if scope_key != self.query_scope_key:
+            self.query_scope = self.resolve_query_layers(
+                selected_paths is not None, layer_filter)
+            self.query_scope_key = scope_key
+        return self.query_scope
+
+    def resolve_query_layers(self, selection_only, layer_filter):
+        layers = None
+        if selection_only:
+            layers = set()
+            for prim in self.usdviewApi.selectedPrims:
+                for descendant in Usd.PrimRange(prim):
+                    layers |= collect_layer_paths_from_prim(descendant)
+        if layer_filter:
+            matching = set(
+                self.chromadb_collections.collection_layers(
+                    self.collection_name, layer_filter)
+            )
+            layers = matching if layers is None else layers & matching
+        return None if layers is None else sorted(layers)
+
     def handle_collection_change(self):
         self.collection_name = self.collection_combo_box.currentText()
         try:
@@ -283,9 +375,14 @@ class ChatBotUI(QWidget):
         except BaseException:
             pass
 
+    def prefetch_context(self, text):
+        if self.rag_mode:
+            self.chat_bridge.prefetch(text, self.query_layers())
+
     def handle_rag_mode_change(self, newRagMode):
         self.rag_mode = newRagMode
         self.chat_bridge.rag_mode = self.rag_mode
+        self.scope_widget.setVisible(self.rag_mode)
         self.hide_welcome_screen()
         self.scroll_area_layout.removeWidget(self.welcome_widget)
         init_welcome_screen(self)
@@ -406,6 +503,8 @@ class ChatBotUI(QWidget):
 
             self.user_input.clear()
             self.enable_stop_button()
+            if self.rag_mode:
+                self.chat_bridge.query_layers = self.query_layers()
             self.signal_user_message.emit(user_input)
 
         except Exception as e:
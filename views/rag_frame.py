@@ -1,8 +1,14 @@
 from PySide6.QtCore import Qt
-from PySide6.QtWidgets import (QComboBox, QFrame, QHBoxLayout, QLabel,
-                               QLineEdit, QProgressBar, QPushButton,
+from PySide6.QtWidgets import (QCheckBox, QComboBox, QFrame, QHBoxLayout,
+                               QLabel, QLineEdit, QProgressBar, QPushButton,
                                QSizePolicy, QVBoxLayout)
 
+LOAD_MODES = {
+    "All payloads": "all",
+    "No payloads": "none",
+    "Selected prims": "none",
+}
+
 
 def rag_frame(self, widget):
     rag_frame = QFrame(widget)
@@ -29,6 +35,32 @@ def rag_frame(self, widget):
     dir_layout.addWidget(self.working_dir_line_edit)
     dir_layout.addWidget(self.browse_button)
 
+    self.load_mode_combo_box = QComboBox()
+    self.load_mode_combo_box.setObjectName("load_mode_combo_box")
+    self.load_mode_combo_box.addItems(list(LOAD_MODES))
+    self.load_mode_combo_box.setFixedHeight(30)
+
+    self.load_paths_line_edit = QLineEdit()
+    self.load_paths_line_edit.setPlaceholderText(
+        "Prim paths to load, e.g. /World/Set /World/Chars"
+    )
+    self.load_paths_line_edit.setFixedHeight(30)
+    self.load_paths_line_edit.setObjectName("load_paths_line_edit")
+    self.load_paths_line_edit.setEnabled(False)
+    self.load_mode_combo_box.currentTextChanged.connect(
+        lambda text: self.load_paths_line_edit.setEnabled(
+            text == "Selected prims")
+    )
+
+    self.all_variants_check_box = QCheckBox("All variants")
+    self.all_variants_check_box.setObjectName("all_variants_check_box")
+
+    load_layout = QHBoxLayout()
+    load_layout.addWidget(QLabel("Load"))
+    load_layout.addWidget(self.load_mode_combo_box)
+    load_layout.addWidget(self.load_paths_line_edit)
+    load_layout.addWidget(self.all_variants_check_box)
+
     self.collection_name_label = QLabel("")
     self.collection_name_label.setVisible(False)
 
@@ -54,6 +86,7 @@ def rag_frame(self, widget):
     self.progress_layout.addWidget(self.progress_bar)
 
     rag_layout.addLayout(dir_layout)
+    rag_layout.addLayout(load_layout)
     rag_layout.addLayout(create_collection_layout)
 
     rag_layout.addLayout(self.progress_layout)